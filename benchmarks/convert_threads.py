@@ -0,0 +1,91 @@
+"""
+Conversion of the comments of each thread into <item> elements, one
+record at a time and with the dates and URLs of the thread computed as
+columns (comments per second), and the date conversion alone
+
+usage: python benchmarks/convert_threads.py [dump.zst] [repeat]
+"""
+
+import os
+import sys
+import time
+
+from collections import defaultdict
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from lxml.etree import Element  # noqa: E402
+
+from extractor import columns  # noqa: E402
+from extractor.columns import CommentColumns, format_dates  # noqa: E402
+from extractor.comment_tree import extract_comments  # noqa: E402
+from extractor.json2xml import create_comment_element  # noqa: E402
+
+DEFAULT_DUMP = os.path.join(
+    ROOT, "tests/files/GermanRap_comments_small/GermanRap_comments_small.zst"
+)
+
+
+def load_threads(zst_file):
+    threads = defaultdict(list)
+    for comment in extract_comments(zst_file):
+        threads[comment["link_id"][3:]].append(comment)
+    return list(threads.items())
+
+
+def per_record(threads):
+    for thread_id, comments in threads:
+        docmeta = {"thread_url": f"https://www.reddit.com/r/x/comments/{thread_id}/"}
+        comment_list = Element("list")
+        for comment in comments:
+            create_comment_element(comment_list, comment, docmeta)
+
+
+def by_columns(threads):
+    for thread_id, comments in threads:
+        docmeta = {"thread_url": f"https://www.reddit.com/r/x/comments/{thread_id}/"}
+        comment_list = Element("list")
+        thread_columns = CommentColumns(comments, docmeta["thread_url"])
+        for comment, (date, url) in zip(comments, thread_columns.rows()):
+            create_comment_element(comment_list, comment, docmeta, date=date, comment_url=url)
+
+
+def dates_per_record(timestamps):
+    return [
+        datetime.fromtimestamp(int(t), tz=timezone.utc).strftime("%Y-%m-%d") for t in timestamps
+    ]
+
+
+def measure(func, arg, repeat):
+    "Best time of repeat runs."
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(arg)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == "__main__":
+    dump = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_DUMP
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    threads = load_threads(dump)
+    count = sum(len(comments) for _, comments in threads)
+    print(f"{len(threads)} threads, {count} comments")
+    for name, func in (("per record", per_record), ("columns", by_columns)):
+        print(f"{name:<12} {count / measure(func, threads, repeat):12.0f} comments/s")
+
+    timestamps = [comment["created_utc"] for _, comments in threads for comment in comments]
+    print("dates:")
+    print(f"  {'per record':<12} {count / measure(dates_per_record, timestamps, repeat):12.0f}/s")
+    numpy = columns.np
+    columns.np = None
+    print(f"  {'day cache':<12} {count / measure(format_dates, timestamps, repeat):12.0f}/s")
+    columns.np = numpy
+    if numpy is not None:
+        min_batch = columns.NUMPY_MIN_BATCH
+        columns.NUMPY_MIN_BATCH = 0
+        print(f"  {'numpy':<12} {count / measure(format_dates, timestamps, repeat):12.0f}/s")
+        columns.NUMPY_MIN_BATCH = min_batch
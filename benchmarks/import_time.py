@@ -0,0 +1,41 @@
+"""
+Startup cost of the CLI and the converter modules,
+each measured in a fresh interpreter (median of several runs)
+
+usage: python benchmarks/import_time.py [runs]
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CASES = {
+    "interpreter": [sys.executable, "-c", "pass"],
+    "run.py --help": [sys.executable, "run.py", "--help"],
+    "import json2xml": [sys.executable, "-c", "import extractor.json2xml"],
+    "import json2xml + DTD": [
+        sys.executable,
+        "-c",
+        "import extractor.json2xml, extractor.validate as v; v.get_dtd()",
+    ],
+}
+
+
+def measure(command, runs):
+    "Median wall time of a command in milliseconds."
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=ROOT, check=True, stdout=subprocess.DEVNULL)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+if __name__ == "__main__":
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    for name, command in CASES.items():
+        print(f"{name:<24} {measure(command, runs):8.1f} ms")
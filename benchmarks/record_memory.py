@@ -0,0 +1,40 @@
+"""
+Memory of the comments buffered in grouped mode, as dicts and as compact
+records (bytes per comment, measured with tracemalloc)
+
+usage: python benchmarks/record_memory.py [dump.zst]
+"""
+
+import os
+import sys
+import tracemalloc
+
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from extractor.comment_tree import extract_comments  # noqa: E402
+from extractor.records import compact  # noqa: E402
+
+DEFAULT_DUMP = os.path.join(
+    ROOT, "tests/files/GermanRap_comments_small/GermanRap_comments_small.zst"
+)
+
+
+def grouped_size(zst_file, convert):
+    "Traced bytes of the grouped comments and their number."
+    tracemalloc.start()
+    thread_comments = defaultdict(list)
+    for comment in extract_comments(zst_file):
+        thread_comments[comment["link_id"][3:]].append(convert(comment))
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size, sum(len(comments) for comments in thread_comments.values())
+
+
+if __name__ == "__main__":
+    dump = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_DUMP
+    for name, convert in (("dict", lambda comment: comment), ("compact", compact)):
+        size, count = grouped_size(dump, convert)
+        print(f"{name:<8} {count} comments {size / count:8.0f} bytes/comment")
@@ -0,0 +1,72 @@
+"""
+Column view of a batch of comments for the TEI conversion: ids and
+timestamps as lists, with the derived fields (dates, comment URLs)
+computed once per batch instead of once per element.
+Dates go through a cache of the formatted days, for larger batches the
+day numbers are computed with NumPy if it is installed.
+"""
+
+from datetime import datetime, timezone
+
+try:
+    import numpy as np
+except ImportError:  # optional, the day cache is used instead
+    np = None
+
+SECONDS_PER_DAY = 86400
+NUMPY_MIN_BATCH = 1024  # smaller batches are faster without NumPy
+DAY_CACHE_SIZE = 100000  # max. days cached per process
+
+# day number since 1970-01-01 (UTC) -> "YYYY-MM-DD"
+day_cache = {}
+
+
+def format_day(day):
+    "Date of a day number (UTC), cached."
+    text = day_cache.get(day)
+    if text is None:
+        if len(day_cache) >= DAY_CACHE_SIZE:
+            day_cache.clear()
+        text = datetime.fromtimestamp(day * SECONDS_PER_DAY, tz=timezone.utc).strftime(
+            "%Y-%m-%d"
+        )
+        day_cache[day] = text
+    return text
+
+
+def format_dates(timestamps):
+    """Dates ("YYYY-MM-DD", UTC) of a list of Unix timestamps (int, float
+    or str, truncated to seconds as int() does). With NumPy, the day
+    numbers are computed at once and each distinct day is formatted once."""
+    seconds = [int(timestamp) for timestamp in timestamps]
+    if np is not None and len(seconds) >= NUMPY_MIN_BATCH:
+        days, index = np.unique(
+            np.array(seconds, dtype="int64") // SECONDS_PER_DAY, return_inverse=True
+        )
+        texts = [format_day(day) for day in days.tolist()]
+        return [texts[i] for i in index.tolist()]
+    return [format_day(second // SECONDS_PER_DAY) for second in seconds]
+
+
+class CommentColumns:
+    """Columns of a list of comments (dicts or compact records), the
+    URLs of the comments are built on the thread URL."""
+
+    __slots__ = ("ids", "created", "dates", "urls")
+
+    def __init__(self, comments, thread_url):
+        self.ids = [comment["id"] for comment in comments]
+        self.created = [comment["created_utc"] for comment in comments]
+        self.dates = format_dates(self.created)
+        self.urls = [f"{thread_url}comment/{comment_id}/" for comment_id in self.ids]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def rows(self):
+        "(date, url) of each comment, in order."
+        return zip(self.dates, self.urls)
+
+    def by_id(self):
+        "id -> (date, url), for the comments of a tree."
+        return dict(zip(self.ids, self.rows()))
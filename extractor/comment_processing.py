@@ -1,55 +1,416 @@
-import json
+import os
+import threading
+import time
 
-from .json2xml import json2xml
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from .json2xml import (
+    build_tei,
+    create_corpus_header,
+    part_suffix,
+    serialize_tei,
+    xml_filename,
+)
+from .json_archive import encode_json_file
+from .memory import peak_rss
+from .quarantine import quarantine_record, reason_code
+from .settings import CORPUS_MAX_BYTES, CORPUS_MAX_MEMBERS
+from .stats import CorpusStats
 from .utils import get_output_dir
 
 
-def process_single_comment(comment, json_output_dir, xml_output_dir):
-    """process single comment (--no-group)"""
+WRITER_THREADS = 4  # threads writing files in each worker
+WRITER_QUEUE_SIZE = 64  # max. files waiting to be written
+MAX_OPEN_FILES = 4  # max. files open at the same time in each worker
+
+
+class WriteError(Exception):
+    "Writing files failed for another reason than an OSError (a bug)."
+
+
+class AsyncWriter:
+    """Write finished files from a small thread pool, so that the
+    conversion of the next thread overlaps with the disk I/O.
+    submitted lists the paths in submission order, paths the files
+    actually written (in completion order)."""
+
+    def __init__(
+        self,
+        threads=WRITER_THREADS,
+        queue_size=WRITER_QUEUE_SIZE,
+        max_open_files=MAX_OPEN_FILES,
+    ):
+        self.errors = []  # (path, message) of OSErrors, quarantined
+        self.failures = []  # (path, exception) of other errors, raised by close
+        self.submitted = []
+        self.paths = []
+        self._executor = ThreadPoolExecutor(max_workers=threads)
+        self._pending = threading.BoundedSemaphore(queue_size)
+        self._open_files = threading.BoundedSemaphore(max_open_files)
+
+    def _write(self, path, data):
+        try:
+            with self._open_files, open(path, "wb") as outfile:
+                outfile.write(data)
+            self.paths.append(path)
+        except OSError as e:
+            self.errors.append((path, str(e)))
+        except Exception as e:
+            self.failures.append((path, e))
+        finally:
+            self._pending.release()
+
+    def submit(self, path, data):
+        "Queue data to be written to path, blocks while the queue is full."
+        self._pending.acquire()
+        self.submitted.append(path)
+        self._executor.submit(self._write, path, data)
+
+    def close(self):
+        """Wait for all pending writes and return the OSErrors,
+        raise WriteError if a write failed otherwise."""
+        self._executor.shutdown(wait=True)
+        if self.failures:
+            path, error = self.failures[0]
+            raise WriteError(
+                f"{len(self.failures)} file(s) not written, first {path}: {error!r}"
+            ) from error
+        return self.errors
+
+
+class CorpusWriter:
+    """Collect serialized <TEI> documents and write them as <teiCorpus> files
+    with a shared header, rolled over by member count or byte size.
+    With a stream (binary file object), the documents are written to it
+    one after another instead. fixed_dir: output_dir is the shard
+    directory assigned by the main process."""
+
+    def __init__(
+        self,
+        output_dir,
+        group_mode,
+        max_members=CORPUS_MAX_MEMBERS,
+        max_bytes=CORPUS_MAX_BYTES,
+        writer=None,
+        stream=None,
+        fixed_dir=False,
+    ):
+        self.output_dir = output_dir
+        self.fixed_dir = fixed_dir
+        self.group_mode = group_mode
+        self.max_members = max_members
+        self.max_bytes = max_bytes
+        self.writer = writer
+        self.stream = stream
+        self._reset()
+
+    def _reset(self):
+        self.members, self.size = [], 0
+        self.first_id = self.subreddit = None
+        self.first_date = self.last_date = None
+
+    def add(self, doc_id, tei_bytes, comment):
+        "Add a member document, comment provides subreddit and date."
+        date = datetime.fromtimestamp(int(comment["created_utc"]), tz=timezone.utc).date()
+        if not self.members:
+            self.first_id, self.subreddit = doc_id, comment["subreddit"]
+            self.first_date = self.last_date = date
+        self.first_date = min(self.first_date, date)
+        self.last_date = max(self.last_date, date)
+        self.members.append(tei_bytes)
+        self.size += len(tei_bytes)
+        if len(self.members) >= self.max_members or self.size >= self.max_bytes:
+            self.flush()
+
+    def flush(self):
+        "Write the collected members as one <teiCorpus> document."
+        if not self.members:
+            return
+        header = create_corpus_header(
+            self.subreddit,
+            self.group_mode,
+            len(self.members),
+            self.first_date,
+            self.last_date,
+        )
+        data = b"".join(
+            [
+                b'<teiCorpus xmlns="http://www.tei-c.org/ns/1.0">\n',
+                serialize_tei(header),
+                *self.members,
+                b"</teiCorpus>\n",
+            ]
+        )
+        if self.stream is not None:
+            self.stream.write(data)
+        else:
+            path = f"{output_subdir(self.output_dir, self.fixed_dir)}/corpus_{self.first_id}.xml"
+            write_file(path, data, self.writer)
+        self._reset()
+
+
+def make_corpus(options, xml_output_dir, group_mode, writer):
+    """CorpusWriter if the corpus output mode is selected in the options"""
+    if not options or not options.get("corpus"):
+        return None
+    max_members, max_bytes = options["corpus"]
+    return CorpusWriter(
+        xml_output_dir,
+        group_mode,
+        max_members,
+        max_bytes,
+        writer,
+        fixed_dir=bool(options.get("fixed_dirs")),
+    )
+
+
+def json_options(options):
+    """compression of the JSON archive: (json_zst, dictionary path)"""
+    if not options:
+        return False, None
+    return bool(options.get("json_zst")), options.get("json_dictionary")
+
+
+def fixed_dirs(options, *dirs):
+    """partitioned layout and updates: the directories are the shards assigned
+    to the batch by the main process, created here. Returns whether they are."""
+    if not options or not options.get("fixed_dirs"):
+        return False
+    for directory in dirs:
+        os.makedirs(directory, exist_ok=True)
+    return True
+
+
+def output_subdir(base_dir, fixed=False):
+    """directory for the next file: the assigned shard or the current
+    shard of base_dir"""
+    return base_dir if fixed else get_output_dir(base_dir)
+
+
+def write_file(path, data, writer=None):
+    """write data directly or hand it over to an AsyncWriter"""
+    if writer is not None:
+        writer.submit(path, data)
+        return
+    with open(path, "wb") as outfile:
+        outfile.write(data)
+
+
+def process_single_comment(
+    comment,
+    json_output_dir,
+    xml_output_dir,
+    writer=None,
+    corpus=None,
+    json_zst=False,
+    json_dictionary=None,
+    fixed=False,
+):
+    """process single comment (--no-group), returns a quarantine record or None.
+    With json_zst the JSON is written compressed (.json.zst), with fixed
+    the output directories are shards assigned by the main process."""
+    comment_id = comment.get("id")
     try:
-        comment_id = comment["id"]
         link_id = comment["link_id"].replace("t3_", "")
 
         # save JSON
-        json_subdir = get_output_dir(json_output_dir)
-        json_filename = f"{json_subdir}/{link_id}_{comment_id}.json"
-        with open(json_filename, "w", encoding="utf-8") as outfile:
-            json.dump([comment], outfile, indent=4)
+        json_subdir = output_subdir(json_output_dir, fixed)
+        json_filename, data = encode_json_file(
+            f"{json_subdir}/{link_id}_{comment_id}", [comment], json_zst, json_dictionary
+        )
+        write_file(json_filename, data, writer)
 
         # convert JSON to XML
-        xml_subdir = get_output_dir(xml_output_dir)
-        json2xml(json_filename, output_dir=xml_subdir, link_id=link_id, comment_id=comment_id, group_mode=False)
+        teidoc, post_id = build_tei([comment], link_id=link_id, group_mode=False)
+        if corpus is not None:
+            corpus.add(f"{link_id}_{comment_id}", serialize_tei(teidoc), comment)
+            return None
+        xml_subdir = output_subdir(xml_output_dir, fixed)
+        filename = xml_filename(xml_subdir, post_id, link_id, comment_id, group_mode=False)
+        write_file(filename, serialize_tei(teidoc), writer)
     except Exception as e:
-        print(f"Error processing comment {comment_id}: {e}")
+        return quarantine_record(
+            "convert",
+            reason_code(e),
+            comment,
+            f"Error processing comment {comment_id}: {e}",
+        )
+    return None
 
 
-def process_thread(thread_id, comments_list, json_output_dir, xml_output_dir):
-    """process a single thread (group)"""
+def process_thread(
+    thread_id,
+    comments_list,
+    json_output_dir,
+    xml_output_dir,
+    writer=None,
+    part=None,
+    corpus=None,
+    tree_structure=False,
+    json_zst=False,
+    json_dictionary=None,
+    fixed=False,
+):
+    """process a single thread (group), returns a quarantine record or None.
+    part is (number, total, last comment of the thread) for split threads,
+    with json_zst the JSON is written compressed (.json.zst), with fixed
+    the output directories are shards assigned by the main process."""
     try:
+        number_of = part[:2] if part else None
         # save JSON
-        json_subdir = get_output_dir(json_output_dir)
-        json_filename = f"{json_subdir}/{thread_id}_flat.json"
-        with open(json_filename, "w", encoding="utf-8") as outfile:
-            json.dump(comments_list, outfile, indent=4)
+        json_subdir = output_subdir(json_output_dir, fixed)
+        json_filename, data = encode_json_file(
+            f"{json_subdir}/{thread_id}{part_suffix(number_of)}_flat",
+            comments_list,
+            json_zst,
+            json_dictionary,
+        )
+        write_file(json_filename, data, writer)
 
         # convert JSON to XML
-        xml_subdir = get_output_dir(xml_output_dir)
-        json2xml(json_filename, output_dir=xml_subdir, link_id=thread_id, group_mode=True)
+        last_comment = part[2] if part else comments_list[-1]
+        teidoc, post_id = build_tei(
+            comments_list,
+            link_id=thread_id,
+            group_mode=True,
+            part=number_of,
+            last_comment=last_comment,
+            tree_structure=tree_structure,
+        )
+        if corpus is not None:
+            doc_id = f"{thread_id}{part_suffix(number_of)}"
+            corpus.add(doc_id, serialize_tei(teidoc), last_comment)
+            return None
+        xml_subdir = output_subdir(xml_output_dir, fixed)
+        filename = xml_filename(xml_subdir, post_id, part=number_of)
+        write_file(filename, serialize_tei(teidoc), writer)
     except Exception as e:
-        print(f"Error processing thread {thread_id}: {e}")
+        return quarantine_record(
+            "convert",
+            reason_code(e),
+            comments_list,
+            f"Error processing thread {thread_id}: {e}",
+        )
+    return None
 
 
-def process_comment_batch(comment_batch, json_output_dir, xml_output_dir):
+def collect_stats(options, converted):
+    """statistics of the converted comments (lists of comments), if enabled"""
+    if not options or not options.get("stats"):
+        return None
+    stats = CorpusStats()
+    for comments in converted:
+        for comment in comments:
+            stats.add(comment)
+    return stats
+
+
+def written_files(options, keys, results, writer, marks):
+    """updates: (key, paths) of the files written for each successful item
+    whose files were all written (after writer.close()), marks are the
+    number of paths submitted before each item"""
+    if not options or not options.get("update"):
+        return None
+    ends = marks[1:] + [len(writer.submitted)]
+    done = set(writer.paths)
+    written = []
+    for key, start, end, error in zip(keys, marks, ends, results):
+        paths = writer.submitted[start:end]
+        if not error and all(path in done for path in paths):
+            written.append((key, paths))
+    return written
+
+
+def batch_result(results, write_errors, start, stats=None, written=None):
+    """batch result: error messages and quarantine records of failed
+    conversions and writes, time spent, peak RSS of the worker,
+    statistics (if collected), files written per item (updates only)"""
+    failed = [record for record in results if record]
+    failed.extend(
+        quarantine_record("write", "io_error", error=f"Error writing {path}: {e}", path=path)
+        for path, e in write_errors
+    )
+    return {
+        "errors": [record["error"] for record in failed],
+        "quarantine": failed,
+        "busy": time.perf_counter() - start,
+        "pid": os.getpid(),
+        "max_rss": peak_rss(),
+        "stats": stats,
+        "written": written,
+    }
+
+
+def process_comment_batch(comment_batch, json_output_dir, xml_output_dir, options=None):
     """process a batch of comments, iterate through batch and processes each comment individually"""
+    start = time.perf_counter()
+    writer = AsyncWriter()
+    fixed = fixed_dirs(options, json_output_dir, xml_output_dir)
+    corpus = make_corpus(options, xml_output_dir, False, writer)
+    json_zst, json_dictionary = json_options(options)
+    results, marks = [], []
     for comment in comment_batch:
-        process_single_comment(comment, json_output_dir, xml_output_dir)
+        marks.append(len(writer.submitted))
+        results.append(
+            process_single_comment(
+                comment,
+                json_output_dir,
+                xml_output_dir,
+                writer,
+                corpus,
+                json_zst,
+                json_dictionary,
+                fixed,
+            )
+        )
+    if corpus is not None:
+        corpus.flush()
+    stats = collect_stats(
+        options,
+        ([comment] for comment, error in zip(comment_batch, results) if not error),
+    )
+    # updates index the comments with their thread
+    keys = [
+        (comment.get("id"), comment.get("link_id", "").replace("t3_", ""))
+        for comment in comment_batch
+    ]
+    write_errors = writer.close()
+    written = written_files(options, keys, results, writer, marks)
+    return batch_result(results, write_errors, start, stats, written)
 
 
-def process_thread_batch(thread_batch, json_output_dir, xml_output_dir):
-    """process a batch of threads, iterates through each thread in batch"""
-    try:
-        for thread_id, comments_list in thread_batch:
-            process_thread(thread_id, comments_list, json_output_dir, xml_output_dir)
-    except Exception as e:
-        print(f"Error in process_thread_batch: {e}")
-        print(f"Thread batch: {thread_batch}")
+def process_thread_batch(thread_batch, json_output_dir, xml_output_dir, options=None):
+    """process a batch of threads (thread_id, comments, optional part),
+    iterates through each thread in batch"""
+    start = time.perf_counter()
+    writer = AsyncWriter()
+    fixed = fixed_dirs(options, json_output_dir, xml_output_dir)
+    corpus = make_corpus(options, xml_output_dir, True, writer)
+    json_zst, json_dictionary = json_options(options)
+    results, marks = [], []
+    for thread_id, comments_list, *part in thread_batch:
+        marks.append(len(writer.submitted))
+        results.append(
+            process_thread(
+                thread_id,
+                comments_list,
+                json_output_dir,
+                xml_output_dir,
+                writer,
+                part=part[0] if part else None,
+                corpus=corpus,
+                tree_structure=bool(options and options.get("tree")),
+                json_zst=json_zst,
+                json_dictionary=json_dictionary,
+                fixed=fixed,
+            )
+        )
+    if corpus is not None:
+        corpus.flush()
+    stats = collect_stats(
+        options, (task[1] for task, error in zip(thread_batch, results) if not error)
+    )
+    write_errors = writer.close()
+    written = written_files(options, [task[0] for task in thread_batch], results, writer, marks)
+    return batch_result(results, write_errors, start, stats, written)
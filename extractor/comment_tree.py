@@ -6,7 +6,12 @@ https://github.com/sgoettel/zstsidescripts/blob/main/comment_tree.py
 """
 
 import json
-import zstandard as zstd
+
+from collections import defaultdict
+
+from .quarantine import reason_code
+from .settings import KEEP_FIELDS
+from .utils import iter_zst_lines
 
 CHUNK_SIZE = 16384
 
@@ -57,7 +62,6 @@ UNWANTED_FIELDS = [
     "name",
     "no_follow",
     "num_reports",
-    "parent_id",
     "quarantined" "removal_reason",
     "removal_reason",
     "replies",
@@ -79,6 +83,10 @@ UNWANTED_FIELDS = [
     "user_reports",
 ]
 
+# projection plans: (keep list, key layout of the object) -> keys to copy
+projection_plans = {}
+
+
 def prune_object(obj):
     "Delete unwanted keys in dict extracted from JSON."
     for field in UNWANTED_FIELDS:
@@ -86,48 +94,98 @@ def prune_object(obj):
             del obj[field]
 
 
-def extract_comments(zst_file, link_id=None):
-    "Read a ZST file containing comments and extract them."
-    dctx = zstd.ZstdDecompressor()
-    seen_ids = set()
-
-    with open(zst_file, 'rb') as fh:
-        with dctx.stream_reader(fh) as reader:
-            bufferstr = ""
-
-            while True:
-                chunk = reader.read(CHUNK_SIZE)
-                if not chunk:
-                    break
-
-                bufferstr += chunk.decode(errors='ignore')
-
-                while True:
-                    position = bufferstr.find('\n')
-                    if position == -1:
-                        break
-
-                    line = bufferstr[:position]
-                    bufferstr = bufferstr[position + 1:]
-
-                    try:
-                        obj = json.loads(line)
-
-                        if link_id and obj.get('link_id', '').replace('t3_', '') != link_id:
-                            continue
-
-                        if obj.get('link_id', '').startswith('t3_'):
-
-                            if obj['id'] not in seen_ids:
-                                seen_ids.add(obj['id'])
-
-                                prune_object(obj)
-                                yield obj
-
-                    except Exception as e:
-                        print(f"Error processing object: {e}. Author: {obj.get('author', 'Unknown Author')}", end="")
-                        if 'permalink' in obj:
-                            print(f", Permalink: {obj['permalink']}")
-                        else:
-                            print()
-                        continue
+def make_projection_plan(keys, keep_fields):
+    "Select the keys to keep from a key layout, in their original order."
+    exact = {field for field in keep_fields if not field.endswith("*")}
+    prefixes = tuple(field[:-1] for field in keep_fields if field.endswith("*"))
+    return tuple(key for key in keys if key in exact or key.startswith(prefixes))
+
+
+def project_object(obj, keep_fields=KEEP_FIELDS):
+    "Return a new dict with whitelisted keys only, unknown fields are dropped."
+    # Pushshift objects of one period share their key layout,
+    # so the plan is computed once per layout and then reused
+    shape = (keep_fields, tuple(obj))
+    plan = projection_plans.get(shape)
+    if plan is None:
+        plan = projection_plans[shape] = make_projection_plan(shape[1], keep_fields)
+    return {key: obj[key] for key in plan}
+
+
+def build_comment_tree(comments):
+    """Index comments by id and attach them to their parents in O(n).
+    Returns the top-level comments and a dict of replies per comment id
+    (in input order). Comments whose parent is missing (orphans) are
+    returned as top-level comments too. A parent cycle is broken at its
+    first comment in input order (the oldest, in a dump sorted by time),
+    which becomes a top-level comment; replies to the cycle stay attached."""
+    by_id = {comment["id"]: comment for comment in comments}
+    replies = defaultdict(list)
+    roots = []
+    for comment in comments:
+        kind, _, parent_id = (comment.get("parent_id") or "").partition("_")
+        if kind == "t1" and parent_id in by_id and parent_id != comment["id"]:
+            replies[parent_id].append(comment)
+        else:
+            roots.append(comment)
+
+    def parent(comment):
+        return by_id[comment["parent_id"].partition("_")[2]]
+
+    # comments that can't be reached from a top-level comment are in a
+    # parent cycle or below one: their parents lead into the cycle
+    order = {comment["id"]: number for number, comment in enumerate(comments)}
+    seen = set()
+    pending = list(roots)
+    for comment in comments:
+        if not pending and comment["id"] not in seen:
+            path, start = set(), comment
+            while start["id"] not in path:
+                path.add(start["id"])
+                start = parent(start)
+            cycle, current = [start], parent(start)
+            while current is not start:
+                cycle.append(current)
+                current = parent(current)
+            first = min(cycle, key=lambda member: order[member["id"]])
+            replies[first["parent_id"].partition("_")[2]].remove(first)
+            roots.append(first)
+            pending.append(first)
+        while pending:
+            current = pending.pop()
+            seen.add(current["id"])
+            pending.extend(replies.get(current["id"], ()))
+    return roots, replies
+
+
+def extract_comments(zst_file, link_id=None, keep_fields=None, quarantine=None, seen_ids=None):
+    """Read a ZST file containing comments and extract them.
+    With keep_fields the objects are projected on this whitelist,
+    otherwise the UNWANTED_FIELDS are removed. Lines that can't be
+    processed go to the quarantine (if given). seen_ids is the set of
+    ids used to skip duplicates (given to measure it)."""
+    if seen_ids is None:
+        seen_ids = set()
+
+    for line in iter_zst_lines(zst_file, CHUNK_SIZE):
+        try:
+            obj = json.loads(line.decode(errors="ignore"))
+
+            if link_id and obj.get("link_id", "").replace("t3_", "") != link_id:
+                continue
+
+            if obj.get("link_id", "").startswith("t3_"):
+
+                if obj["id"] not in seen_ids:
+                    seen_ids.add(obj["id"])
+
+                    if keep_fields:
+                        yield project_object(obj, keep_fields)
+                    else:
+                        prune_object(obj)
+                        yield obj
+
+        except Exception as e:
+            if quarantine is not None and line.strip():
+                quarantine.add("extract", reason_code(e), line, e)
+            continue
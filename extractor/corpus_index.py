@@ -0,0 +1,170 @@
+"""
+Persistent index of a corpus for incremental updates (--update): the ids
+of the converted comments with their thread, and the JSON and XML files
+of each thread, in an SQLite database next to the output. A new dump
+only adds its unknown comments, threads that get new comments are
+rewritten in place, all other files are left untouched.
+"""
+
+import json
+import os
+import sqlite3
+
+from collections import Counter, defaultdict
+
+from .json2xml import PART_REGEX, find_json_tasks, parse_json_filename
+from .json_archive import read_json_bytes, strip_json_suffix
+from .utils import ShardAllocator, make_chunks
+
+LOOKUP_BATCH = 500  # ids per SELECT ... IN (...)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS comments (
+    id TEXT PRIMARY KEY,
+    thread TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS files (
+    thread TEXT NOT NULL,
+    path TEXT NOT NULL,
+    PRIMARY KEY (thread, path)
+) WITHOUT ROWID;
+"""
+
+
+def thread_of_xml(filename):
+    "Thread id of a grouped XML file (<thread>.xml or <thread>_p0001.xml)."
+    name = filename[: -len(".xml")]
+    match = PART_REGEX.fullmatch(name)
+    return match[1] if match else name
+
+
+class CorpusIndex:
+    """Comment ids and thread files of a corpus, paths are stored
+    relative to root (the subreddit output folder)."""
+
+    def __init__(self, path, root):
+        self.path = path
+        self.root = root
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+        self.skipped = 0  # comments dropped by new_comments
+
+    def is_empty(self):
+        return self.db.execute("SELECT 1 FROM comments LIMIT 1").fetchone() is None
+
+    def known_ids(self, ids):
+        "The ids of a list that are in the index."
+        known = set()
+        for i in range(0, len(ids), LOOKUP_BATCH):
+            chunk = ids[i : i + LOOKUP_BATCH]
+            query = f"SELECT id FROM comments WHERE id IN ({','.join('?' * len(chunk))})"
+            known.update(row[0] for row in self.db.execute(query, chunk))
+        return known
+
+    def new_comments(self, comments):
+        """Yield the comments that are neither in the index nor earlier
+        in comments, the others are counted in skipped."""
+        seen = set()
+        for batch in make_chunks(comments, LOOKUP_BATCH):
+            known = self.known_ids([comment["id"] for comment in batch])
+            for comment in batch:
+                if comment["id"] in known or comment["id"] in seen:
+                    self.skipped += 1
+                    continue
+                seen.add(comment["id"])
+                yield comment
+
+    def add_comments(self, pairs):
+        "Add (comment id, thread id) pairs."
+        self.db.executemany("INSERT OR IGNORE INTO comments VALUES (?, ?)", pairs)
+
+    def thread_files(self, thread):
+        "Absolute paths of the files of a thread (empty for a new thread)."
+        rows = self.db.execute("SELECT path FROM files WHERE thread = ? ORDER BY path", (thread,))
+        return [os.path.join(self.root, row[0]) for row in rows]
+
+    def add_files(self, thread, paths):
+        self.db.executemany(
+            "INSERT OR IGNORE INTO files VALUES (?, ?)",
+            ((thread, os.path.relpath(path, self.root)) for path in paths),
+        )
+
+    def set_files(self, thread, paths):
+        "Replace the files of a thread."
+        self.db.execute("DELETE FROM files WHERE thread = ?", (thread,))
+        self.add_files(thread, paths)
+
+    def build(self, json_dir, xml_dir, group_mode=True):
+        """Index an output that was written without an index, from its JSON
+        archive (and the XML file names of the threads in grouped mode)."""
+        for paths in find_json_tasks(json_dir):
+            for path in paths:
+                thread, _, _, _ = parse_json_filename(os.path.basename(path))
+                comments = json.loads(read_json_bytes(path).decode("utf-8", errors="replace"))
+                self.add_comments((comment["id"], thread) for comment in comments)
+                if group_mode:
+                    self.add_files(thread, [path])
+        if group_mode:
+            for root, _, files in os.walk(xml_dir):
+                for filename in files:
+                    if filename.endswith(".xml") and not filename.startswith("corpus_"):
+                        self.add_files(thread_of_xml(filename), [os.path.join(root, filename)])
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+
+def load_thread(paths):
+    "Comments of a thread from its JSON files (all parts, in order)."
+    json_paths = sorted(
+        (path for path in paths if strip_json_suffix(path) != path),
+        key=lambda path: parse_json_filename(os.path.basename(path))[3] or 0,
+    )
+    comments = []
+    for path in json_paths:
+        comments.extend(json.loads(read_json_bytes(path).decode("utf-8", errors="replace")))
+    return comments
+
+
+class UpdateLayout:
+    """Output directories of an update: a thread is rewritten where its files
+    are, new threads and comments continue the last shards of the output."""
+
+    def __init__(self, json_dir, xml_dir):
+        self.json_shards = ShardAllocator(json_dir).resume()
+        self.xml_shards = ShardAllocator(xml_dir).resume()
+
+    def assign(self, files, old_files=()):
+        "JSON and XML directory for files of a new item, or of an item with old_files."
+        json_dirs = [os.path.dirname(path) for path in old_files if strip_json_suffix(path) != path]
+        xml_dirs = [os.path.dirname(path) for path in old_files if path.endswith(".xml")]
+        return (
+            json_dirs[0] if json_dirs else self.json_shards.next_dir(files),
+            xml_dirs[0] if xml_dirs else self.xml_shards.next_dir(files),
+        )
+
+
+def record_update(index, written, old_files, tasks, new_ids):
+    """Record the files written by an update (thread -> paths) and the new
+    comment ids of the threads that were written completely, and remove old
+    files these threads no longer have (e.g. after a split into parts).
+    tasks is the number of tasks of each thread. Returns the XML paths."""
+    paths = defaultdict(list)
+    done = Counter()
+    for thread, thread_paths in written:
+        paths[thread].extend(thread_paths)
+        done[thread] += 1
+    for thread, thread_paths in paths.items():
+        if done[thread] < tasks[thread]:
+            # some parts failed: keep the old files, the comments are retried
+            index.add_files(thread, thread_paths)
+            continue
+        for path in set(old_files.get(thread, ())) - set(thread_paths):
+            if os.path.exists(path):
+                os.remove(path)
+        index.set_files(thread, thread_paths)
+        index.add_comments((comment_id, thread) for comment_id in new_ids[thread])
+    index.db.commit()
+    return [path for thread_paths in paths.values() for path in thread_paths if path.endswith(".xml")]
@@ -0,0 +1,227 @@
+"""
+Dry run on a sample of an input file: the filter and conversion stages
+run on the first megabytes and a few later frames, and the counts, sizes
+and times are extrapolated to the whole file
+"""
+
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+from collections import defaultdict
+
+import zstandard as zstd
+
+from .comment_processing import process_comment_batch, process_thread_batch
+from .filter_rules import load_rules
+from .json_archive import DICTIONARY_SAMPLES, train_dictionary
+from .records import compact
+from .settings import NDJSON_EXTENSIONS
+from .streaming import ZSTD_MAGIC, iter_extracted
+from .trim_username_comments import iter_filtered, new_filter_counts
+from .utils import make_chunks, split_thread
+from .validate import validate_files
+
+SAMPLE_BYTES = 64 * 1024 * 1024  # decompressed bytes read from the start
+SAMPLE_FRAMES = 4  # later positions probed for a frame start
+FRAME_SAMPLE_BYTES = 4 * 1024 * 1024  # decompressed bytes read at each of them
+READ_SIZE = 131072
+MAX_WINDOW_SIZE = 2**31  # Pushshift dumps use long-distance windows
+
+
+def read_zst_sample(fh, offset, limit):
+    """Decompress up to limit bytes of a frame starting at offset,
+    returns the data and the compressed bytes consumed."""
+    fh.seek(offset)
+    dctx = zstd.ZstdDecompressor(max_window_size=MAX_WINDOW_SIZE)
+    reader = dctx.stream_reader(
+        fh, read_size=READ_SIZE, read_across_frames=True, closefd=False
+    )
+    chunks, size = [], 0
+    try:
+        while size < limit and (chunk := reader.read(READ_SIZE)):
+            chunks.append(chunk)
+            size += len(chunk)
+    except zstd.ZstdError:
+        # not a frame start after all, or a truncated file
+        if not chunks:
+            return b"", 0
+    reader.close()
+    return b"".join(chunks), fh.tell() - offset
+
+
+def find_frame(fh, offset):
+    "Offset of the next zstd frame magic after offset, or None."
+    fh.seek(offset)
+    position = fh.read(READ_SIZE * 8).find(ZSTD_MAGIC)
+    return None if position == -1 else offset + position
+
+
+def sample_lines(path, sample_bytes=SAMPLE_BYTES, frames=SAMPLE_FRAMES):
+    """Complete lines of the start of the file and of up to frames later
+    positions (frame starts for zst files), with the share of the file
+    they cover (1.0 if the whole file was read)."""
+    file_size = os.path.getsize(path)
+    compressed = not path.endswith(NDJSON_EXTENSIONS)
+    lines, consumed = [], 0
+    with open(path, "rb") as fh:
+        if compressed:
+            data, used = read_zst_sample(fh, 0, sample_bytes)
+        else:
+            data = fh.read(sample_bytes)
+            used = len(data)
+        if used >= file_size:
+            return data.splitlines(), 1.0
+        # the last line of each sample is cut off
+        lines.extend(data.split(b"\n")[:-1])
+        consumed += used
+
+        for i in range(1, frames + 1):
+            offset = file_size * i // (frames + 1)
+            if offset < consumed:
+                continue
+            if compressed:
+                offset = find_frame(fh, offset)
+                if offset is None:
+                    continue
+                data, used = read_zst_sample(fh, offset, FRAME_SAMPLE_BYTES)
+                later = data.split(b"\n")[:-1]
+            else:
+                fh.seek(offset)
+                data = fh.read(FRAME_SAMPLE_BYTES)
+                used = len(data)
+                # the first line starts before the offset
+                later = data.split(b"\n")[1:-1]
+            lines.extend(later)
+            consumed += used
+    return lines, min(consumed / file_size, 1.0) if file_size else 1.0
+
+
+def directory_size(directory):
+    "Total size of the files in a directory tree."
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, files in os.walk(directory)
+        for name in files
+    )
+
+
+def grouping_memory(comments):
+    "Bytes allocated to hold the comments parsed and grouped by thread (compact)."
+    lines = [json.dumps(comment) for comment in comments]
+    tracemalloc.start()
+    try:
+        thread_comments = defaultdict(list)
+        for line in lines:
+            comment = compact(json.loads(line))
+            thread_comments[comment["link_id"][3:]].append(comment)
+        return tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+
+def estimate(
+    path,
+    processes,
+    no_group=False,
+    keep_fields=None,
+    max_comments=None,
+    max_bytes=None,
+    corpus=None,
+    tree=False,
+    json_zst=False,
+    chunk_size=100,
+    sample_bytes=SAMPLE_BYTES,
+    frames=SAMPLE_FRAMES,
+    rules=None,
+):
+    """Run the filter (with rules, default: the default config), extract,
+    convert and validation stages on a sample of path and extrapolate them
+    to the whole file for processes workers. Returns a dict of the estimates."""
+    lines, share = sample_lines(path, sample_bytes, frames)
+    scale = 1 / share if share else 0
+    times = {}
+
+    start = time.perf_counter()
+    counts = new_filter_counts()
+    decoded = (line.decode(errors="ignore") for line in lines)
+    kept = list(iter_filtered(decoded, rules or load_rules(), counts))
+    times["filter"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    comments = list(iter_extracted(kept, keep_fields))
+    thread_comments = defaultdict(list)
+    for comment in comments:
+        thread_comments[comment["link_id"][3:]].append(comment)
+    times["extract"] = time.perf_counter() - start
+
+    options = {"corpus": corpus, "tree": tree}
+    with tempfile.TemporaryDirectory() as tmp:
+        json_dir, xml_dir = os.path.join(tmp, "json"), os.path.join(tmp, "xml")
+        os.makedirs(json_dir)
+        os.makedirs(xml_dir)
+        if json_zst:
+            options["json_zst"] = True
+            options["json_dictionary"] = train_dictionary(
+                comments[:DICTIONARY_SAMPLES], json_dir
+            )
+        if no_group:
+            chunk_size = corpus[0] if corpus else chunk_size
+            results = [
+                process_comment_batch(batch, json_dir, xml_dir, options)
+                for batch in make_chunks(comments, chunk_size)
+            ]
+        else:
+            tasks = []
+            for thread_id, thread in thread_comments.items():
+                parts = split_thread(thread, max_comments, max_bytes)
+                if len(parts) == 1:
+                    tasks.append((thread_id, thread))
+                    continue
+                for number, part in enumerate(parts, 1):
+                    tasks.append((thread_id, part, (number, len(parts), thread[-1])))
+            results = [process_thread_batch(tasks, json_dir, xml_dir, options)]
+        # the workers share conversion and validation
+        times["convert"] = sum(result["busy"] for result in results) / processes
+        json_bytes, xml_bytes = directory_size(json_dir), directory_size(xml_dir)
+
+        start = time.perf_counter()
+        validate_files(
+            os.path.join(root, name)
+            for root, _, files in os.walk(xml_dir)
+            for name in files
+        )
+        times["validate"] = (time.perf_counter() - start) / processes
+
+    return {
+        "share": share,
+        "comments": round(len(lines) * scale),
+        "kept": round(len(comments) * scale),
+        "threads": round(len(thread_comments) * scale),
+        "grouping_memory": 0 if no_group else round(grouping_memory(comments) * scale),
+        "json_bytes": round(json_bytes * scale),
+        "xml_bytes": round(xml_bytes * scale),
+        "times": {stage: seconds * scale for stage, seconds in times.items()},
+        "processes": processes,
+    }
+
+
+def print_estimate(path, result):
+    "Print the estimates of a file."
+    mib = 1024 * 1024
+    times = result["times"]
+    stages = ", ".join(f"{stage} {seconds:.1f}s" for stage, seconds in times.items())
+    print(f"Estimate for {path} (sample: {result['share']:.1%} of the file):")
+    print(f"  comments: ~{result['comments']} (~{result['kept']} after filtering)")
+    print(f"  threads: ~{result['threads']}")
+    print(f"  peak memory for grouping: ~{result['grouping_memory'] / mib:.1f} MiB")
+    print(
+        f"  output: ~{result['json_bytes'] / mib:.1f} MiB JSON, "
+        f"~{result['xml_bytes'] / mib:.1f} MiB XML"
+    )
+    print(
+        f"  wall time with {result['processes']} workers: "
+        f"~{sum(times.values()):.1f}s ({stages})"
+    )
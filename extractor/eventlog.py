@@ -0,0 +1,134 @@
+"""
+Compact NDJSON event logs written to zstd-compressed files
+by a background writer thread
+"""
+
+import json
+import queue
+import threading
+
+import zstandard as zstd
+
+from .records import to_json
+from .settings import LOG_LEVELS
+
+BATCH_SIZE = 512  # events handed to the writer thread at once
+QUEUE_SIZE = 64  # max. pending batches before the producer blocks
+
+
+class EventWriter:
+    """Write dicts as NDJSON into a zstd stream, encoding and
+    compression happen in a background thread."""
+
+    def __init__(self, path, level=3):
+        self.path = path
+        self._batch = []
+        self._error = None
+        self._queue = queue.Queue(maxsize=QUEUE_SIZE)
+        self._fh = open(path, "wb")
+        self._writer = zstd.ZstdCompressor(level=level).stream_writer(self._fh)
+        self._thread = threading.Thread(target=self._drain, daemon=True)
+        self._thread.start()
+
+    def _drain(self):
+        """Encode and compress batches until the end marker arrives, after
+        a failure the batches are still taken (write never blocks) and the
+        error is raised by close."""
+        dumps = json.JSONEncoder(
+            ensure_ascii=False, separators=(",", ":"), default=to_json
+        ).encode
+        while (batch := self._queue.get()) is not None:
+            if self._error is not None:
+                continue
+            try:
+                self._writer.write(
+                    "".join(dumps(record) + "\n" for record in batch).encode("utf-8")
+                )
+            except Exception as e:
+                self._error = e
+
+    def write(self, record):
+        self._batch.append(record)
+        if len(self._batch) >= BATCH_SIZE:
+            self._queue.put(self._batch)
+            self._batch = []
+
+    def close(self):
+        if self._batch:
+            self._queue.put(self._batch)
+            self._batch = []
+        self._queue.put(None)
+        self._thread.join()
+        self._writer.close()  # also closes the underlying file
+        if self._error is not None:
+            raise RuntimeError(f"writing {self.path} failed: {self._error}") from self._error
+
+
+def summary_record(level, counts):
+    "Final record of a filter log."
+    return {"event": "summary", "level": level, "counts": counts or {}}
+
+
+class FilterLog:
+    """Structured log of the filter stage.
+
+    Levels: "off" writes nothing, "counts" only a final summary record,
+    "sample" every n-th event of each kind, "full" every event.
+    """
+
+    def __init__(self, path, level="full", sample_rate=0.01):
+        if level not in LOG_LEVELS:
+            raise ValueError(f"unknown log level: {level}")
+        if not 0 < sample_rate <= 1:
+            raise ValueError(f"log sample rate must be in (0, 1]: {sample_rate}")
+        self.level = level
+        self.path = path
+        # only sample and full levels need the writer in the hot loop
+        self.enabled = level in ("sample", "full")
+        self._every = max(1, round(1 / sample_rate)) if level == "sample" else 1
+        self._seen = {}
+        self._writer = EventWriter(path) if self.enabled else None
+
+    def event(self, kind, **fields):
+        "Record a single filter event, subject to sampling."
+        if self._every > 1:
+            seen = self._seen.get(kind, 0)
+            self._seen[kind] = seen + 1
+            if seen % self._every:
+                return
+        fields["event"] = kind
+        self._writer.write(fields)
+
+    def close(self, counts=None, summary=True):
+        """Write the summary record (if any) and flush the log,
+        without summary only the events are written."""
+        if self.level == "off" or not (summary or self.enabled):
+            return
+        if not summary:
+            self._writer.close()
+            return
+        summary = summary_record(self.level, counts)
+        if self._writer is None:
+            # counts only: a single record, no need for a thread
+            with open(self.path, "wb") as fh:
+                fh.write(zstd.compress(json.dumps(summary).encode("utf-8") + b"\n"))
+            return
+        self._writer.write(summary)
+        self._writer.close()
+
+
+def read_events(path):
+    "Iterate over the records of a compressed event log."
+    with open(path, "rb") as fh:
+        # logs written in parts consist of several frames
+        dctx = zstd.ZstdDecompressor()
+        with dctx.stream_reader(fh, read_across_frames=True) as reader:
+            buffer = b""
+            while chunk := reader.read(65536):
+                buffer += chunk
+                *lines, buffer = buffer.split(b"\n")
+                for line in lines:
+                    if line:
+                        yield json.loads(line)
+            if buffer.strip():
+                yield json.loads(buffer)
@@ -0,0 +1,409 @@
+"""
+Filter rules of the filter stage, read from a JSON config
+(src/config/filters.json by default):
+
+    {"rules": [{"rule": "authors", "botlist": "botlist.txt"}, {"rule": "deleted"}, ...]}
+
+The rules run in the configured order, except that consecutive rules which
+don't modify the comment are reordered while filtering: cheap rules that
+drop many comments first, so that the expensive ones see fewer comments.
+A drop is still counted and logged by the first configured rule that
+matches, so counts and log don't depend on the order. Each rule records
+its time, hits (matches) and drops; time and comments seen depend on it.
+"""
+
+import json
+import os
+import re
+import time
+
+from .settings import FILTER_CONFIG
+from .trim_username_comments import (
+    deleted_tags,
+    markdown_url_regex,
+    modern_quote_regex,
+    plain_url_regex,
+    quote_regex,
+    read_bot_list,
+    remindme_regex,
+    remove_markdown_urls,
+    remove_plain_urls,
+)
+
+REORDER_EVERY = 10000  # comments between two reorderings
+
+# results of Rule.apply: no match, match (comment kept), drop
+HIT = 1
+DROP = 2
+
+# comment bodies consisting only of [URL] placeholders
+url_placeholder_regex = re.compile(r"(\[URL\]([!?\.])*[\s\n]*)+")
+
+
+class Record:
+    """A comment passing the rules, with its original body and author."""
+
+    __slots__ = ("obj", "original_body", "author", "changes")
+
+    def __init__(self, obj):
+        self.obj = obj
+        self.original_body = obj.get("body", "").strip()
+        self.author = obj.get("author", "").lower()
+        # modification events ("quote", "url") logged after all rules
+        self.changes = []
+
+
+class Rule:
+    """Base class of the rules, apply() returns None, HIT or DROP.
+    Rules that modify the comment set modifies, keep their position and
+    implement apply(), the others implement matches() and drop()."""
+
+    name = None
+    modifies = False
+
+    def __init__(self):
+        self.seen = 0
+        self.hits = 0
+        self.drops = 0
+        self.time = 0.0
+
+    @classmethod
+    def from_config(cls, params, base_dir):
+        "Rule from its config entry, paths are relative to base_dir."
+        return cls(**params)
+
+    def apply(self, record, counts, log):
+        if self.matches(record):
+            self.drop(record, counts, log)
+            return DROP
+        return None
+
+    def matches(self, record):
+        "True if the comment is dropped by the rule."
+        raise NotImplementedError
+
+    def drop(self, record, counts, log):
+        "Count and log a comment dropped by the rule."
+
+    def rank(self):
+        """Expected cost of the rule per dropped comment (time per comment
+        over drop rate), 0 until it has seen comments."""
+        if not self.seen:
+            return 0.0
+        return (self.time / self.seen) / ((self.drops + 1) / (self.seen + 2))
+
+    def stats(self):
+        return {
+            "rule": self.name,
+            "seen": self.seen,
+            "hits": self.hits,
+            "drops": self.drops,
+            "time": round(self.time, 6),
+        }
+
+
+class AuthorRule(Rule):
+    """Drop comments of the listed authors (e.g. bots)."""
+
+    name = "authors"
+
+    def __init__(self, authors=(), botlist=None):
+        super().__init__()
+        authors = list(authors)
+        if botlist:
+            authors.extend(read_bot_list(*os.path.split(botlist)))
+        self.authors = tuple(authors)
+        self.lookup = frozenset(authors)
+
+    @classmethod
+    def from_config(cls, params, base_dir):
+        botlist = params.get("botlist")
+        return cls(
+            [author.lower() for author in params.get("authors", ())],
+            os.path.join(base_dir, botlist) if botlist else None,
+        )
+
+    def matches(self, record):
+        return record.author in self.lookup
+
+    def drop(self, record, counts, log):
+        counts["authors"][record.author] = counts["authors"].get(record.author, 0) + 1
+
+
+class DeletedRule(Rule):
+    """Drop deleted or removed comments."""
+
+    name = "deleted"
+
+    def __init__(self, tags=tuple(deleted_tags)):
+        super().__init__()
+        self.tags = frozenset(tags)
+
+    def matches(self, record):
+        return record.original_body in self.tags
+
+    def drop(self, record, counts, log):
+        counts["deleted"] += 1
+        if log:
+            log(
+                "deleted",
+                id=record.obj.get("id"),
+                original=record.original_body,
+                comment=record.obj,
+            )
+
+
+class UrlOnlyRule(Rule):
+    """Drop comments that are just a plain URL."""
+
+    name = "url_only"
+
+    def matches(self, record):
+        return plain_url_regex.fullmatch(record.original_body) is not None
+
+    def drop(self, record, counts, log):
+        counts["url_only"] += 1
+        if log:
+            log("url_only", id=record.obj.get("id"), original=record.original_body)
+
+
+class QuoteRule(Rule):
+    """Remove quotations (&gt; before 2023, > from 2023 on)."""
+
+    name = "quotes"
+    modifies = True
+
+    def apply(self, record, counts, log):
+        obj = record.obj
+        body = obj.get("body", "").strip()
+        cleaned_body_before_strip = quote_regex.sub("", body)
+        cleaned_body_after_strip = modern_quote_regex.sub("", cleaned_body_before_strip).strip()
+
+        # check if significant changes were made, besides removing whitespace
+        if (cleaned_body_before_strip.strip() != body) or (
+            cleaned_body_after_strip != cleaned_body_before_strip.strip()
+        ):
+            obj["body"] = cleaned_body_after_strip
+            counts["quote"] += 1
+            record.changes.append("quote")
+            return HIT
+        return None
+
+
+class UrlRule(Rule):
+    """Replace URLs with [URL] (markdown links by their text),
+    drop comments that are only [URL] placeholders afterwards."""
+
+    name = "urls"
+    modifies = True
+
+    def apply(self, record, counts, log):
+        obj = record.obj
+        body = obj.get("body", "")
+        original_url_count = len(plain_url_regex.findall(body)) + len(
+            markdown_url_regex.findall(body)
+        )
+        new_body = remove_plain_urls(remove_markdown_urls(body))
+        if new_body == body:
+            return None
+
+        obj["body"] = new_body
+        record.changes.append("url")
+        new_url_count = len(plain_url_regex.findall(new_body)) + len(
+            markdown_url_regex.findall(new_body)
+        )
+        counts["urls_removed"] += original_url_count - new_url_count
+
+        cleaned_body = new_body.strip()
+        if not cleaned_body or url_placeholder_regex.fullmatch(cleaned_body):
+            if log:
+                log("url_placeholders", id=obj.get("id"), original=record.original_body)
+            return DROP
+        return HIT
+
+
+class RemindMeRule(Rule):
+    """Drop RemindMeBot invocations (of the body as modified so far)."""
+
+    name = "remindme"
+
+    def matches(self, record):
+        return remindme_regex.search(record.obj.get("body", "")) is not None
+
+    def drop(self, record, counts, log):
+        counts["remindme"] += 1
+        if log:
+            log("remindme", id=record.obj.get("id"), original=record.obj.get("body", ""))
+
+
+class PatternRule(Rule):
+    """Drop comments whose field matches a regular expression,
+    e.g. {"rule": "pattern", "label": "ads", "field": "body", "regex": "..."}."""
+
+    name = "pattern"
+
+    def __init__(self, regex, field="body", label=None, ignore_case=False):
+        super().__init__()
+        self.regex = re.compile(regex, re.IGNORECASE if ignore_case else 0)
+        self.field = field
+        self.label = label or regex
+
+    def matches(self, record):
+        value = record.obj.get(self.field)
+        return value is not None and self.regex.search(str(value)) is not None
+
+    def drop(self, record, counts, log):
+        if log:
+            value = record.obj.get(self.field)
+            log("pattern", id=record.obj.get("id"), rule=self.label, original=value)
+
+    def stats(self):
+        return {**super().stats(), "label": self.label}
+
+
+# rule names of the config -> rule classes
+RULES = {
+    rule.name: rule
+    for rule in (
+        AuthorRule,
+        DeletedRule,
+        UrlOnlyRule,
+        QuoteRule,
+        UrlRule,
+        RemindMeRule,
+        PatternRule,
+    )
+}
+
+
+class FilterPipeline:
+    """The configured rules, applied in order (see module docstring)."""
+
+    def __init__(self, rules, reorder_every=REORDER_EVERY):
+        self.rules = list(rules)
+        self.order = list(self.rules)
+        # rule -> rules configured before it that are evaluated after it
+        self.earlier = {}
+        self.reorder_every = reorder_every
+        self.records = 0
+
+    @property
+    def authors(self):
+        "Authors dropped by the authors rules."
+        return [author for rule in self.rules if rule.name == "authors" for author in rule.authors]
+
+    def names(self):
+        return {rule.name for rule in self.rules}
+
+    def reorder(self):
+        "Sort each run of rules that don't modify the comment by rank."
+        order, run = [], []
+        for rule in self.rules:
+            if rule.modifies:
+                order.extend(sorted(run, key=Rule.rank))
+                order.append(rule)
+                run = []
+            else:
+                run.append(rule)
+        order.extend(sorted(run, key=Rule.rank))
+        self.order = order
+        evaluated = {rule: number for number, rule in enumerate(order)}
+        self.earlier = {
+            rule: [other for other in self.rules[:number] if evaluated[other] > evaluated[rule]]
+            for number, rule in enumerate(self.rules)
+            if not rule.modifies
+        }
+
+    def credited(self, rule, record):
+        """The rule a drop by rule is counted against: the first configured
+        rule that matches (rules evaluated before rule didn't match)."""
+        for other in self.earlier.get(rule, ()):
+            if other.matches(record):
+                return other
+        return rule
+
+    def apply(self, record, counts, log=None):
+        "Apply the rules to a record, returns True if the comment is dropped."
+        self.records += 1
+        if self.records % self.reorder_every == 0:
+            self.reorder()
+        clock = time.perf_counter
+        for rule in self.order:
+            start = clock()
+            if rule.modifies:
+                result = rule.apply(record, counts, log)
+            else:
+                result = DROP if rule.matches(record) else None
+            rule.time += clock() - start
+            rule.seen += 1
+            if result == DROP and not rule.modifies:
+                rule = self.credited(rule, record)
+                rule.drop(record, counts, log)
+            if result:
+                rule.hits += 1
+                if result == DROP:
+                    rule.drops += 1
+                    return True
+        return False
+
+    def stats(self):
+        "Statistics of the rules, in the configured order."
+        return [rule.stats() for rule in self.rules]
+
+    def merge_stats(self, stats):
+        "Add the statistics of a copy of the pipeline (e.g. in a worker)."
+        for rule, other in zip(self.rules, stats):
+            rule.seen += other["seen"]
+            rule.hits += other["hits"]
+            rule.drops += other["drops"]
+            rule.time += other["time"]
+
+
+def default_rules(authors, remove_deleted, remove_quotes, remove_remindme, remove_urls):
+    """The rules of the default config, selected by flags, with an author list."""
+    rules = []
+    if authors:
+        rules.append(AuthorRule(authors))
+    if remove_deleted:
+        rules.append(DeletedRule())
+    if remove_urls:
+        rules.append(UrlOnlyRule())
+    if remove_quotes:
+        rules.append(QuoteRule())
+    if remove_urls:
+        rules.append(UrlRule())
+    if remove_remindme:
+        rules.append(RemindMeRule())
+    return FilterPipeline(rules)
+
+
+def load_rules(path=None, botlist=None):
+    """FilterPipeline of a JSON config (default: FILTER_CONFIG), entries with
+    "enabled": false are skipped, botlist replaces the list of the authors rule."""
+    path = path or FILTER_CONFIG
+    with open(path, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    base_dir = os.path.dirname(os.path.abspath(path))
+    rules = []
+    for entry in config.get("rules", []):
+        params = dict(entry)
+        name = params.pop("rule", None)
+        if not params.pop("enabled", True):
+            continue
+        if name not in RULES:
+            raise ValueError(f"unknown filter rule {name!r} in {path}")
+        if name == "authors" and botlist:
+            params["botlist"] = os.path.abspath(botlist)
+        rules.append(RULES[name].from_config(params, base_dir))
+    return FilterPipeline(rules)
+
+
+def print_rules(rules):
+    "Time, hits and drops of each rule, in the order of the last reordering."
+    print("Filter rules (time, comments seen, hits, dropped):")
+    for rule in rules.order:
+        label = rule.label if isinstance(rule, PatternRule) else rule.name
+        print(
+            f"  {label:<12} {rule.time:8.2f}s {rule.seen:>10} seen "
+            f"{rule.hits:>9} hits {rule.drops:>9} dropped"
+        )
@@ -8,13 +8,36 @@ import html
 import json
 import os
 import re
+import time
 
+from collections import defaultdict
 from datetime import datetime, timezone
-
-from lxml.etree import Element, ElementTree, SubElement, tostring
-
-from .utils import get_output_dir
-from .validate import validate_directory
+from functools import partial
+
+from lxml.etree import Element, SubElement, tostring
+
+from .columns import CommentColumns
+from .comment_tree import build_comment_tree
+from .json_archive import JSON_SUFFIXES, read_json_bytes, strip_json_suffix
+from .partitions import source_partition
+from .quarantine import Quarantine, print_quarantine, quarantine_record, reason_code
+from .settings import DTD_SAMPLE_RATE
+from .utils import ShardAllocator, make_chunks
+from .validate import (
+    describe_validation,
+    record_validation,
+    validate_directory,
+    validation_rate,
+)
+from .workers import use_pool
+
+
+JSON2XML_BATCH_SIZE = 100  # files per task sent to a worker
+PROGRESS_EVERY = 10000  # print progress every n files
+PART_REGEX = re.compile(r"(.+)_p(\d{4})")
+user_mention_regex = re.compile(r"/u/(\w+)")
+# max. nesting of reply lists (libxml2 parses up to 256 levels by default)
+MAX_TREE_DEPTH = 100
 
 
 def return_printables_and_spaces(char):
@@ -34,8 +57,8 @@ def process_comment_text(comment_text):
         "&gt;", ">"
     )  # Replace &gt; with > manually to ensure correct display in XML
     comment_text = remove_control_characters(comment_text)
-    comment_text = re.sub(
-        r"/u/(\w+)", r"\1", comment_text
+    comment_text = user_mention_regex.sub(
+        r"\1", comment_text
     )  # replace username mentions, /u/username → username
 
     # Remove additional control characters and NULL bytes
@@ -44,27 +67,25 @@ def process_comment_text(comment_text):
     comment_text = comment_text.replace("\0", " ")  # NULL-Bytes
 
     # transform line breaks to <lb> (do we need white space after last line break?)
-    try:
-        if "\n" in comment_text:
-            text_parts = comment_text.split("\n")
-            elements = [remove_control_characters(text_parts[0])]
-            for part in text_parts[1:]:
-                lb_element = Element("lb")
-                lb_element.tail = remove_control_characters(
-                    part
-                )  # ensure XML-safe text
-                elements.append(lb_element)
-            return elements
-        return [remove_control_characters(comment_text)]
-    except ValueError as e:
-        print("Error processing comment text:", repr(comment_text))
-        print("Error message:", e)
-        raise e
-
-
-def create_comment_element(parent_element, comment, base_info, element_type="item"):
-    """Creates XML element for a comment (as <item> or <p> depending on the mode)."""
-    comment_url = f"{base_info['thread_url']}comment/{comment['id']}/"
+    # a ValueError is handled by the calling stage (quarantine)
+    if "\n" in comment_text:
+        text_parts = comment_text.split("\n")
+        elements = [remove_control_characters(text_parts[0])]
+        for part in text_parts[1:]:
+            lb_element = Element("lb")
+            lb_element.tail = remove_control_characters(part)  # ensure XML-safe text
+            elements.append(lb_element)
+        return elements
+    return [remove_control_characters(comment_text)]
+
+
+def create_comment_element(
+    parent_element, comment, base_info, element_type="item", date=None, comment_url=None
+):
+    """Creates XML element for a comment (as <item> or <p> depending on the mode),
+    date and comment_url can be precomputed for a batch (see columns)."""
+    if comment_url is None:
+        comment_url = f"{base_info['thread_url']}comment/{comment['id']}/"
 
     # different structures depending on the mode
     if element_type == "item":
@@ -82,7 +103,11 @@ def create_comment_element(parent_element, comment, base_info, element_type="ite
 
         # add <date> and <name> only in standard mode
         date_elem = SubElement(comment_elem, "date")
-        date_elem.text = datetime.fromtimestamp(int(comment["created_utc"]), tz=timezone.utc).strftime("%Y-%m-%d")
+        if date is None:
+            date = datetime.fromtimestamp(int(comment["created_utc"]), tz=timezone.utc).strftime(
+                "%Y-%m-%d"
+            )
+        date_elem.text = date
         date_elem.tail = " "  # optional space after <date> (how should we handle this?)
 
         author_elem = SubElement(comment_elem, "name")
@@ -103,8 +128,38 @@ def create_comment_element(parent_element, comment, base_info, element_type="ite
     return comment_elem
 
 
-def create_tei_header(teidoc, docmeta, retrieved_on, group_mode):
-    """creates the TEI header based on the mode."""
+def create_comment_tree(comment_list, comments, docmeta):
+    """Nests replies as <list> in the <item> of their parent comment.
+    Iterative traversal, so deep reply chains don't hit the recursion limit.
+    Beyond MAX_TREE_DEPTH and for orphans (parent not in the document),
+    @corresp points to the parent comment instead."""
+    roots, replies = build_comment_tree(comments)
+    derived = CommentColumns(comments, docmeta["thread_url"]).by_id()
+    # stack of (parent <list>, comment, depth), reversed to keep the input order
+    stack = [(comment_list, comment, 1) for comment in reversed(roots)]
+    while stack:
+        parent_list, comment, depth = stack.pop()
+        date, url = derived[comment["id"]]
+        item = create_comment_element(
+            parent_list, comment, docmeta, element_type="item", date=date, comment_url=url
+        )
+        kind, _, parent_id = (comment.get("parent_id") or "").partition("_")
+        if kind == "t1" and (depth == 1 or depth > MAX_TREE_DEPTH):
+            item.set("corresp", f"{docmeta['thread_url']}comment/{parent_id}/")
+
+        children = replies.get(comment["id"])
+        if children:
+            if depth < MAX_TREE_DEPTH:
+                sublist = SubElement(item, "list")
+            else:
+                # too deep for XML parsers: continue in the current list
+                sublist = parent_list
+            stack.extend((sublist, child, depth + 1) for child in reversed(children))
+
+
+def create_tei_header(teidoc, docmeta, retrieved_on, group_mode, part=None):
+    """creates the TEI header based on the mode,
+    part is (number, total) for threads split into several documents."""
     header = SubElement(teidoc, "teiHeader")
     filedesc = SubElement(header, "fileDesc")
 
@@ -131,6 +186,11 @@ def create_tei_header(teidoc, docmeta, retrieved_on, group_mode):
         title_main_full = SubElement(titleStmt_full, "title", type="main")
         title_main_full.text = f"Reddit/{docmeta['subreddit']}"
 
+        # parts of a split thread: same thread metadata, numbered extent
+        if part:
+            extent = SubElement(biblFull, "extent")
+            extent.text = f"part {part[0]} of {part[1]}"
+
         pubStmt = SubElement(biblFull, "publicationStmt")
         publisher = SubElement(pubStmt, "publisher")
         ptr_url = SubElement(pubStmt, "ptr", type="URL", target=docmeta["thread_url"])
@@ -171,29 +231,44 @@ def create_tei_header(teidoc, docmeta, retrieved_on, group_mode):
     download_date.text = retrieved_on
 
 
-def json2xml(
-    inputfile,
+def create_corpus_header(subreddit, group_mode, count, first_date, last_date):
+    """creates the shared teiHeader of a <teiCorpus> document."""
+    header = Element("teiHeader")
+    filedesc = SubElement(header, "fileDesc")
+
+    titleStmt = SubElement(filedesc, "titleStmt")
+    title_main = SubElement(titleStmt, "title", type="main")
+    title_main.text = f"Reddit/{subreddit}"
+
+    extent = SubElement(filedesc, "extent")
+    extent.text = f"{count} {'threads' if group_mode else 'comments'}"
+
+    publicationStmt = SubElement(filedesc, "publicationStmt")
+    SubElement(publicationStmt, "p")
+
+    sourceDesc = SubElement(filedesc, "sourceDesc")
+    bibl = SubElement(sourceDesc, "bibl")
+    bibl.text = f"Reddit/{subreddit}: {first_date} - {last_date}"
+    return header
+
+
+def build_tei(
+    comments,
     tree_structure=False,
-    output_dir=None,
     filtered=True,
     link_id=None,
-    comment_id=None,
     group_mode=True,
+    fallback_timestamp=None,
+    part=None,
+    last_comment=None,
 ):
-    # ensure output directory exists before attempting to write files
-    if output_dir:
-        os.makedirs(output_dir, exist_ok=True)
-    """converts Reddit JSON data into TEI XML."""
-    # read JSON file
-    with open(inputfile, "r", encoding="utf-8", errors='replace') as f:
-        txt = f.read()
-    comments = json.loads(txt)
-    if not comments:
-        print(f"Empty file: {inputfile}")
-        return None
-
+    """Builds the TEI document for a list of comments,
+    returns the document and the post id used for the file name.
+    For parts of a split thread, part is (number, total) and last_comment
+    the last comment of the whole thread, used for the shared metadata.
+    With tree_structure, replies are nested in the list of their parent."""
     # extract metadata
-    info = comments[-1] if not tree_structure else list(comments.values())[-1]
+    info = last_comment if last_comment is not None else comments[-1]
     post_id = link_id or info["link_id"][3:]  # remove 't3_' prefix
     subreddit = info["subreddit"]
 
@@ -222,13 +297,13 @@ def json2xml(
     elif "retrieved_utc" in info:
         retrieved_date = datetime.fromtimestamp(int(info["retrieved_utc"]), tz=timezone.utc)
     else:
-        file_creation = os.path.getctime(inputfile)
-        retrieved_date = datetime.fromtimestamp(file_creation)
+        # file creation date or, for data not read from a file, now
+        retrieved_date = datetime.fromtimestamp(fallback_timestamp or time.time())
     retrieved_on = retrieved_date.strftime("%Y-%m-%d")
 
     # create TEI root element and add header
     teidoc = Element("TEI", xmlns="http://www.tei-c.org/ns/1.0")
-    create_tei_header(teidoc, docmeta, retrieved_on, group_mode)
+    create_tei_header(teidoc, docmeta, retrieved_on, group_mode, part)
 
     # text body based on mode
     text = SubElement(teidoc, "text")
@@ -238,43 +313,218 @@ def json2xml(
         comments_div = SubElement(body, "div", type="comments")
         comment_list = SubElement(comments_div, "list")
 
-        for comment in comments:
-            if not filtered or comment["body"] != "[deleted]":
+        if filtered:
+            comments = [comment for comment in comments if comment["body"] != "[deleted]"]
+        if tree_structure:
+            create_comment_tree(comment_list, comments, docmeta)
+        else:
+            # dates and URLs converted for the whole list at once
+            columns = CommentColumns(comments, thread_url)
+            for comment, (date, url) in zip(comments, columns.rows()):
                 create_comment_element(
-                    comment_list, comment, docmeta, element_type="item"
+                    comment_list, comment, docmeta, element_type="item", date=date, comment_url=url
                 )
     else:
         # `--no-group` mode: each comment as an individual <p> element
         if not filtered or info["body"] != "[deleted]":
             create_comment_element(body, info, docmeta, element_type="p")
 
-    # save XML
-    tei_str = tostring(teidoc, pretty_print=True, encoding="utf-8")
-    filename = (
-        f"{output_dir}/{post_id}.xml"
-        if group_mode
-        else f"{output_dir}/{link_id}_{comment_id}.xml"
+    return teidoc, post_id
+
+
+def part_suffix(part):
+    """file name suffix for parts of a split thread"""
+    return f"_p{part[0]:04d}" if part else ""
+
+
+def xml_filename(output_dir, post_id, link_id=None, comment_id=None, group_mode=True, part=None):
+    """Name of the XML file for a thread (grouped) or a single comment."""
+    if group_mode:
+        return f"{output_dir}/{post_id}{part_suffix(part)}.xml"
+    return f"{output_dir}/{link_id}_{comment_id}.xml"
+
+
+def serialize_tei(teidoc):
+    """Serialize a TEI document the way it is written to disk."""
+    return tostring(teidoc, pretty_print=True, encoding="utf-8")
+
+
+def json2xml(
+    inputfile,
+    tree_structure=False,
+    output_dir=None,
+    filtered=True,
+    link_id=None,
+    comment_id=None,
+    group_mode=True,
+    part=None,
+    last_comment=None,
+):
+    """converts Reddit JSON data into TEI XML."""
+    # ensure output directory exists before attempting to write files
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    # read JSON file (.json or .json.zst)
+    txt = read_json_bytes(inputfile).decode("utf-8", errors="replace")
+    comments = json.loads(txt)
+    if not comments:
+        print(f"Empty file: {inputfile}")
+        return None
+
+    teidoc, post_id = build_tei(
+        comments,
+        tree_structure=tree_structure,
+        filtered=filtered,
+        link_id=link_id,
+        group_mode=group_mode,
+        fallback_timestamp=os.path.getctime(inputfile),
+        part=part,
+        last_comment=last_comment,
     )
-    ElementTree(teidoc).write(filename, pretty_print=True, encoding="utf-8")
+
+    # save XML
+    tei_str = serialize_tei(teidoc)
+    filename = xml_filename(output_dir, post_id, link_id, comment_id, group_mode, part)
+    with open(filename, "wb") as outputfile:
+        outputfile.write(tei_str)
     return tei_str
 
 
-def pipeline_json2xml(dir_json):
-    """pipeline if the json files already exist: convert to XML, validate"""
-    xml_output_dir = dir_json.replace("json", "xml")
-    os.makedirs(xml_output_dir, exist_ok=True)
-    for inputfile in os.listdir(dir_json):
-        json_path = os.path.join(dir_json, inputfile)
-        if os.path.isfile(json_path):
-            link_id, comment_id = inputfile.replace(".json", "").split("_")
-            # select or create an XML subdirectory for output
-            xml_subdir = get_output_dir(xml_output_dir)
-            json2xml(
-                json_path, output_dir=xml_subdir, link_id=link_id, comment_id=comment_id
+def parse_json_filename(filename):
+    """Identify a JSON archive file: returns link_id, comment_id,
+    group mode and part number from `<thread>_flat.json`,
+    `<thread>_p0001_flat.json` or `<link>_<comment>.json` (or .json.zst)."""
+    name = strip_json_suffix(filename)
+    if name.endswith("_flat"):
+        match = PART_REGEX.fullmatch(name[: -len("_flat")])
+        if match:
+            return match[1], None, True, int(match[2])
+        return name[: -len("_flat")], None, True, None
+    link_id, comment_id = name.split("_", 1)
+    return link_id, comment_id, False, None
+
+
+def find_json_tasks(dir_json):
+    """Walk the JSON directory and its shards, yields lists of files to be
+    converted together: single files, or all parts of a split thread."""
+    parts = defaultdict(list)
+    for root, dirs, files in os.walk(dir_json):
+        dirs.sort()
+        for filename in sorted(files):
+            if not filename.endswith(JSON_SUFFIXES):
+                continue
+            link_id, _, _, part = parse_json_filename(filename)
+            if part is None:
+                yield [os.path.join(root, filename)]
+            else:
+                parts[link_id].append((part, os.path.join(root, filename)))
+    for numbered in parts.values():
+        yield [path for _, path in sorted(numbered)]
+
+
+def convert_json_task(paths, output_dir, tree_structure=False):
+    """Convert one JSON file, or all parts of a split thread
+    with the metadata of the thread's last comment."""
+    link_id, comment_id, group_mode, part = parse_json_filename(os.path.basename(paths[0]))
+    if part is None:
+        json2xml(
+            paths[0],
+            output_dir=output_dir,
+            link_id=link_id,
+            comment_id=comment_id,
+            group_mode=group_mode,
+            tree_structure=tree_structure and group_mode,
+        )
+        return
+    last_comment = json.loads(
+        read_json_bytes(paths[-1]).decode("utf-8", errors="replace")
+    )[-1]
+    for path in paths:
+        link_id, _, _, number = parse_json_filename(os.path.basename(path))
+        json2xml(
+            path,
+            output_dir=output_dir,
+            link_id=link_id,
+            group_mode=True,
+            part=(number, len(paths)),
+            last_comment=last_comment,
+            tree_structure=tree_structure,
+        )
+
+
+def convert_json_batch(tasks, tree_structure=False):
+    """worker: convert a batch of (paths, output directory) tasks,
+    failures are returned as quarantine records"""
+    errors = []
+    for paths, output_dir in tasks:
+        try:
+            convert_json_task(paths, output_dir, tree_structure)
+        except Exception as e:
+            errors.append(
+                quarantine_record(
+                    "json2xml",
+                    reason_code(e),
+                    error=f"Error converting {paths[0]}: {e}",
+                    path=paths[0],
+                )
             )
+    return {"errors": errors, "files": sum(len(paths) for paths, _ in tasks)}
 
-    print("Validate XML files.")
-    validate_directory(xml_output_dir)
+
+def pipeline_json2xml(
+    dir_json,
+    processes=None,
+    batch_size=JSON2XML_BATCH_SIZE,
+    tree_structure=False,
+    pool=None,
+    quarantine=None,
+    validation="full",
+    dtd_sample=DTD_SAMPLE_RATE,
+):
+    """pipeline if the json files already exist: convert to XML, validate.
+    Shard subdirectories are searched recursively, files are converted in parallel,
+    files that fail are recorded in the quarantine. validation is one of
+    VALIDATION_MODES, dtd_sample the DTD sample rate of "fast"."""
+    head, tail = os.path.split(os.path.normpath(dir_json))
+    own_quarantine = quarantine is None
+    if own_quarantine:
+        quarantine = Quarantine(f"quarantine_{tail}.ndjson.zst")
+    xml_output_dir = os.path.join(head, tail.replace("json", "xml"))
+    os.makedirs(xml_output_dir, exist_ok=True)
+
+    # output shards are assigned here, so the workers don't race for them,
+    # with a counter per <year>/<month> partition of a partitioned archive
+    shards = {}
+    tasks = []
+    for paths in find_json_tasks(dir_json):
+        partition = source_partition(paths[0], dir_json)
+        if partition not in shards:
+            shards[partition] = ShardAllocator(
+                os.path.normpath(os.path.join(xml_output_dir, partition))
+            )
+        tasks.append((paths, shards[partition].next_dir(len(paths))))
+    total = sum(len(paths) for paths, _ in tasks)
+    print(f"Converting {total} JSON files to XML...")
+
+    converted, errors = 0, 0
+    convert = partial(convert_json_batch, tree_structure=tree_structure)
+    with use_pool(pool, processes, preload_dtd=validation == "full") as workers:
+        for result in workers.imap_unordered(convert, make_chunks(tasks, batch_size)):
+            converted += result["files"]
+            errors += len(result["errors"])
+            for record in result["errors"]:
+                quarantine.add_record(record)
+            if converted // PROGRESS_EVERY != (converted - result["files"]) // PROGRESS_EVERY:
+                print(f"{converted}/{total} files converted")
+        print(f"{converted}/{total} files converted, {errors} error(s).")
+        if own_quarantine:
+            quarantine.close()
+            print_quarantine(quarantine)
+
+        dtd_rate = validation_rate(validation, dtd_sample)
+        print(f"Validate XML files ({describe_validation(dtd_rate)}).")
+        invalid = validate_directory(xml_output_dir, pool=workers, dtd_rate=dtd_rate)
+        record_validation(dtd_rate, invalid)
 
 
 def demo():
@@ -0,0 +1,96 @@
+"""
+JSON archive files: indented .json, or .json.zst compressed with a zstd
+dictionary trained on a sample of the run's comments and stored as
+dictionary.zstd in the JSON output directory
+"""
+
+import json
+import os
+
+from functools import lru_cache
+
+import zstandard as zstd
+
+from .records import to_json
+
+JSON_SUFFIXES = (".json", ".json.zst")
+DICTIONARY_NAME = "dictionary.zstd"
+DICTIONARY_SIZE = 112640  # zstd's default dictionary size (110 KiB)
+DICTIONARY_SAMPLES = 10000  # comments used for training
+COMPRESSION_LEVEL = 9
+
+
+def dump_json(comments):
+    """JSON archive format of the comments (dicts or compact records)"""
+    return json.dumps(comments, indent=4, default=to_json).encode("utf-8")
+
+
+def strip_json_suffix(filename):
+    "File name without .json or .json.zst."
+    for suffix in reversed(JSON_SUFFIXES):
+        if filename.endswith(suffix):
+            return filename[: -len(suffix)]
+    return filename
+
+
+def train_dictionary(comments, output_dir, size=DICTIONARY_SIZE):
+    """Train a dictionary on single-comment archive documents and store it
+    in output_dir, returns its path or None if there are too few samples."""
+    samples = [dump_json([comment]) for comment in comments]
+    try:
+        dictionary = zstd.train_dictionary(size, samples)
+    except zstd.ZstdError:
+        return None
+    path = os.path.join(output_dir, DICTIONARY_NAME)
+    with open(path, "wb") as f:
+        f.write(dictionary.as_bytes())
+    return path
+
+
+@lru_cache(maxsize=None)
+def load_dictionary(path):
+    """read a dictionary once per process"""
+    with open(path, "rb") as f:
+        return zstd.ZstdCompressionDict(f.read())
+
+
+@lru_cache(maxsize=None)
+def get_compressor(dictionary_path=None):
+    dict_data = load_dictionary(dictionary_path) if dictionary_path else None
+    return zstd.ZstdCompressor(level=COMPRESSION_LEVEL, dict_data=dict_data)
+
+
+@lru_cache(maxsize=None)
+def get_decompressor(dictionary_path=None):
+    dict_data = load_dictionary(dictionary_path) if dictionary_path else None
+    return zstd.ZstdDecompressor(dict_data=dict_data)
+
+
+def encode_json_file(name, comments, compressed=False, dictionary_path=None):
+    "Path (name plus suffix) and content of a JSON archive file."
+    data = dump_json(comments)
+    if not compressed:
+        return f"{name}.json", data
+    return f"{name}.json.zst", get_compressor(dictionary_path).compress(data)
+
+
+def find_dictionary(directory):
+    """Dictionary of the archive a directory belongs to, stored in the
+    directory itself, above its shard subdirectories or above the
+    <year>/<month>/<shard> subdirectories of a partitioned archive."""
+    for _ in range(4):
+        path = os.path.join(directory, DICTIONARY_NAME)
+        if os.path.exists(path):
+            return path
+        directory = os.path.dirname(directory)
+    return None
+
+
+def read_json_bytes(path):
+    "Content of a .json or .json.zst archive file."
+    with open(path, "rb") as f:
+        data = f.read()
+    if path.endswith(".zst"):
+        dictionary_path = find_dictionary(os.path.dirname(os.path.abspath(path)))
+        data = get_decompressor(dictionary_path).decompress(data)
+    return data
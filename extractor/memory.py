@@ -0,0 +1,214 @@
+"""
+Memory instrumentation of a run: RSS of the main process at the stage
+boundaries, peak RSS of the workers (reported with their batch results),
+sizes of the buffers of the grouping stage, optional tracemalloc top
+allocations, and a soft limit (--memory-limit): in grouped mode the
+buffered threads are spilled to bucket files on disk when it is reached,
+where that isn't possible the run is aborted with MemoryLimitError.
+"""
+
+import json
+import os
+import shutil
+import sys
+import tracemalloc
+import zlib
+
+from collections import defaultdict
+
+from .records import CompactComment, compact, to_json
+
+try:
+    import resource
+except ImportError:  # not on Windows
+    resource = None
+
+MEMORY_CHECK_EVERY = 10000  # comments between two checks of the limit
+SPILL_BUCKETS = 64  # files the threads are spread over by their id
+SIZE_SAMPLE = 1000  # items measured to estimate the size of a buffer
+MB = 1024 * 1024
+
+
+class MemoryLimitError(Exception):
+    "The soft memory limit was reached where nothing can be spilled."
+
+
+def peak_rss():
+    "Peak resident set size of this process in bytes (0 if unknown)."
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def current_rss():
+    "Resident set size of this process in bytes, the peak where /proc is missing."
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return peak_rss()
+
+
+def object_size(obj):
+    "Bytes of an object with its values (compact records, dicts, strings)."
+    if isinstance(obj, CompactComment):
+        return sys.getsizeof(obj) + object_size(obj.values)
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(object_size(value) for value in obj.values())
+    if isinstance(obj, (tuple, list)):
+        return sys.getsizeof(obj) + sum(object_size(value) for value in obj)
+    return sys.getsizeof(obj)
+
+
+def buffer_sizes(thread_comments=None, seen_ids=None):
+    """Sizes of the grouping buffers: threads, comments and estimated bytes
+    (the comments of the first SIZE_SAMPLE threads are measured), ids."""
+    sizes = {}
+    if thread_comments is not None:
+        comments = sum(map(len, thread_comments.values()))
+        size = sys.getsizeof(thread_comments)
+        measured, measured_comments = 0, 0
+        for number, (thread_id, records) in enumerate(thread_comments.items()):
+            size += sys.getsizeof(thread_id) + sys.getsizeof(records)
+            if number < SIZE_SAMPLE:
+                measured += sum(object_size(record) for record in records)
+                measured_comments += len(records)
+        if measured_comments:
+            size += round(measured / measured_comments * comments)
+        sizes["thread_comments"] = {
+            "threads": len(thread_comments),
+            "comments": comments,
+            "bytes": size,
+        }
+    if seen_ids is not None:
+        sizes["seen_ids"] = {
+            "ids": len(seen_ids),
+            "bytes": sys.getsizeof(seen_ids) + sum(map(sys.getsizeof, seen_ids)),
+        }
+    return sizes
+
+
+class MemoryMonitor:
+    """Memory report of a run, limit is the soft limit in bytes,
+    top > 0 takes tracemalloc snapshots with the top allocations."""
+
+    def __init__(self, limit=None, top=0):
+        self.limit = limit
+        self.top = top
+        self.stages = []
+        self.workers = {}  # pid -> peak RSS
+        self.spilled = 0
+        if top and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def over_limit(self):
+        return self.limit is not None and current_rss() > self.limit
+
+    def abort(self, stage):
+        "Stop the run cleanly, the limit was reached in stage."
+        raise MemoryLimitError(
+            f"memory limit of {self.limit // MB} MB reached in stage {stage!r} "
+            f"(RSS {current_rss() // MB} MB)"
+        )
+
+    def stage(self, name, **sizes):
+        "Record the memory at the end of a stage, sizes as of buffer_sizes."
+        entry = {"stage": name, "rss": current_rss(), "peak_rss": peak_rss(), **sizes}
+        if self.top:
+            snapshot = tracemalloc.take_snapshot()
+            entry["top_allocations"] = [
+                {"location": str(stat.traceback), "bytes": stat.size, "blocks": stat.count}
+                for stat in snapshot.statistics("lineno")[: self.top]
+            ]
+        self.stages.append(entry)
+
+    def add_results(self, results):
+        "Peak RSS of the workers from their batch results."
+        for result in results:
+            if result.get("max_rss"):
+                self.workers[result["pid"]] = max(
+                    self.workers.get(result["pid"], 0), result["max_rss"]
+                )
+
+    def report(self):
+        return {
+            "limit": self.limit,
+            "peak_rss": peak_rss(),
+            "workers_peak_rss": dict(sorted(self.workers.items())),
+            "spilled_comments": self.spilled,
+            "stages": self.stages,
+        }
+
+    def close(self):
+        if self.top and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+
+def print_memory(monitor):
+    "Short memory report: RSS per stage, buffers, worker peaks."
+    print(f"Memory: peak RSS {peak_rss() / MB:.0f} MB (main process)")
+    for entry in monitor.stages:
+        line = f"  {entry['stage']:<12} RSS {entry['rss'] / MB:8.0f} MB"
+        for name in ("thread_comments", "seen_ids"):
+            if name in entry:
+                line += f", {name} {entry[name]['bytes'] / MB:.0f} MB"
+        print(line)
+        for allocation in entry.get("top_allocations", ()):
+            print(f"    {allocation['bytes'] / MB:8.1f} MB  {allocation['location']}")
+    if monitor.workers:
+        peaks = monitor.workers.values()
+        print(
+            f"  workers      peak RSS {max(peaks) / MB:.0f} MB max, "
+            f"{sum(peaks) / len(peaks) / MB:.0f} MB mean ({len(peaks)} workers)"
+        )
+    if monitor.spilled:
+        print(f"  {monitor.spilled} comments spilled to disk (memory limit)")
+
+
+class ThreadSpill:
+    """Comments of the grouping stage spilled to SPILL_BUCKETS NDJSON files
+    in directory, by a hash of their thread id: each bucket holds whole
+    threads, in the order their comments arrived, and is grouped on its own."""
+
+    def __init__(self, directory, buckets=SPILL_BUCKETS):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.files = [
+            open(os.path.join(directory, f"bucket_{number:03d}.ndjson"), "w", encoding="utf-8")
+            for number in range(buckets)
+        ]
+        self.count = 0
+
+    def add(self, thread_id, comment):
+        bucket = zlib.crc32(thread_id.encode()) % len(self.files)
+        self.files[bucket].write(json.dumps(comment, default=to_json) + "\n")
+        self.count += 1
+
+    def add_threads(self, thread_comments):
+        "Spill buffered threads (and empty the buffer)."
+        for thread_id, comments in thread_comments.items():
+            for comment in comments:
+                self.add(thread_id, comment)
+        thread_comments.clear()
+
+    def groups(self):
+        "Yield the threads of each bucket (thread id -> compact records)."
+        for f in self.files:
+            f.close()
+        for f in self.files:
+            thread_comments = defaultdict(list)
+            with open(f.name, "r", encoding="utf-8") as bucket:
+                for line in bucket:
+                    comment = json.loads(line)
+                    thread_id = comment.get("link_id", "").replace("t3_", "")
+                    thread_comments[thread_id].append(compact(comment))
+            os.remove(f.name)
+            if thread_comments:
+                yield thread_comments
+
+    def close(self):
+        for f in self.files:
+            f.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
@@ -0,0 +1,53 @@
+"""
+Merge several zst dumps of the same subreddit (e.g. monthly files)
+into one stream ordered by creation time, without duplicates
+"""
+
+import heapq
+import json
+
+from operator import itemgetter
+
+import zstandard as zstd
+
+from .quarantine import reason_code
+from .utils import iter_zst_lines
+
+
+def iter_timed_lines(zst_file, quarantine=None):
+    """Yield (created_utc, id, line) for each valid comment of a zst file,
+    malformed lines go to the quarantine (if given)."""
+    for line in iter_zst_lines(zst_file):
+        try:
+            obj = json.loads(line)
+            yield float(obj.get("created_utc") or 0), obj.get("id"), line
+        except (json.JSONDecodeError, TypeError, ValueError, AttributeError) as e:
+            if quarantine is not None and line.strip():
+                quarantine.add("merge", reason_code(e), line, e, path=zst_file)
+            continue
+
+
+def merge_comments(zst_files, quarantine=None):
+    """k-way merge of several zst files on created_utc, the inputs are
+    expected to be sorted by time, as Pushshift dumps are. Only the current
+    record of each file is held in memory, ids seen before are skipped."""
+    seen_ids = set()
+    streams = [iter_timed_lines(zst_file, quarantine) for zst_file in zst_files]
+    for _, comment_id, line in heapq.merge(*streams, key=itemgetter(0)):
+        if comment_id is not None:
+            if comment_id in seen_ids:
+                continue
+            seen_ids.add(comment_id)
+        yield line
+
+
+def merge_zst_files(zst_files, output_file, level=3, quarantine=None):
+    """Write the merged comments of several zst files to one zst file,
+    malformed lines go to the quarantine (if given)."""
+    count = 0
+    cctx = zstd.ZstdCompressor(level=level)
+    with open(output_file, "wb") as ofh, cctx.stream_writer(ofh) as writer:
+        for line in merge_comments(zst_files, quarantine):
+            writer.write(line + b"\n")
+            count += 1
+    return count
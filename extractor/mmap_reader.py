@@ -0,0 +1,181 @@
+"""
+Parallel filter stage for uncompressed NDJSON files (.ndjson, .jsonl):
+the file is memory-mapped and split into newline-aligned byte ranges,
+each worker maps the file itself and filters its own range
+"""
+
+import json
+import mmap
+import os
+import shutil
+
+import zstandard as zstd
+
+from .comment_tree import project_object, prune_object
+from .eventlog import EventWriter, FilterLog, summary_record
+from .quarantine import Quarantine
+from .trim_username_comments import filter_result, iter_filtered, new_filter_counts
+
+MIN_RANGE_SIZE = 4 * 1024 * 1024  # smaller files are split into fewer ranges
+RANGES_PER_PROCESS = 4
+
+
+def map_file(fh):
+    "Read-only memory map of an open file, None for an empty file."
+    if os.fstat(fh.fileno()).st_size == 0:
+        return None
+    return mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def line_ranges(path, parts):
+    """Split a file into at most parts (start, end) byte ranges,
+    each range ends after a newline or at the end of the file."""
+    with open(path, "rb") as fh:
+        mapped = map_file(fh)
+        if mapped is None:
+            return []
+        with mapped:
+            size = len(mapped)
+            step = max(size // max(parts, 1), MIN_RANGE_SIZE)
+            ranges, start = [], 0
+            while start < size:
+                newline = mapped.find(b"\n", min(start + step, size) - 1)
+                end = size if newline == -1 else newline + 1
+                ranges.append((start, end))
+                start = end
+    return ranges
+
+
+def iter_range_lines(mapped, start, end):
+    "Yield the lines of a byte range of a memory map, without the newline."
+    position = start
+    while position < end:
+        newline = mapped.find(b"\n", position, end)
+        if newline == -1:
+            newline = end
+        yield mapped[position:newline]
+        position = newline + 1
+
+
+def filter_range(
+    path,
+    start,
+    end,
+    output_file,
+    rules,
+    keep_fields=None,
+    log_file=None,
+    log_level="off",
+    log_sample_rate=0.01,
+    quarantine_file=None,
+):
+    """Filter one range of an NDJSON file into a zst file of its own,
+    kept comments are pruned (or projected on keep_fields),
+    malformed lines are written to quarantine_file.
+    Returns the filter counts and the statistics of the rules."""
+    counts = new_filter_counts()
+    filter_log = FilterLog(log_file, level=log_level, sample_rate=log_sample_rate)
+    log = filter_log.event if filter_log.enabled else None
+    quarantine = Quarantine(quarantine_file)
+    cctx = zstd.ZstdCompressor(level=15)
+
+    with open(path, "rb") as fh, map_file(fh) as mapped:
+        lines = (
+            line.decode(errors="ignore")
+            for line in iter_range_lines(mapped, start, end)
+        )
+        with open(output_file, "wb") as ofh, cctx.stream_writer(ofh) as writer:
+            for obj in iter_filtered(lines, rules, counts, log, quarantine):
+                if keep_fields:
+                    obj = project_object(obj, keep_fields)
+                else:
+                    prune_object(obj)
+                writer.write(json.dumps(obj).encode() + b"\n")
+
+    # the summary of all ranges is written by the parent
+    filter_log.close(summary=False)
+    quarantine.close()
+    return counts, rules.stats()
+
+
+def merge_counts(results):
+    "Sum the filter counts of several ranges."
+    total = new_filter_counts()
+    for counts in results:
+        for key, value in counts.items():
+            if key == "authors":
+                for author, count in value.items():
+                    total["authors"][author] = total["authors"].get(author, 0) + count
+            else:
+                total[key] += value
+    return total
+
+
+def concatenate(paths, output_file):
+    "Concatenate files (zst frames) into one file and remove them."
+    with open(output_file, "wb") as ofh:
+        for path in paths:
+            if os.path.exists(path):
+                with open(path, "rb") as fh:
+                    shutil.copyfileobj(fh, ofh)
+                os.remove(path)
+
+
+def filter_ndjson(
+    ndjson_file,
+    rules,
+    log_file,
+    pool,
+    processes,
+    keep_fields=None,
+    log_level="full",
+    log_sample_rate=0.01,
+    quarantine=None,
+):
+    """filter_comments for an uncompressed NDJSON file, the ranges are
+    filtered in the pool and written as consecutive frames of one zst file,
+    the rule statistics of the workers are added to rules"""
+    output_filename = f"{ndjson_file.rsplit('.', 1)[0]}_filtered.zst"
+    ranges = line_ranges(ndjson_file, processes * RANGES_PER_PROCESS)
+    range_files = [f"{output_filename}.{i:04d}" for i in range(len(ranges))]
+    log_files = [f"{log_file}.{i:04d}" for i in range(len(ranges))]
+    # workers quarantine to files of their own, taken over afterwards
+    quarantine_files = [f"{range_file}.quarantine" for range_file in range_files]
+
+    results = pool.starmap(
+        filter_range,
+        [
+            (
+                ndjson_file,
+                start,
+                end,
+                range_file,
+                rules,
+                keep_fields,
+                range_log,
+                log_level,
+                log_sample_rate,
+                quarantine_file if quarantine is not None else None,
+            )
+            for (start, end), range_file, range_log, quarantine_file in zip(
+                ranges, range_files, log_files, quarantine_files
+            )
+        ],
+        chunksize=1,
+    )
+    concatenate(range_files, output_filename)
+    counts = merge_counts(range_counts for range_counts, _ in results)
+    for _, rule_stats in results:
+        rules.merge_stats(rule_stats)
+    if quarantine is not None:
+        for quarantine_file in quarantine_files:
+            quarantine.absorb(quarantine_file)
+
+    if log_level != "off":
+        # range logs in file order, followed by the summary record
+        summary_log = f"{log_file}.summary"
+        writer = EventWriter(summary_log)
+        writer.write(summary_record(log_level, counts))
+        writer.close()
+        concatenate(log_files + [summary_log], log_file)
+    return filter_result(counts, rules.authors)
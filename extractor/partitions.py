@@ -0,0 +1,80 @@
+"""
+Time-partitioned output layout: <output dir>/<year>/<month>/<shard>/,
+keyed on created_utc of a comment, or of the last comment of a thread.
+Shard directories are assigned per batch by the main process, with a
+counter per partition, and a manifest lists the partitions of a run.
+"""
+
+import json
+import os
+import time
+
+from collections import Counter, defaultdict
+
+from .utils import ShardAllocator
+
+
+def partition_key(comment):
+    "year/month of a comment (UTC)."
+    created = time.gmtime(int(comment.get("created_utc") or 0))
+    return f"{created.tm_year:04d}/{created.tm_mon:02d}"
+
+
+def partition_batches(comments, size, key=partition_key):
+    """Group a stream of comments into batches of one partition each,
+    yields (partition, batch) with at most size comments per batch."""
+    pending = defaultdict(list)
+    for comment in comments:
+        partition = key(comment)
+        batch = pending[partition]
+        batch.append(comment)
+        if len(batch) >= size:
+            yield partition, batch
+            del pending[partition]
+    for partition, batch in pending.items():
+        yield partition, batch
+
+
+def source_partition(path, root):
+    """Partition of an archive file below root (<root>/<year>/<month>/<shard>/),
+    "." for files of an archive without partitions."""
+    partition = os.path.relpath(os.path.dirname(os.path.dirname(path)), root)
+    return "." if partition.startswith("..") else partition
+
+
+class PartitionedLayout:
+    """Shard directories of the JSON and XML output per partition,
+    continuing after the shards already in the output."""
+
+    def __init__(self, json_dir, xml_dir):
+        self.json_dir = json_dir
+        self.xml_dir = xml_dir
+        self.allocators = {}
+        self.files = Counter()
+        self.comments = Counter()
+
+    def assign(self, partition, files, comments=0):
+        "JSON and XML shard directory for a batch of files of a partition."
+        allocators = self.allocators.get(partition)
+        if allocators is None:
+            allocators = self.allocators[partition] = (
+                ShardAllocator(os.path.join(self.json_dir, partition)).resume(),
+                ShardAllocator(os.path.join(self.xml_dir, partition)).resume(),
+            )
+        self.files[partition] += files
+        self.comments[partition] += comments
+        return allocators[0].next_dir(files), allocators[1].next_dir(files)
+
+    def write_manifest(self, path):
+        "List the partitions with their directories and sizes."
+        base = os.path.dirname(os.path.abspath(path))
+        manifest = {
+            "json_dir": os.path.relpath(self.json_dir, base),
+            "xml_dir": os.path.relpath(self.xml_dir, base),
+            "partitions": {
+                partition: {"files": self.files[partition], "comments": self.comments[partition]}
+                for partition in sorted(self.allocators)
+            },
+        }
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=4)
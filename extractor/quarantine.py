@@ -0,0 +1,92 @@
+"""
+Quarantine for lines and records that can't be processed: they are written
+with their stage and a reason code to a compressed side file (NDJSON),
+only the counters are reported
+"""
+
+import json
+import os
+import sys
+
+from collections import Counter
+
+from .eventlog import EventWriter, read_events
+
+
+def reason_code(error):
+    "Short reason code for an exception."
+    if isinstance(error, json.JSONDecodeError):
+        return "invalid_json"
+    if isinstance(error, UnicodeDecodeError):
+        return "invalid_encoding"
+    if isinstance(error, KeyError):
+        return "missing_field"
+    if isinstance(error, (AttributeError, TypeError)):
+        return "invalid_record"
+    if isinstance(error, OSError):
+        return "io_error"
+    return "error"
+
+
+def quarantine_record(stage, reason, data=None, error=None, **fields):
+    """Quarantine entry for a raw line (bytes or str) or a parsed record,
+    fields are added as they are (e.g. the path of a file)."""
+    record = {"stage": stage, "reason": reason}
+    if isinstance(data, bytes):
+        data = data.decode("utf-8", errors="replace")
+    if isinstance(data, str):
+        record["line"] = data
+    elif data is not None:
+        record["record"] = data
+    if error is not None:
+        record["error"] = str(error)
+    record.update(fields)
+    return record
+
+
+class Quarantine:
+    """Counts quarantined records per stage and reason and writes them to
+    path, the file is only created with the first record (no path: count only)."""
+
+    def __init__(self, path=None):
+        self.path = path
+        self.counts = Counter()
+        self._writer = None
+
+    def add(self, stage, reason, data=None, error=None, **fields):
+        self.add_record(quarantine_record(stage, reason, data, error, **fields))
+
+    def add_record(self, record):
+        self.counts[f"{record['stage']}:{record['reason']}"] += 1
+        if self.path is None:
+            return
+        if self._writer is None:
+            self._writer = EventWriter(self.path)
+        self._writer.write(record)
+
+    def absorb(self, path):
+        "Take over the records of a quarantine file written by a worker."
+        if not os.path.exists(path):
+            return
+        for record in read_events(path):
+            self.add_record(record)
+        os.remove(path)
+
+    def close(self):
+        "Flush the side file and return the counters."
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        return dict(self.counts)
+
+
+def print_quarantine(quarantine, file=sys.stdout):
+    "Run summary of the quarantined records."
+    if not quarantine.counts:
+        return
+    details = ", ".join(f"{key} {count}" for key, count in sorted(quarantine.counts.items()))
+    target = f" to {quarantine.path}" if quarantine.path else ""
+    print(
+        f"{sum(quarantine.counts.values())} record(s) quarantined{target} ({details}).",
+        file=file,
+    )
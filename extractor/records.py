@@ -0,0 +1,88 @@
+"""
+Compact records for the comments buffered in grouped mode: the values are
+kept in a tuple, the keys in a layout shared by all comments with the same
+fields, and repeated strings (author, subreddit, link_id) are interned
+"""
+
+import sys
+
+from collections.abc import Mapping
+
+INTERNED_FIELDS = frozenset(("author", "subreddit", "link_id"))
+
+# key layouts of the records: tuple of keys -> Layout
+layouts = {}
+
+
+class Layout:
+    """Key order and key -> position index, shared by compact records"""
+
+    __slots__ = ("keys", "index")
+
+    def __init__(self, keys):
+        self.keys = keys
+        self.index = {key: position for position, key in enumerate(keys)}
+
+    def __reduce__(self):
+        # shared again by the receiving process
+        return get_layout, (self.keys,)
+
+
+def get_layout(keys):
+    "The shared layout for a tuple of keys."
+    layout = layouts.get(keys)
+    if layout is None:
+        layout = layouts[keys] = Layout(keys)
+    return layout
+
+
+class CompactComment(Mapping):
+    """Read-only comment record, used by the tree builder, json2xml and
+    the JSON archive like the dict it was made from."""
+
+    __slots__ = ("layout", "values")
+
+    def __init__(self, layout, values):
+        self.layout = layout
+        self.values = values
+
+    def __getitem__(self, key):
+        return self.values[self.layout.index[key]]
+
+    def __iter__(self):
+        return iter(self.layout.keys)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __contains__(self, key):
+        return key in self.layout.index
+
+    def get(self, key, default=None):
+        position = self.layout.index.get(key)
+        return default if position is None else self.values[position]
+
+    def as_dict(self):
+        return dict(zip(self.layout.keys, self.values))
+
+    def __reduce__(self):
+        return CompactComment, (self.layout, self.values)
+
+    def __repr__(self):
+        return f"CompactComment({self.as_dict()!r})"
+
+
+def compact(comment):
+    "Compact record of a comment dict."
+    values = tuple(
+        sys.intern(value) if key in INTERNED_FIELDS and isinstance(value, str) else value
+        for key, value in comment.items()
+    )
+    return CompactComment(get_layout(tuple(comment)), values)
+
+
+def to_json(obj):
+    "json.dumps default: compact records are written as dicts."
+    if isinstance(obj, CompactComment):
+        return obj.as_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
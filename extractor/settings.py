@@ -0,0 +1,54 @@
+"""
+Defaults shared by the command line and the pipeline modules,
+kept free of heavy imports so that the CLI starts quickly
+"""
+
+import os
+
+# verbosity levels of the filter log
+LOG_LEVELS = ("off", "counts", "sample", "full")
+
+# whitelist alternative to UNWANTED_FIELDS, a trailing * matches a prefix
+KEEP_FIELDS = (
+    "id",
+    "link_id",
+    "parent_id",
+    "author",
+    "body",
+    "created_utc",
+    "subreddit",
+    "permalink",
+    "retrieved_*",
+)
+
+CORPUS_MAX_MEMBERS = 1000  # max. <TEI> documents in a <teiCorpus> file
+CORPUS_MAX_BYTES = 64 * 1024 * 1024  # max. size of a <teiCorpus> file
+
+# start methods of the worker processes
+START_METHODS = ("fork", "spawn", "forkserver")
+
+# streaming mode (input "-"): formats written to stdout
+STREAM_FORMATS = ("ndjson", "tei")
+STREAM_MAX_THREADS = 1000  # max. open threads buffered in grouped mode
+STREAM_MAX_COMMENTS = 100000  # max. comments buffered in grouped mode
+
+# uncompressed inputs, filtered range-parallel from a memory map
+NDJSON_EXTENSIONS = (".ndjson", ".jsonl")
+
+# filter rules and bot list, relative paths in the config are resolved
+# against the directory of the config file
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONFIG_DIR = os.path.join(ROOT_DIR, "src", "config")
+FILTER_CONFIG = os.path.join(CONFIG_DIR, "filters.json")
+
+# no-group dispatch through shared memory (--shared-memory): size of a block
+# of raw lines, blocks in flight per worker process
+SHARED_BLOCK_SIZE = 1024 * 1024
+SHARED_BLOCKS_PER_PROCESS = 2
+
+# validation of the XML output: "fast" checks the structure of every file and
+# validates a sample against the DTD, "full" validates every file (audits)
+VALIDATION_MODES = ("fast", "full")
+DTD_SAMPLE_RATE = 0.01
+# hash of the XML generator code at the last validation of all files
+VALIDATION_STATE = os.path.join(ROOT_DIR, "subreddits", ".validated_generator")
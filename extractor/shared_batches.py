@@ -0,0 +1,174 @@
+"""
+Dispatch of the no-group mode through shared memory (--shared-memory):
+the main process only splits the filtered file into lines and copies the
+raw bytes into blocks of shared memory, the workers get the name of a
+block and the end offsets of its lines, and parse the comments themselves.
+The blocks come from a fixed pool and are reused once their batch is
+done, so that the memory held by batches in flight stays bounded.
+"""
+
+import hashlib
+import json
+
+from collections import deque
+from multiprocessing.shared_memory import SharedMemory
+
+from .comment_processing import process_comment_batch
+from .comment_tree import project_object, prune_object
+from .quarantine import quarantine_record, reason_code
+from .settings import SHARED_BLOCK_SIZE, SHARED_BLOCKS_PER_PROCESS
+
+
+class BlockPool:
+    """Shared memory blocks of the main process, created once per run
+    and unlinked by close()."""
+
+    def __init__(self, count, size=SHARED_BLOCK_SIZE):
+        self.size = size
+        self.blocks = [SharedMemory(create=True, size=size) for _ in range(count)]
+        self.free = deque(range(count))
+
+    def write(self, number, lines):
+        "Copy lines into a block, returns the end offsets of the lines."
+        buf = self.blocks[number].buf
+        ends, pos = [], 0
+        for line in lines:
+            buf[pos : pos + len(line)] = line
+            pos += len(line)
+            ends.append(pos)
+        return ends
+
+    def close(self):
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+
+
+def unique_lines(lines):
+    """Skip lines seen before, by a digest of their bytes: the main process
+    doesn't know the ids, comments that occur again with a different line
+    are only skipped within a batch."""
+    seen = set()
+    for line in lines:
+        digest = hashlib.blake2b(line, digest_size=16).digest()
+        if digest not in seen:
+            seen.add(digest)
+            yield line
+
+
+def iter_line_batches(lines, chunk_size, block_size=SHARED_BLOCK_SIZE):
+    """Group lines into batches of at most chunk_size lines that fit into a
+    block, longer lines make up a batch of their own (sent without a block)."""
+    batch, size = [], 0
+    for line in lines:
+        if len(line) > block_size:
+            if batch:
+                yield batch, True
+                batch, size = [], 0
+            yield [line], False
+            continue
+        if len(batch) == chunk_size or size + len(line) > block_size:
+            yield batch, True
+            batch, size = [], 0
+        batch.append(line)
+        size += len(line)
+    if batch:
+        yield batch, True
+
+
+def read_block(name, ends):
+    "Decoded lines of a block, attached only while reading."
+    block = SharedMemory(name=name)
+    try:
+        lines, start = [], 0
+        for end in ends:
+            lines.append(str(block.buf[start:end], "utf-8", "ignore"))
+            start = end
+    finally:
+        block.close()
+    return lines
+
+
+def parse_lines(lines, keep_fields=None):
+    """Comments of the lines as extract_comments reads them (duplicates are
+    only skipped within the lines), and quarantine records of the lines
+    that can't be processed."""
+    comments, failed = [], []
+    seen_ids = set()
+    for line in lines:
+        try:
+            obj = json.loads(line)
+            if obj.get("link_id", "").startswith("t3_") and obj["id"] not in seen_ids:
+                seen_ids.add(obj["id"])
+                if keep_fields:
+                    obj = project_object(obj, keep_fields)
+                else:
+                    prune_object(obj)
+                comments.append(obj)
+        except Exception as e:
+            if line.strip():
+                failed.append(quarantine_record("extract", reason_code(e), line, e))
+    return comments, failed
+
+
+def process_shared_batch(name, lines, json_output_dir, xml_output_dir, options=None):
+    """Worker: parse and process the lines of a batch, from the block name
+    with the end offsets as lines, or from the lines themselves (name None)."""
+    if name is not None:
+        lines = read_block(name, lines)
+    else:
+        lines = [line.decode(errors="ignore") for line in lines]
+    comments, failed = parse_lines(lines, (options or {}).get("keep_fields"))
+    result = process_comment_batch(comments, json_output_dir, xml_output_dir, options)
+    result["quarantine"][:0] = failed
+    result["errors"][:0] = [record["error"] for record in failed]
+    return result
+
+
+def dispatch_shared(
+    lines,
+    chunk_size,
+    shards,
+    options,
+    pool,
+    processes,
+    block_size=SHARED_BLOCK_SIZE,
+):
+    """Run process_shared_batch on the lines in the pool, with
+    SHARED_BLOCKS_PER_PROCESS blocks per worker process, shards is the
+    ShardLayout assigning the output directories of each batch. Returns
+    the batch results in order."""
+    blocks = BlockPool(processes * SHARED_BLOCKS_PER_PROCESS, block_size)
+    pending, results = deque(), []
+    corpus = bool(options.get("corpus"))
+    options = {**options, "fixed_dirs": True}
+    try:
+        for line_batch, shared in iter_line_batches(lines, chunk_size, blocks.size):
+            for batch, json_dir, xml_dir in shards.split(line_batch, corpus):
+                if not shared:
+                    task = pool.apply_async(
+                        process_shared_batch, (None, batch, json_dir, xml_dir, options)
+                    )
+                    pending.append((None, task))
+                    continue
+                while not blocks.free:
+                    # wait for the oldest batch, its block (if any) is free again
+                    number, task = pending.popleft()
+                    results.append(task.get())
+                    if number is not None:
+                        blocks.free.append(number)
+                number = blocks.free.popleft()
+                ends = blocks.write(number, batch)
+                task = pool.apply_async(
+                    process_shared_batch,
+                    (blocks.blocks[number].name, ends, json_dir, xml_dir, options),
+                )
+                pending.append((number, task))
+        while pending:
+            results.append(pending.popleft()[1].get())
+    finally:
+        # batches still running (after an error) must not lose their block
+        for _, task in pending:
+            task.wait()
+        blocks.close()
+    return results
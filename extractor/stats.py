@@ -0,0 +1,109 @@
+"""
+Corpus statistics collected while the comments pass through the workers:
+comments and tokens per year, body length histogram, approximate top-k
+authors and threads. The per-batch collectors are merged by the parent
+and written as JSON at the end of the run.
+"""
+
+import heapq
+import json
+import time
+
+from collections import Counter
+from operator import itemgetter
+
+TOP_K = 100  # authors and threads listed in the statistics
+TOP_K_CAPACITY = 10  # counters kept per listed entry, for accuracy
+
+
+class TopK:
+    """Approximate heavy hitters: counts are kept for at most
+    2 * capacity keys, above that only the capacity largest survive.
+    Counts are lower bounds, error is the largest count dropped so far."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}
+        self.error = 0
+
+    def add(self, key, count=1):
+        self.counts[key] = self.counts.get(key, 0) + count
+        if len(self.counts) > 2 * self.capacity:
+            self._prune()
+
+    def _prune(self):
+        ranked = sorted(self.counts.items(), key=itemgetter(1), reverse=True)
+        if len(ranked) > self.capacity:
+            self.error = max(self.error, ranked[self.capacity][1])
+        self.counts = dict(ranked[: self.capacity])
+
+    def merge(self, other):
+        for key, count in other.counts.items():
+            self.counts[key] = self.counts.get(key, 0) + count
+        self.error = max(self.error, other.error)
+        if len(self.counts) > 2 * self.capacity:
+            self._prune()
+
+    def top(self, k):
+        return heapq.nlargest(k, self.counts.items(), key=itemgetter(1))
+
+
+def length_bucket(length):
+    "Lower bound of the power-of-two bucket of a length (0, 1, 2, 4, 8, ...)."
+    return 1 << (length.bit_length() - 1) if length else 0
+
+
+class CorpusStats:
+    """Mergeable aggregates of the converted comments."""
+
+    def __init__(self, top_k=TOP_K):
+        self.top_k = top_k
+        self.comments = 0
+        self.tokens = 0
+        self.comments_per_year = Counter()
+        self.tokens_per_year = Counter()
+        self.body_lengths = Counter()
+        self.authors = TopK(top_k * TOP_K_CAPACITY)
+        self.threads = TopK(top_k * TOP_K_CAPACITY)
+
+    def add(self, comment):
+        body = comment.get("body") or ""
+        tokens = len(body.split())
+        year = time.gmtime(int(comment.get("created_utc") or 0)).tm_year
+        self.comments += 1
+        self.tokens += tokens
+        self.comments_per_year[year] += 1
+        self.tokens_per_year[year] += tokens
+        self.body_lengths[length_bucket(len(body))] += 1
+        self.authors.add(comment.get("author"))
+        self.threads.add((comment.get("link_id") or "").replace("t3_", ""))
+
+    def merge(self, other):
+        self.comments += other.comments
+        self.tokens += other.tokens
+        self.comments_per_year.update(other.comments_per_year)
+        self.tokens_per_year.update(other.tokens_per_year)
+        self.body_lengths.update(other.body_lengths)
+        self.authors.merge(other.authors)
+        self.threads.merge(other.threads)
+
+    def as_dict(self):
+        return {
+            "comments": self.comments,
+            "tokens": self.tokens,
+            "comments_per_year": dict(sorted(self.comments_per_year.items())),
+            "tokens_per_year": dict(sorted(self.tokens_per_year.items())),
+            "body_length_histogram": dict(sorted(self.body_lengths.items())),
+            "top_authors": self.authors.top(self.top_k),
+            "top_authors_error": self.authors.error,
+            "top_threads": self.threads.top(self.top_k),
+            "top_threads_error": self.threads.error,
+        }
+
+
+def write_stats(path, stats, **extra):
+    """Write the statistics and further sections (e.g. filter counts) as JSON."""
+    data = stats.as_dict()
+    data.update(extra)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=4, ensure_ascii=False)
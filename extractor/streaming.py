@@ -0,0 +1,188 @@
+"""
+Streaming mode: read comments as NDJSON (plain or zstd-compressed) from
+a binary stream such as stdin and write filtered NDJSON or TEI documents
+to another stream, so that the pipeline can sit between other tools
+without intermediate files
+"""
+
+import io
+import json
+import sys
+
+from collections import OrderedDict
+
+import zstandard as zstd
+
+from .comment_processing import CorpusWriter
+from .comment_tree import project_object, prune_object
+from .eventlog import FilterLog
+from .filter_rules import load_rules
+from .json2xml import build_tei, serialize_tei
+from .quarantine import Quarantine, print_quarantine, reason_code
+from .records import compact
+from .settings import STREAM_MAX_COMMENTS, STREAM_MAX_THREADS
+from .trim_username_comments import filter_result, iter_filtered, new_filter_counts
+from .utils import iter_stream_lines
+
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+def open_stream(fh):
+    "Binary reader for fh, decompressed if the data starts with a zstd frame."
+    if not hasattr(fh, "peek"):
+        fh = io.BufferedReader(fh)
+    if fh.peek(4)[:4] == ZSTD_MAGIC:
+        # concatenated frames (e.g. from zstd -c a.zst b.zst) are read as one stream
+        return zstd.ZstdDecompressor().stream_reader(fh, read_across_frames=True)
+    return fh
+
+
+def iter_extracted(comments, keep_fields=None):
+    """Skip duplicates and comments without a thread, then prune or
+    project the comments, as extract_comments does for files."""
+    seen_ids = set()
+    for obj in comments:
+        comment_id = obj.get("id")
+        if not obj.get("link_id", "").startswith("t3_") or comment_id in seen_ids:
+            continue
+        seen_ids.add(comment_id)
+        if keep_fields:
+            yield project_object(obj, keep_fields)
+        else:
+            prune_object(obj)
+            yield obj
+
+
+class ThreadBuffer:
+    """Comments of the most recently updated threads, grouped by thread.
+    With more than max_threads threads or max_comments comments buffered,
+    the least recently updated thread is emitted; comments of this thread
+    arriving later end up in another document."""
+
+    def __init__(
+        self, emit, max_threads=STREAM_MAX_THREADS, max_comments=STREAM_MAX_COMMENTS
+    ):
+        self.emit = emit
+        self.max_threads = max_threads
+        self.max_comments = max_comments
+        self.threads = OrderedDict()
+        self.size = 0
+
+    def add(self, thread_id, comment):
+        comments = self.threads.get(thread_id)
+        if comments is None:
+            comments = self.threads[thread_id] = []
+        else:
+            self.threads.move_to_end(thread_id)
+        comments.append(comment)
+        self.size += 1
+        while len(self.threads) > self.max_threads or self.size > self.max_comments:
+            self._emit_oldest()
+
+    def _emit_oldest(self):
+        thread_id, comments = self.threads.popitem(last=False)
+        self.size -= len(comments)
+        self.emit(thread_id, comments)
+
+    def flush(self):
+        "Emit all buffered threads, oldest first."
+        while self.threads:
+            self._emit_oldest()
+
+
+def stream_pipeline(
+    infile,
+    outfile,
+    output_format="ndjson",
+    group_mode=True,
+    keep_fields=None,
+    corpus=None,
+    tree=False,
+    max_threads=STREAM_MAX_THREADS,
+    max_comments=STREAM_MAX_COMMENTS,
+    log_level="counts",
+    log_file="filtered_log_stdin.ndjson.zst",
+    quarantine_file="quarantine_stdin.ndjson.zst",
+    rules=None,
+    status=sys.stderr,
+):
+    """Filter the comments of infile and write them to outfile,
+    as NDJSON (the filtered comments, like the _filtered.zst file)
+    or as concatenated TEI documents (<teiCorpus> documents if corpus
+    is (max. members, max. bytes)), filtered with rules (FilterPipeline,
+    default: the default config). Malformed lines and documents that fail
+    are written to quarantine_file. Returns the number of comments written."""
+    if rules is None:
+        rules = load_rules()
+    counts = new_filter_counts()
+    filter_log = FilterLog(log_file, level=log_level)
+    log = filter_log.event if filter_log.enabled else None
+    quarantine = Quarantine(quarantine_file)
+
+    lines = (
+        line.decode(errors="ignore") for line in iter_stream_lines(open_stream(infile))
+    )
+    comments = iter_filtered(lines, rules, counts, log, quarantine)
+    written = 0
+
+    if output_format == "ndjson":
+        for obj in comments:
+            outfile.write(json.dumps(obj).encode() + b"\n")
+            written += 1
+    else:
+        writer = None
+        if corpus:
+            writer = CorpusWriter(None, group_mode, *corpus, stream=outfile)
+
+        def emit(doc_id, doc_comments, link_id):
+            nonlocal written
+            try:
+                teidoc, _ = build_tei(
+                    doc_comments,
+                    link_id=link_id,
+                    group_mode=group_mode,
+                    tree_structure=tree,
+                )
+            except Exception as e:
+                quarantine.add(
+                    "convert", reason_code(e), doc_comments, f"Error processing {doc_id}: {e}"
+                )
+                return
+            if writer is not None:
+                writer.add(doc_id, serialize_tei(teidoc), doc_comments[-1])
+            else:
+                outfile.write(serialize_tei(teidoc))
+            written += len(doc_comments)
+
+        extracted = iter_extracted(comments, keep_fields)
+        if group_mode:
+            buffer = ThreadBuffer(
+                lambda thread_id, thread: emit(thread_id, thread, thread_id),
+                max_threads,
+                max_comments,
+            )
+            for comment in extracted:
+                buffer.add(comment["link_id"][3:], compact(comment))
+            buffer.flush()
+        else:
+            for comment in extracted:
+                link_id = comment["link_id"][3:]
+                emit(f"{link_id}_{comment.get('id')}", [comment], link_id)
+        if writer is not None:
+            writer.flush()
+    outfile.flush()
+
+    filter_log.close(counts=counts)
+    excluded_counts, deleted, quote, remindme, url_removal, url_only = filter_result(
+        counts, rules.authors
+    )
+    print(
+        f"{written} comment(s) written, {sum(excluded_counts.values())} from "
+        f"excluded authors, {deleted} deleted/removed, {url_only} only a URL, "
+        f"{remindme} RemindMeBot call(s); {quote} quote(s) and "
+        f"{url_removal} URL(s) removed.",
+        file=status,
+    )
+    quarantine.close()
+    print_quarantine(quarantine, file=status)
+    return written
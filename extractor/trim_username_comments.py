@@ -12,6 +12,10 @@ import re
 
 import zstandard as zstd
 
+from .eventlog import FilterLog
+from .quarantine import reason_code
+from .settings import CONFIG_DIR, NDJSON_EXTENSIONS
+from .utils import iter_zst_lines
 
 CHUNK_SIZE = 16384
 
@@ -34,8 +38,8 @@ bold_text_regex = re.compile(r"\*\*(?!\s)(.*?)(?<!\s)\*\*")
 italic_text_regex = re.compile(r"\*(?!\s)(.*?)(?<!\s)\*")
 
 
-def read_bot_list(config_dir="src/config"):
-    bot_file_path = os.path.join(config_dir, "botlist.txt")
+def read_bot_list(config_dir=CONFIG_DIR, filename="botlist.txt"):
+    bot_file_path = os.path.join(config_dir, filename)
     bot_file_path = os.path.normpath(bot_file_path)  # normalize path
     with open(bot_file_path, "r", encoding="utf-8") as inputfile:
         bots = [line.strip().lower() for line in inputfile.readlines() if line.strip()]
@@ -74,277 +78,185 @@ def is_comment_empty(comment_body):
     return not comment_body.strip()
 
 
+# pre 2023 quotation: matches a citation marker at the start of a line or
+# text, capturing everything up to the next citation marker, newline,
+# or end of text
+quote_regex = re.compile(r"(?:\n|^)(&gt;.*?)(?=(\n&gt;)|\n|$)")
+
+# onwards 2023 quotation
+modern_quote_regex = re.compile(r"(?:\n|^)>[^\n]+(\n>[^\n]*)*")
+
+# catches various ways users try to summon the RemindMeBot, even though
+# there's technically just one right way to do it..it can vary..
+remindme_regex = re.compile(
+    r"^\s*(!remindme|!RemindMe|!remind me|RemindMe!|Remind me!)\b", re.IGNORECASE
+)
+
+deleted_tags = ["[removed]", "[deleted]", "[removed by reddit]"]
+
+
+def new_filter_counts():
+    """counters updated by iter_filtered"""
+    return {
+        "authors": {},
+        "deleted": 0,
+        "url_only": 0,
+        "quote": 0,
+        "remindme": 0,
+        "urls_removed": 0,
+    }
+
+
+def iter_filtered(lines, rules, counts, log=None, quarantine=None):
+    """Apply the rules (a filter_rules.FilterPipeline) to NDJSON lines (str)
+    and yield the kept comments, counts is updated in place, log is
+    a FilterLog.event or None, malformed lines go to the quarantine (if given)."""
+    # imported here, filter_rules builds on this module
+    from .filter_rules import Record
+
+    last_modified_body = None
+
+    for raw_line in lines:
+        # apply inline-formatting removals
+        line = remove_inline_formatting(raw_line)
+
+        try:
+            obj = json.loads(line)
+            record = Record(obj)
+        except (json.JSONDecodeError, AttributeError, TypeError) as e:
+            # not JSON, or not a comment object (e.g. a null body)
+            if quarantine is not None and raw_line.strip():
+                quarantine.add("filter", reason_code(e), raw_line, e)
+            continue
+
+        if rules.apply(record, counts, log):
+            continue
+
+        # remove all Zero-Width Spaces and reduce multiple
+        # newlines down to a single one
+        # this is done for all comments,
+        # regardless of other modifications
+        obj["body"] = zero_width_space_regex.sub("", obj.get("body", ""))
+        obj["body"] = newline_regex.sub("\n", obj.get("body", ""))
+
+        # check if we got any modifications, only log if applicable
+        if log and record.changes and last_modified_body != obj["body"]:
+            # refresh last_modified_body
+            last_modified_body = obj["body"]
+
+            # logging the changes if there are any
+            for event in record.changes:
+                log(
+                    event,
+                    id=obj.get("id"),
+                    original=record.original_body,
+                    modified=obj["body"],
+                )
+
+        # check if the comment is empty after all modifications
+        # and cleaning
+        if is_comment_empty(obj.get("body", "")):
+            # logging empty and ignored comments
+            if log:
+                log("empty", id=obj.get("id"), original=record.original_body)
+            # skip writing this comment to the output file
+            continue
+
+        # the updated comment is kept
+        yield obj
+
+
+def filter_result(counts, authors):
+    """counts in the form returned by filter_comments"""
+    excluded_counts = {author.lower(): 0 for author in authors} if authors else {}
+    excluded_counts.update(counts["authors"])
+    return (
+        excluded_counts,
+        counts["deleted"],
+        counts["quote"],
+        counts["remindme"],
+        counts["urls_removed"],
+        counts["url_only"],
+    )
+
+
 def filter_comments(
     zst_file,
-    authors,
-    remove_deleted,
-    remove_quotes,
-    remove_remindme,
-    remove_urls,
+    rules,
     log_file,
+    log_level="full",
+    log_sample_rate=0.01,
+    quarantine=None,
 ):
-    dctx = zstd.ZstdDecompressor()
     cctx = zstd.ZstdCompressor(level=15)
 
-    # pre 2023 quotation: matches a citation marker at the start of a line or
-    # text, capturing everything up to the next citation marker, newline,
-    # or end of text
-    quote_regex = re.compile(r"(?:\n|^)(&gt;.*?)(?=(\n&gt;)|\n|$)")
-
-    # onwards 2023 quotation
-    modern_quote_regex = re.compile(r"(?:\n|^)>[^\n]+(\n>[^\n]*)*")
-
-    # catches various ways users try to summon the RemindMeBot, even though
-    # there's technically just one right way to do it..it can vary..
-    remindme_regex = re.compile(
-        r"^\s*(!remindme|!RemindMe|!remind me|RemindMe!|Remind me!)\b", re.IGNORECASE
-    )
-
     input_filename = zst_file
     output_filename = f"{zst_file.rsplit('.', 1)[0]}_filtered.zst"
     log_filename = log_file
 
-    excluded_counts = {author.lower(): 0 for author in authors} if authors else {}
-    deleted_count = 0
-    removed_url_only_comments_count = 0
-    quote_removal_count = 0
-    remindme_count = 0
-    url_removal_count = 0
-
-    with open(input_filename, "rb") as fh, open(output_filename, "wb") as ofh, open(
-        log_filename, "w", encoding="utf-8"
-    ) as lf:
-        lf.write("Logfile initiated.\n")
-        with dctx.stream_reader(fh) as reader, cctx.stream_writer(ofh) as writer:
-            bufferstr = ""
-            deleted_tags = ["[removed]", "[deleted]", "[removed by reddit]"]
-
-            while True:
-                chunk = reader.read(CHUNK_SIZE)
-                if not chunk:
-                    break
-
-                bufferstr += chunk.decode(errors="ignore")
-
-                # initialize last_modified_body for every new chunk
-                last_modified_body = None
-
-                while True:
-                    position = bufferstr.find("\n")
-
-                    if position == -1:
-                        break
-
-                    line = bufferstr[:position]
-                    bufferstr = bufferstr[position + 1 :]
-
-                    # apply inline-formatting removals
-                    line = remove_inline_formatting(line)
-
-                    # reset flags for every iteration
-                    quote_changed = False
-                    url_changed = False
-
-                    try:
-                        obj = json.loads(line)
-                        body_changed = False
-                        original_body = obj.get("body", "").strip()
-                        author = obj.get("author", "").lower()
-
-                        # check and filter out comments from specific authors
-                        if authors and author in authors:
-                            excluded_counts[author] += 1
-                            # skip further processing for this comment
-                            continue
-
-                        # check and remove deleted or removed comments
-                        if remove_deleted and original_body in deleted_tags:
-                            deleted_count += 1
-                            # log the removal
-                            lf.write("\n=========== body: deleted/removed ==========\n")
-                            lf.write(
-                                json.dumps(
-                                    {"original": original_body, "deleted_comment": obj}
-                                )
-                                + "\n"
-                            )
-                            continue
-
-                        # check if body-text is just plaintext URL
-                        if remove_urls and plain_url_regex.fullmatch(original_body):
-                            removed_url_only_comments_count += 1
-                            # log the removal
-                            lf.write(
-                                "\n=========== body: removed due to being only a URL ==========\n"
-                            )
-                            lf.write(json.dumps({"original": original_body}) + "\n")
-                            continue
-
-                        # remove quotations
-                        if remove_quotes:
-                            cleaned_body_before_strip = re.sub(
-                                quote_regex, "", original_body
-                            )
-                            cleaned_body_after_strip = re.sub(
-                                modern_quote_regex, "", cleaned_body_before_strip
-                            ).strip()
-
-                            # check if significant changes were made, besides removing whitespace
-                            substantial_change_made = (
-                                cleaned_body_before_strip.strip()
-                                != obj.get("body", "").strip()
-                            ) or (
-                                cleaned_body_after_strip
-                                != cleaned_body_before_strip.strip()
-                            )
-
-                            if substantial_change_made:
-                                obj["body"] = cleaned_body_after_strip
-                                quote_removal_count += 1
-                                quote_changed = True
-                                body_changed = True
-
-                        # remove URLs
-                        if remove_urls:
-                            # count URLs in comments
-                            original_plain_url_count = len(
-                                plain_url_regex.findall(obj.get("body", ""))
-                            )
-                            original_markdown_url_count = len(
-                                markdown_url_regex.findall(obj.get("body", ""))
-                            )
-
-                            # for markdown URLs
-                            new_body_markdown_urls_removed = remove_markdown_urls(
-                                obj.get("body", "")
-                            )
-                            # for plain URLs
-                            new_body_plain_urls_removed = remove_plain_urls(
-                                new_body_markdown_urls_removed
-                            )
-
-                            if new_body_plain_urls_removed != obj.get("body", ""):
-                                obj["body"] = new_body_plain_urls_removed
-                                body_changed = True
-                                url_changed = True
-
-                                # count URLs after processing
-                                new_plain_url_count = len(
-                                    plain_url_regex.findall(obj["body"])
-                                )
-                                new_markdown_url_count = len(
-                                    markdown_url_regex.findall(obj["body"])
-                                )
-
-                                # count number of processed URLs and add to url_removal_count
-                                urls_removed = (
-                                    original_plain_url_count - new_plain_url_count
-                                ) + (
-                                    original_markdown_url_count - new_markdown_url_count
-                                )
-                                url_removal_count += urls_removed
-
-                                cleaned_body = obj["body"].strip()
-                                # match strings consisting only of "[URL]"
-                                # followed by any combination of
-                                # "!", "?", ".", spaces, or newlines,
-                                # repeated any number of times
-
-                                if not cleaned_body or re.fullmatch(
-                                    r"(\[URL\]([!?\.])*[\s\n]*)+", cleaned_body
-                                ):
-                                    # log comment and skip writing in output data
-                                    lf.write(
-                                        "\n=========== body: only [URL] placeholders ==========\n"
-                                    )
-                                    lf.write(
-                                        json.dumps({"original": original_body}) + "\n"
-                                    )
-                                    continue  # skip comment
-
-                        # remove RemindMe bot invocations
-                        if remove_remindme and remindme_regex.search(obj.get("body", "")):
-                            remindme_count += 1
-                            lf.write("\n=========== body: !remindme ==========\n")
-                            lf.write(json.dumps({"original": obj.get("body", "")}) + "\n")
-                            continue
-
-                        # remove all Zero-Width Spaces and reduce multiple
-                        # newlines down to a single one
-                        # this is done for all comments,
-                        # regardless of other modifications
-                        obj["body"] = zero_width_space_regex.sub("", obj.get("body", ""))
-                        obj["body"] = newline_regex.sub("\n", obj.get("body", ""))
-
-                        if body_changed:  # check if we got any modifications
-                            # only log if applicable
-                            if last_modified_body != obj["body"]:
-                                # refresh last_modified_body
-                                last_modified_body = obj["body"]
-
-                                # logging the changes if there are any
-                                if quote_changed:
-                                    lf.write(
-                                        "\n=========== body: contained quotation ==========\n"
-                                    )
-                                    lf.write(
-                                        json.dumps({"original": original_body}) + "\n\n"
-                                    )
-                                    lf.write(
-                                        json.dumps({"modified": obj["body"]}) + "\n"
-                                    )
-                                if url_changed:
-                                    lf.write(
-                                        "\n=========== body: URL (any type) ==========\n"
-                                    )
-                                    lf.write(
-                                        json.dumps({"original": original_body}) + "\n\n"
-                                    )
-                                    lf.write(
-                                        json.dumps({"modified": obj["body"]}) + "\n"
-                                    )
-
-                        # check if the comment is empty after all modifications
-                        # and cleaning
-                        if is_comment_empty(obj.get("body", "")):
-                            # logging empty and ignored comments
-                            lf.write(
-                                "\n=========== body: empty or whitespace only ==========\n"
-                            )
-                            lf.write(json.dumps({"original": original_body}) + "\n")
-                            # skip writing this comment to the output file
-                            continue
-
-                        # writing the updated comment back to the output file
-                        writer.write(json.dumps(obj).encode() + b"\n")
-
-                    except json.JSONDecodeError:
-                        continue
+    counts = new_filter_counts()
+    filter_log = FilterLog(log_filename, level=log_level, sample_rate=log_sample_rate)
+    # None unless events are actually recorded, the loop only checks for it
+    log = filter_log.event if filter_log.enabled else None
 
-    return (
-        excluded_counts,
-        deleted_count,
-        quote_removal_count,
-        remindme_count,
-        url_removal_count,
-        removed_url_only_comments_count,
+    lines = (
+        line.decode(errors="ignore")
+        for line in iter_zst_lines(input_filename, CHUNK_SIZE)
     )
+    with open(output_filename, "wb") as ofh, cctx.stream_writer(ofh) as writer:
+        for obj in iter_filtered(lines, rules, counts, log, quarantine):
+            # writing the updated comment back to the output file
+            writer.write(json.dumps(obj).encode() + b"\n")
+
+    filter_log.close(counts=counts)
+    return filter_result(counts, rules.authors)
 
 
 def process_comments(
     zst_file,
-    remove_deleted=False,
-    remove_quotes=False,
-    remove_remindme=False,
-    remove_urls=False,
+    rules=None,
+    log_level="full",
+    log_sample_rate=0.01,
+    pool=None,
+    processes=None,
+    keep_fields=None,
+    quarantine=None,
 ):
-    # read botlist
-    authors = read_bot_list()
+    """filter a zst file, or an uncompressed NDJSON file in parallel
+    in the pool (kept comments pruned or projected on keep_fields),
+    with rules (FilterPipeline, default: the rules of the default config),
+    malformed lines are written to the quarantine.
+    Returns the counts in the form of filter_comments."""
+    from .filter_rules import load_rules, print_rules
+
+    if rules is None:
+        rules = load_rules()
     # extract file name and path
     input_filename_without_path = os.path.basename(zst_file)
     input_filename_without_extension = input_filename_without_path.rsplit(".", 1)[0]
-    log_filename = f"filtered_log_{input_filename_without_extension}.txt"
-
+    log_filename = f"filtered_log_{input_filename_without_extension}.ndjson.zst"
+
+    filter_args = (zst_file, rules, log_filename)
+    if zst_file.endswith(NDJSON_EXTENSIONS) and pool is not None:
+        # imported here, mmap_reader builds on this module
+        from .mmap_reader import filter_ndjson
+
+        result = filter_ndjson(
+            *filter_args,
+            pool,
+            processes,
+            keep_fields=keep_fields,
+            log_level=log_level,
+            log_sample_rate=log_sample_rate,
+            quarantine=quarantine,
+        )
+    else:
+        result = filter_comments(
+            *filter_args,
+            log_level=log_level,
+            log_sample_rate=log_sample_rate,
+            quarantine=quarantine,
+        )
     (
         excluded_counts,
         deleted_count,
@@ -352,32 +264,27 @@ def process_comments(
         remindme_count,
         url_removal_count,
         removed_url_only_comments_count,
-    ) = filter_comments(
-        zst_file,
-        authors,
-        remove_deleted,
-        remove_quotes,
-        remove_remindme,
-        remove_urls,
-        log_filename,
-    )
+    ) = result
 
     for name, count in excluded_counts.items():
         if count > 0:
             print(f"{count} comment(s) from '{name}' excluded.")
 
-    if remove_deleted:
+    configured = rules.names()
+    if "deleted" in configured:
         print(f"{deleted_count} 'deleted/removed' comment(s) excluded.")
 
-    if remove_quotes:
+    if "quotes" in configured:
         print(f"{quote_removal_count} quote(s) removed from comments.")
 
-    if remove_remindme:
+    if "remindme" in configured:
         print(f"{remindme_count} comment(s) asking for RemindMeBot removed.")
 
-    if remove_urls:
+    if "urls" in configured:
         print(f"{url_removal_count} URL(s) removed from comments.")
 
     print(f"{removed_url_only_comments_count} comment(s) removed for being only a URL.")
 
+    print_rules(rules)
     print("Comments successfully filtered.")
+    return result
@@ -6,9 +6,11 @@ from itertools import islice
 
 import zstandard as zstd
 
+from .json_archive import JSON_SUFFIXES, read_json_bytes
+
 
-error_log = []  # error log for problematic JSON objects
 MAX_FILES_PER_DIR = 1000  # max files each folder
+COMMENT_COST = 200  # fixed cost per comment, in body bytes
 directory_state = defaultdict(lambda: {"current_dir": None})
 
 
@@ -32,6 +34,66 @@ def get_output_dir(base_dir):
     return state["current_dir"]
 
 
+class ShardAllocator:
+    """assigns numbered subdirectories with MAX_FILES_PER_DIR files each,
+    in the parent process, so that workers don't need to count files."""
+
+    def __init__(self, base_dir, max_files=MAX_FILES_PER_DIR):
+        self.base_dir = base_dir
+        self.max_files = max_files
+        self.count = 0
+
+    def next_dir(self, files=1):
+        """Directory for the next files (created by the writer), a new shard
+        is started if they don't fit into the current one."""
+        if files > self.room() and self.count % self.max_files:
+            self.count += self.room()
+        shard = self.count // self.max_files + 1
+        self.count += files
+        return os.path.join(self.base_dir, str(shard).zfill(5))
+
+    def room(self):
+        "Files that still fit into the current shard."
+        return self.max_files - self.count % self.max_files
+
+    def resume(self):
+        "Continue after the files already in the shards of base_dir."
+        if os.path.isdir(self.base_dir):
+            shards = sorted(int(d) for d in os.listdir(self.base_dir) if d.isdigit())
+            if shards:
+                last = os.path.join(self.base_dir, str(shards[-1]).zfill(5))
+                self.count = (shards[-1] - 1) * self.max_files + len(os.listdir(last))
+        return self
+
+
+class ShardLayout:
+    """JSON and XML shard directories of batches, assigned in the parent
+    process before dispatch: both continue after the shards already in
+    the output, and the files of an item get the same shard numbers."""
+
+    def __init__(self, json_dir, xml_dir, max_files=MAX_FILES_PER_DIR):
+        self.json_shards = ShardAllocator(json_dir, max_files).resume()
+        self.xml_shards = ShardAllocator(xml_dir, max_files).resume()
+
+    def assign(self, files, xml_files=None):
+        "JSON and XML directory for a batch of files (xml_files if they differ)."
+        return (
+            self.json_shards.next_dir(files),
+            self.xml_shards.next_dir(files if xml_files is None else xml_files),
+        )
+
+    def split(self, batch, corpus=False):
+        """Split a batch (one JSON and one XML file per item, one <teiCorpus>
+        file with corpus) at the shard boundaries, yields (part, json dir,
+        xml dir)."""
+        while batch:
+            room = self.json_shards.room()
+            if not corpus:
+                room = min(room, self.xml_shards.room())
+            part, batch = batch[:room], batch[room:]
+            yield (part, *self.assign(len(part), 1 if corpus else None))
+
+
 def make_chunks(iterable, n):
     """split list into n-sized chunks."""
     # 3.12+: https://docs.python.org/3/library/itertools.html#itertools.batched
@@ -40,12 +102,103 @@ def make_chunks(iterable, n):
         yield batch
 
 
+def thread_cost(comments):
+    """estimated processing cost of a thread, in body bytes"""
+    return sum(COMMENT_COST + len(comment.get("body", "")) for comment in comments)
+
+
+def balance_batches(items, batch_cost, cost=thread_cost):
+    """pack (thread_id, comments, ...) items into batches of similar total cost,
+    yields (cost, batch) with the most expensive batches first."""
+    weighted = sorted(
+        ((cost(item[1]), item) for item in items),
+        key=lambda item: item[0],
+        reverse=True,
+    )
+    batch, total = [], 0
+    for item_cost, item in weighted:
+        batch.append(item)
+        total += item_cost
+        # large threads end up alone in their batch, small ones are packed
+        if total >= batch_cost:
+            yield total, tuple(batch)
+            batch, total = [], 0
+    if batch:
+        yield total, tuple(batch)
+
+
+def balance_groups(groups, batch_cost, cost=thread_cost):
+    """balance_batches within each group of items (key -> items) that must not
+    be mixed, returns (cost, key, batch) with the most expensive batches first."""
+    return sorted(
+        (
+            (batch_total, key, batch)
+            for key, items in groups.items()
+            for batch_total, batch in balance_batches(items, batch_cost, cost)
+        ),
+        key=lambda item: item[0],
+        reverse=True,
+    )
+
+
+def split_thread(comments, max_comments=None, max_bytes=None):
+    """split the comments of a thread into consecutive parts with at most
+    max_comments comments and max_bytes body bytes (at least one comment)."""
+    if not max_comments and not max_bytes:
+        return [comments]
+    parts, part, size = [], [], 0
+    for comment in comments:
+        length = len(comment.get("body", "").encode("utf-8")) if max_bytes else 0
+        if part and (
+            (max_comments and len(part) >= max_comments)
+            or (max_bytes and size + length > max_bytes)
+        ):
+            parts.append(part)
+            part, size = [], 0
+        part.append(comment)
+        size += length
+    if part:
+        parts.append(part)
+    return parts
+
+
+def worker_utilization(results, wall_time, processes):
+    """share of the available worker time spent processing batches,
+    the busiest worker's time and the mean time per worker."""
+    busy = defaultdict(float)
+    for result in results:
+        busy[result["pid"]] += result["busy"]
+    if not busy or wall_time <= 0:
+        return 0.0, 0.0, 0.0
+    total = sum(busy.values())
+    return total / (wall_time * processes), max(busy.values()), total / len(busy)
+
+
+def iter_stream_lines(reader, chunk_size=65536):
+    "Yield the lines of a binary stream as bytes, without the newline."
+    buffer = b""
+    while chunk := reader.read(chunk_size):
+        lines = (buffer + chunk).split(b"\n")
+        buffer = lines.pop()
+        yield from lines
+    if buffer:
+        yield buffer
+
+
+def iter_zst_lines(zst_path, chunk_size=65536):
+    "Yield the lines of a zst-compressed NDJSON file as bytes, without the newline."
+    with open(zst_path, "rb") as inputfile:
+        dctx = zstd.ZstdDecompressor()
+        with dctx.stream_reader(inputfile, read_across_frames=True) as reader:
+            yield from iter_stream_lines(reader, chunk_size)
+
+
 def count_json_objects_in_zst(zst_path):
     "Count JSON objects in a .zst file with NDJSON content."
     count = 0
     with open(zst_path, "rb") as inputfile:
         dctx = zstd.ZstdDecompressor()
-        with dctx.stream_reader(inputfile) as reader:
+        with dctx.stream_reader(inputfile, read_across_frames=True) as reader:
             bufferstr = ""
             while chunk := reader.read(16384):
                 bufferstr += chunk.decode(errors="ignore")
@@ -62,19 +215,16 @@ def count_json_objects_in_directory(directory_path):
     count = 0
     for root, _, files in os.walk(directory_path):
         for file_name in files:
-            if file_name.endswith(".json"):
+            if file_name.endswith(JSON_SUFFIXES):
                 file_path = os.path.join(root, file_name)
-                with open(file_path, "r", encoding="utf-8") as inputfile:
-                    try:
-                        for line in inputfile:
-                            json.loads(line)
-                            count += 1
-                    except json.JSONDecodeError:
-                        # handle JSON array format
-                        inputfile.seek(0)
-                        data = json.load(inputfile)
-                        if isinstance(data, list):
-                            count += len(data)
+                text = read_json_bytes(file_path).decode("utf-8")
+                try:
+                    count += len([json.loads(line) for line in text.splitlines()])
+                except json.JSONDecodeError:
+                    # handle JSON array format
+                    data = json.loads(text)
+                    if isinstance(data, list):
+                        count += len(data)
     return count
 
 
@@ -92,5 +242,4 @@ def compare_json_counts(filtered_zst_path, json_output_dir):
         print(
             "Note: number of JSON objects differ, likely due to comments containing null bytes or control characters that couldn't be processed."
         )
-        if error_log:
-            print("Details on problematic objects are listed above.")
+        print("Details on problematic objects are written to the quarantine file.")
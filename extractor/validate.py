@@ -1,23 +1,375 @@
+import hashlib
 import os
+import re
 import sys
+import zlib
+
+from functools import lru_cache, partial
 
 from lxml import etree
 
+from .settings import DTD_SAMPLE_RATE, VALIDATION_STATE
+
+VALIDATION_BATCH_SIZE = 200  # files per task with a worker pool
 SOURCE_DIR = os.path.abspath(os.path.dirname(__file__))
-TEI_DTD = etree.DTD(os.path.join(SOURCE_DIR, "tei_corpus.dtd"))
+DTD_PATH = os.path.join(SOURCE_DIR, "tei_corpus.dtd")
+TEI_NS = "{http://www.tei-c.org/ns/1.0}"
+
+# modules that build the XML, a change of their code (or of the DTD)
+# is validated with the DTD on all files once
+GENERATOR_FILES = ("json2xml.py", "columns.py", "comment_processing.py", "tei_corpus.dtd")
+
+DATE = r"\d{4}-\d{2}-\d{2}"
+URL = r"https://www\.reddit\.com/r/\S+/"
+
+# the elements written by create_tei_header, create_corpus_header and
+# create_comment_element: "parent/element" -> (regex of the child
+# elements, attributes with a regex of their value, required attributes,
+# text and child tails allowed)
+SHAPES = {
+    "/TEI": ("teiHeader text", {}, (), False),
+    "teiCorpus/TEI": ("teiHeader text", {}, (), False),
+    "/teiCorpus": ("teiHeader( TEI)+", {}, (), False),
+    "TEI/teiHeader": ("fileDesc profileDesc", {}, (), False),
+    "teiCorpus/teiHeader": ("fileDesc", {}, (), False),
+    "teiHeader/fileDesc": ("titleStmt( extent)? publicationStmt sourceDesc", {}, (), False),
+    "fileDesc/titleStmt": ("title", {}, (), False),
+    "titleStmt/title": ("", {"type": "main|sub", "level": "a|m"}, ("type",), True),
+    "fileDesc/extent": ("", {}, (), True),
+    "fileDesc/publicationStmt": ("p", {}, (), False),
+    "publicationStmt/p": ("", {}, (), False),
+    "fileDesc/sourceDesc": ("bibl( biblFull)?", {}, (), False),
+    "sourceDesc/bibl": ("", {}, (), True),
+    "sourceDesc/biblFull": (
+        "titleStmt( extent)? publicationStmt( seriesStmt)?",
+        {},
+        (),
+        False,
+    ),
+    "biblFull/titleStmt": ("title( author)?", {}, (), False),
+    "titleStmt/author": ("", {}, (), True),
+    "biblFull/extent": ("", {}, (), True),
+    "biblFull/publicationStmt": ("publisher ptr( ptr)? date", {}, (), False),
+    "publicationStmt/publisher": ("", {}, (), False),
+    "publicationStmt/ptr": (
+        "",
+        {"type": "URL|thread|comment", "target": URL},
+        ("type", "target"),
+        False,
+    ),
+    "publicationStmt/date": ("", {"type": "last_comment"}, (), True),
+    "biblFull/seriesStmt": ("title title", {}, (), False),
+    "seriesStmt/title": ("", {"type": "main|sub", "level": "m"}, ("type", "level"), True),
+    "teiHeader/profileDesc": ("creation", {}, (), False),
+    "profileDesc/creation": ("date", {}, (), False),
+    "creation/date": ("", {"type": "download"}, ("type",), True),
+    "TEI/text": ("body", {}, (), False),
+    "text/body": ("div|p", {}, (), False),
+    "body/div": ("list", {"type": "comments"}, ("type",), False),
+    "body/p": ("(lb ?)*", {}, (), True),
+    "p/lb": ("", {}, (), False),
+    "div/list": ("(item ?)+", {}, (), False),
+    "item/list": ("(item ?)+", {}, (), False),
+    "list/item": ("(lb )*date name( list)?", {"source": URL, "corresp": URL}, ("source",), True),
+    "item/lb": ("", {}, (), False),
+    "item/date": ("", {}, (), True),
+    "item/name": ("", {}, (), True),
+}
+# the text of these elements is a date
+DATE_ELEMENTS = {"publicationStmt/date", "creation/date", "item/date"}
+
+# control characters, removed from the comments by the generator
+# (most of them aren't allowed in XML at all)
+CONTROL_REGEX = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\x7f-\x84\x86-\x9f\ufffe\uffff]")
+
+
+def tokens(*parts):
+    "Regex of consecutive serialized tags, with any whitespace in between."
+    return r"\s*".join(parts)
+
+
+# the same shapes as serialized documents, checked without parsing
+TEXT = r"[^<]*"
+VALUE = r'"[^"<]*"'
+URL_VALUE = f'"{URL}"'
+TITLE = f'<title type="main">{TEXT}</title>'
+HEADER = tokens(
+    "<teiHeader>",
+    "<fileDesc>",
+    "<titleStmt>",
+    TITLE,
+    "</titleStmt>",
+    "<publicationStmt>",
+    "<p/>",
+    "</publicationStmt>",
+    "<sourceDesc>",
+    f"<bibl>{TEXT}</bibl>",
+    "<biblFull>",
+    "(?:%s)",
+    "</biblFull>",
+    "</sourceDesc>",
+    "</fileDesc>",
+    "<profileDesc>",
+    "<creation>",
+    f'<date type="download">{DATE}</date>',
+    "</creation>",
+    "</profileDesc>",
+    "</teiHeader>",
+)
+GROUPED_BIBL = tokens(
+    "<titleStmt>",
+    TITLE,
+    "</titleStmt>",
+    f"(?:<extent>{TEXT}</extent>)?",
+    "<publicationStmt>",
+    "<publisher/>",
+    f'<ptr type="URL" target={URL_VALUE}/>',
+    f'<date type="last_comment">{DATE}</date>',
+    "</publicationStmt>",
+)
+NOGROUP_BIBL = tokens(
+    "<titleStmt>",
+    f'<title type="main" level="a">{TEXT}</title>',
+    f"(?:<author>{TEXT}</author>|<author/>)",
+    "</titleStmt>",
+    "<publicationStmt>",
+    "<publisher/>",
+    f'<ptr type="thread" target={URL_VALUE}/>',
+    f'<ptr type="comment" target={URL_VALUE}/>',
+    f"<date>{DATE}</date>",
+    "</publicationStmt>",
+    "<seriesStmt>",
+    '<title type="main" level="m">Reddit</title>',
+    f'<title type="sub" level="m">{TEXT}</title>',
+    "</seriesStmt>",
+)
+# text up to the next tag, never backtracked into (possessive quantifiers
+# need Python 3.11, the lookahead keeps 3.10 linear but slower on failures)
+TEXT_RUN = r"[^<]++" if sys.version_info >= (3, 11) else r"[^<]+(?=<)"
+# items of a list, nested lists are only checked for balance (check_document)
+ITEM_TOKENS = "|".join(
+    (
+        f"<item source={URL_VALUE}(?: corresp={URL_VALUE})?>",
+        "<lb/>",
+        f"<date>{DATE}</date> (?:<name>{TEXT}</name>|<name/>) ",
+        "<list>",
+        "</list>",
+        "</item>",
+        TEXT_RUN,
+    )
+)
+GROUPED_BODY = tokens(
+    "<text>", "<body>", '<div type="comments">', f"<list>(?:{ITEM_TOKENS})*</list>", "</div>"
+)
+NOGROUP_BODY = tokens("<text>", "<body>", f"(?:<p>(?:{TEXT_RUN}|<lb/>)*</p>|<p/>)")
+TEI_DOCUMENT = tokens(
+    '<TEI xmlns="http://www.tei-c.org/ns/1.0">',
+    f"(?:{HEADER % GROUPED_BIBL}{tokens('', GROUPED_BODY)}"
+    f"|{HEADER % NOGROUP_BIBL}{tokens('', NOGROUP_BODY)})",
+    "</body>",
+    "</text>",
+    "</TEI>",
+)
+CORPUS_HEADER = tokens(
+    "<teiHeader>",
+    "<fileDesc>",
+    "<titleStmt>",
+    TITLE,
+    "</titleStmt>",
+    f"<extent>{TEXT}</extent>",
+    "<publicationStmt>",
+    "<p/>",
+    "</publicationStmt>",
+    "<sourceDesc>",
+    f"<bibl>{TEXT}</bibl>",
+    "</sourceDesc>",
+    "</fileDesc>",
+    "</teiHeader>",
+)
+DOCUMENT_REGEX = re.compile(
+    r"\s*(?:%s|%s)\s*"
+    % (
+        TEI_DOCUMENT,
+        tokens(
+            '<teiCorpus xmlns="http://www.tei-c.org/ns/1.0">',
+            CORPUS_HEADER,
+            f"(?:{TEI_DOCUMENT}\\s*)+",
+            "</teiCorpus>",
+        ),
+    )
+)
+
+
+@lru_cache(maxsize=None)
+def load_dtd(path):
+    """parse a DTD once per process"""
+    return etree.DTD(path)
+
+
+def get_dtd():
+    """the TEI DTD, parsed on first use and not at import time
+    (parsed DTDs can't be pickled, so each process parses its own)."""
+    return load_dtd(DTD_PATH)
+
+
+def __getattr__(name):
+    # lazy module attribute, formerly loaded at import
+    if name == "TEI_DTD":
+        return get_dtd()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def validate(path):
+    tei_dtd = get_dtd()
     xmldoc = etree.parse(path)
-    result = TEI_DTD.validate(xmldoc)
+    result = tei_dtd.validate(xmldoc)
     if result is False:
-        print("not a valid TEI document: %s", TEI_DTD.error_log.last_error)
+        print("not a valid TEI document: %s", tei_dtd.error_log.last_error)
         print(path, result)
     return result
 
 
-def validate_directory(directory):
-    """validates all XML files in the directory and subdirectories recursively."""
+@lru_cache(maxsize=None)
+def compiled_shape(key):
+    "SHAPES entry with compiled regexes, None for unknown elements."
+    if key not in SHAPES:
+        return None
+    children, attributes, required, text = SHAPES[key]
+    return (
+        re.compile(children),
+        {name: re.compile(value) for name, value in attributes.items()},
+        required,
+        text,
+    )
+
+
+def check_text(text, allowed):
+    "Problem with a text or tail, None if there is none."
+    if not text:
+        return None
+    if CONTROL_REGEX.search(text):
+        return "control character"
+    if not allowed and text.strip():
+        return "unexpected text"
+    return None
+
+
+def check_structure(root):
+    """Check a parsed document against the element shapes the generator
+    writes (SHAPES) and for control characters, returns a list of problems."""
+    problems = []
+    stack = [("", root)]
+    while stack:
+        parent, element = stack.pop()
+        if not isinstance(element.tag, str):
+            problems.append(f"unexpected node in <{parent}>")
+            continue
+        tag = element.tag.replace(TEI_NS, "")
+        key = f"{parent}/{tag}"
+        shape = compiled_shape(key)
+        if shape is None:
+            problems.append(f"unexpected <{tag}> in <{parent}>")
+            continue
+        children_regex, attributes, required, text = shape
+        children = list(element)
+        names = " ".join(
+            child.tag.replace(TEI_NS, "") if isinstance(child.tag, str) else "#node"
+            for child in children
+        )
+        if not children_regex.fullmatch(names):
+            problems.append(f"<{key}>: unexpected content {names!r}")
+        for name, value in element.attrib.items():
+            if name not in attributes:
+                problems.append(f"<{key}>: unexpected attribute {name}")
+            elif not attributes[name].fullmatch(value):
+                problems.append(f"<{key}>: invalid {name} {value!r}")
+            elif CONTROL_REGEX.search(value):
+                problems.append(f"<{key}>: control character in {name}")
+        problems.extend(
+            f"<{key}>: missing {name}" for name in required if name not in element.attrib
+        )
+        problem = check_text(element.text, text)
+        if problem is None and key in DATE_ELEMENTS and not re.fullmatch(DATE, element.text or ""):
+            problem = "invalid date"
+        if problem is not None:
+            problems.append(f"<{key}>: {problem}")
+        for child in children:
+            problem = check_text(child.tail, text)
+            if problem is not None:
+                problems.append(f"<{key}>: {problem} after a child")
+        stack.extend((tag, child) for child in reversed(children))
+    return problems
+
+
+def check_document(data):
+    """Fast check of a serialized document (bytes) without parsing it: UTF-8,
+    no control characters, the shapes of SHAPES as a regular expression and
+    balanced reply lists. Returns a problem or None."""
+    try:
+        text = data.decode("utf-8")
+    except UnicodeDecodeError as e:
+        return f"invalid UTF-8: {e}"
+    if CONTROL_REGEX.search(text):
+        return "control character"
+    if not DOCUMENT_REGEX.fullmatch(text):
+        return "unexpected structure"
+    if text.count("<item ") != text.count("</item>") or text.count("<list>") != text.count(
+        "</list>"
+    ):
+        return "unbalanced <item> or <list>"
+    return None
+
+
+def validate_structure(path):
+    """Fast check of a file written by the generator (see check_document)."""
+    with open(path, "rb") as f:
+        problem = check_document(f.read())
+    if problem is not None:
+        print(f"{path}: {problem}")
+    return problem is None
+
+
+def validate_sample(path):
+    "Check a file against the DTD and the shapes of the generator (check_structure)."
+    if not validate(path):
+        return False
+    problems = check_structure(etree.parse(path).getroot())
+    if problems:
+        print(f"{path}: " + "; ".join(problems[:5]))
+    return not problems
+
+
+def in_sample(path, rate):
+    "Deterministic sample of the paths, of about the given rate."
+    return zlib.crc32(os.fsencode(path)) % 10000 < rate * 10000
+
+
+def validate_files(paths, dtd_rate=None):
+    """validates a batch of XML files, returns the number of invalid files.
+    With dtd_rate (fast mode) the files are checked structurally and only
+    this share of them is also validated against the DTD."""
+    invalid = 0
+    for path in paths:
+        try:
+            if dtd_rate is None:
+                valid = validate(path)
+            else:
+                valid = validate_structure(path)
+                if valid and in_sample(path, dtd_rate):
+                    valid = validate_sample(path)
+            if not valid:
+                invalid += 1
+        except etree.XMLSyntaxError as e:
+            print(f"Syntax error in file {path}: {e}")
+            invalid += 1
+    return invalid
+
+
+def validate_directory(directory, pool=None, dtd_rate=None):
+    """validates all XML files in the directory and subdirectories recursively,
+    in batches on the worker pool if one is given. Without dtd_rate every
+    file is validated against the DTD (for audits)."""
+    paths = []
     for root, _, files in os.walk(
         directory
     ):  # all directories and subdirectories recursively
@@ -25,17 +377,68 @@ def validate_directory(directory):
             path = os.path.join(root, filename)
             # only validate XML files
             if path.endswith(".xml") and os.path.getsize(path) > 0:
-                try:
-                    validate(path)
-                except etree.XMLSyntaxError as e:
-                    print(f"Syntax error in file {path}: {e}")
+                paths.append(path)
             else:
                 print(f"Skipping invalid or empty file: {path}")
+    return validate_paths(paths, pool, dtd_rate)
+
+
+def validate_paths(paths, pool=None, dtd_rate=None):
+    """validates a list of XML files, in batches on the worker pool if one is given,
+    returns the number of invalid files (dtd_rate: see validate_files)."""
+    if pool is None:
+        return validate_files(paths, dtd_rate)
+    batches = [
+        paths[i : i + VALIDATION_BATCH_SIZE]
+        for i in range(0, len(paths), VALIDATION_BATCH_SIZE)
+    ]
+    return sum(pool.imap_unordered(partial(validate_files, dtd_rate=dtd_rate), batches))
+
+
+def generator_hash():
+    "Hash of the code that builds the XML and of the DTD."
+    digest = hashlib.sha256()
+    for filename in GENERATOR_FILES:
+        with open(os.path.join(SOURCE_DIR, filename), "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def validation_rate(mode, rate=DTD_SAMPLE_RATE, state_path=VALIDATION_STATE):
+    """dtd_rate of a validation mode (VALIDATION_MODES): None for "full" (every
+    file against the DTD), for "fast" rate, or 1.0 if the generator changed
+    since the hash in state_path was recorded."""
+    if mode == "full":
+        return None
+    try:
+        with open(state_path, "r", encoding="utf-8") as f:
+            recorded = f.read().strip()
+    except FileNotFoundError:
+        recorded = None
+    if recorded != generator_hash():
+        print("XML generator changed, validating all files against the DTD.")
+        return 1.0
+    return rate
+
+
+def record_validation(dtd_rate, invalid, state_path=VALIDATION_STATE):
+    "Record the generator hash after all files were validated without errors."
+    if dtd_rate != 1.0 or invalid:
+        return
+    os.makedirs(os.path.dirname(state_path), exist_ok=True)
+    with open(state_path, "w", encoding="utf-8") as f:
+        f.write(generator_hash() + "\n")
+
+
+def describe_validation(dtd_rate):
+    if dtd_rate is None:
+        return "DTD"
+    return f"structure, DTD on {dtd_rate:.0%}"
 
 
 if __name__ == "__main__":
-    # usage: python validate.py [directory] [tei_dtd(optional)]
+    # usage: python -m extractor.validate [directory] [tei_dtd(optional)]
     directory = sys.argv[1]
     if len(sys.argv) > 2:
-        TEI_DTD = etree.DTD(sys.argv[2])
+        DTD_PATH = sys.argv[2]
     validate_directory(directory)
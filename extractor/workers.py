@@ -0,0 +1,55 @@
+"""
+Long-lived worker pool shared by all input files and stages of a run
+"""
+
+import importlib
+import multiprocessing
+
+from multiprocessing import resource_tracker
+
+from contextlib import contextmanager
+
+from . import utils, validate
+from .settings import START_METHODS  # noqa: F401
+
+# modules the forkserver imports once, before forking the workers
+PRELOAD_MODULES = ["extractor.comment_processing", "extractor.json2xml", "extractor.validate"]
+
+
+def init_worker(preload_dtd=True):
+    """Pool initializer, runs once per worker: imports the modules (compiles
+    the regexes) and, with preload_dtd, parses the DTD unless inherited from
+    the parent (otherwise it is parsed on first use)."""
+    for module in PRELOAD_MODULES:
+        importlib.import_module(module)
+    if preload_dtd:
+        validate.get_dtd()
+    # don't continue output directories of the parent process
+    utils.directory_state.clear()
+
+
+def create_pool(processes=None, start_method=None, preload_dtd=True):
+    """Pool with initialized workers, start_method is one of START_METHODS
+    (forkserver: low-memory startup from a clean, pre-loaded server process),
+    preload_dtd for runs that validate every file against the DTD."""
+    context = multiprocessing.get_context(start_method)
+    # forked workers share the resource tracker of this process (shared memory
+    # blocks, see shared_batches) instead of starting their own
+    resource_tracker.ensure_running()
+    if start_method == "forkserver":
+        context.set_forkserver_preload(PRELOAD_MODULES)
+    return context.Pool(processes=processes, initializer=init_worker, initargs=(preload_dtd,))
+
+
+@contextmanager
+def use_pool(pool=None, processes=None, start_method=None, preload_dtd=True):
+    "Yield the given long-lived pool, or a temporary one for this call."
+    if pool is not None:
+        yield pool
+        return
+    pool = create_pool(processes, start_method, preload_dtd)
+    try:
+        yield pool
+    finally:
+        pool.close()
+        pool.join()
@@ -1,32 +1,145 @@
 import argparse
 import os
+import time
 
-from collections import defaultdict
-from multiprocessing import Pool
+from collections import Counter, defaultdict
+from itertools import chain, islice
 
-from extractor.comment_tree import extract_comments
-from extractor.comment_processing import process_comment_batch, process_thread_batch
-from extractor.json2xml import pipeline_json2xml
-from extractor.trim_username_comments import process_comments
-from extractor.utils import compare_json_counts, make_chunks
-from extractor.validate import validate_directory
+from extractor.settings import (
+    CORPUS_MAX_BYTES,
+    CORPUS_MAX_MEMBERS,
+    DTD_SAMPLE_RATE,
+    FILTER_CONFIG,
+    KEEP_FIELDS,
+    LOG_LEVELS,
+    NDJSON_EXTENSIONS,
+    START_METHODS,
+    STREAM_FORMATS,
+    STREAM_MAX_COMMENTS,
+    STREAM_MAX_THREADS,
+    VALIDATION_MODES,
+)
+
+# the pipeline modules (lxml, zstandard) are imported where they are needed,
+# so that --help and the JSON-only mode start without loading all of them
 
 
 NUM_PROCESSES = max(os.cpu_count(), 32)
 CHUNK_SIZE = 100  # batch size
+BATCHES_PER_PROCESS = 4  # grouped mode: target number of batches per worker
 
 
-def run_multi_process(func, iterator, json_dir, xml_dir):
-    "Run multiprocessing in batches."
-    batches = make_chunks(iterator, CHUNK_SIZE)
-    with Pool(processes=NUM_PROCESSES) as pool:
-        pool.starmap(
-            func,
-            [(batch, json_dir, xml_dir) for batch in batches],
-        )
+def run_multi_process(func, tasks, options, pool, quarantine, monitor=None):
+    """Run multiprocessing on (batch, json dir, xml dir) tasks, dispatched
+    in the given order, failed records are written to the quarantine and
+    the peak RSS of the workers to the memory monitor (if given).
+    Returns the merged statistics of the workers (None unless enabled
+    in the options) and the files written per item (updates only)."""
+    start = time.perf_counter()
+    results = pool.starmap(
+        func,
+        [(batch, json_dir, xml_dir, options) for batch, json_dir, xml_dir in tasks],
+        chunksize=1,
+    )
+    return merge_results(results, options, quarantine, start, monitor)
+
 
+def merge_results(results, options, quarantine, start, monitor=None):
+    """Report the worker utilization since start and merge the batch
+    results, as returned by run_multi_process."""
+    from extractor.stats import CorpusStats
+    from extractor.utils import worker_utilization
+
+    utilization, busiest, mean = worker_utilization(
+        results, time.perf_counter() - start, NUM_PROCESSES
+    )
+    print(
+        f"Worker utilization: {utilization:.0%} "
+        f"(busiest worker {busiest:.1f}s, mean {mean:.1f}s)"
+    )
+    if monitor is not None:
+        monitor.add_results(results)
+    stats = CorpusStats() if options.get("stats") else None
+    written = []
+    for result in results:
+        for record in result["quarantine"]:
+            quarantine.add_record(record)
+        if stats is not None and result["stats"] is not None:
+            stats.merge(result["stats"])
+        written.extend(result["written"] or ())
+    return stats, written
+
+
+def pipeline(
+    zstfile,
+    subreddit,
+    no_group=False,
+    filter_log="full",
+    keep_fields=None,
+    max_comments=None,
+    max_bytes=None,
+    corpus=None,
+    tree=False,
+    json_zst=False,
+    stats=False,
+    partition=False,
+    filter_config=None,
+    botlist=None,
+    update=False,
+    shared_memory=False,
+    validation="full",
+    dtd_sample=DTD_SAMPLE_RATE,
+    memory_limit=None,
+    tracemalloc_top=0,
+    pool=None,
+):
+    """filter, extract and convert a zst (or uncompressed NDJSON) file,
+    corpus is (max. members, max. bytes) for <teiCorpus> output,
+    partition writes the output in <year>/<month> subdirectories,
+    filter_config is the JSON file of the filter rules (botlist replaces its bot list),
+    update adds only the new comments to an existing output (see corpus_index),
+    shared_memory passes raw lines to the workers in no-group mode (see shared_batches),
+    validation is one of VALIDATION_MODES, dtd_sample the DTD sample rate of "fast",
+    memory_limit is a soft limit of the main process in bytes (see memory),
+    tracemalloc_top the number of top allocations reported per stage,
+    pool is a worker pool shared by all files of a run"""
+    from extractor.comment_processing import process_comment_batch, process_thread_batch
+    from extractor.comment_tree import extract_comments
+    from extractor.corpus_index import CorpusIndex, UpdateLayout, load_thread, record_update
+    from extractor.filter_rules import load_rules
+    from extractor.json_archive import DICTIONARY_SAMPLES, find_dictionary, train_dictionary
+    from extractor.memory import (
+        MEMORY_CHECK_EVERY,
+        MemoryMonitor,
+        ThreadSpill,
+        buffer_sizes,
+        print_memory,
+    )
+    from extractor.partitions import PartitionedLayout, partition_batches, partition_key
+    from extractor.records import compact
+    from extractor.shared_batches import dispatch_shared, unique_lines
+    from extractor.stats import length_bucket, write_stats
+    from extractor.quarantine import Quarantine, print_quarantine
+    from extractor.trim_username_comments import process_comments
+    from extractor.utils import (
+        ShardLayout,
+        balance_batches,
+        balance_groups,
+        compare_json_counts,
+        iter_zst_lines,
+        make_chunks,
+        split_thread,
+        thread_cost,
+    )
+    from extractor.validate import (
+        describe_validation,
+        record_validation,
+        validate_directory,
+        validate_paths,
+        validation_rate,
+    )
+    from extractor.workers import use_pool
 
-def pipeline(zstfile, subreddit, no_group=False):
     base_dir = os.path.dirname(os.path.abspath(__file__))
     subreddits_dir = os.path.join(base_dir, "subreddits")
     os.makedirs(subreddits_dir, exist_ok=True)
@@ -43,71 +156,589 @@ def pipeline(zstfile, subreddit, no_group=False):
     os.makedirs(json_output_dir, exist_ok=True)
     os.makedirs(xml_output_dir, exist_ok=True)
 
-    # process comments in zst file (apply filters)
-    print(f"Filtering comments in {subreddit}...")
-    process_comments(
-        zstfile,
-        remove_deleted=True,
-        remove_quotes=True,
-        remove_remindme=True,
-        remove_urls=True,
-    )
-
     filtered_zst_path = f"{zstfile.rsplit('.', 1)[0]}_filtered.zst"
+    options = {
+        "corpus": corpus,
+        "tree": tree,
+        "json_zst": json_zst,
+        "stats": stats,
+        "partition": partition,
+        "update": update,
+        # shard directories assigned here instead of by the workers
+        "fixed_dirs": True,
+    }
+    # partitioned output: shard directories per <year>/<month>, assigned here
+    layout = PartitionedLayout(json_output_dir, xml_output_dir) if partition else None
+    # otherwise the shards of all batches continue the existing output
+    shards = None if partition or update else ShardLayout(json_output_dir, xml_output_dir)
+    index = None
+    if update:
+        index = CorpusIndex(
+            os.path.join(subreddit_folder, f"{subreddit}_index.sqlite"), subreddit_folder
+        )
+        if index.is_empty():
+            print("Indexing the existing output...")
+            index.build(json_output_dir, xml_output_dir, group_mode=not no_group)
+        update_layout = UpdateLayout(json_output_dir, xml_output_dir)
+        # the dictionary of an existing compressed archive is kept
+        options["json_dictionary"] = find_dictionary(json_output_dir)
+    thread_sizes = Counter()
+    monitor = MemoryMonitor(memory_limit, tracemalloc_top)
+    # malformed lines and failed records of all stages, side file next to the filter log
+    name = os.path.basename(zstfile).rsplit(".", 1)[0]
+    quarantine = Quarantine(f"quarantine_{name}.ndjson.zst")
 
-    print(f"Extracting comments from {filtered_zst_path}. This may take a while...")
-
-    # process based on mode
-    if no_group:
-        print("Processing comments in 'no-group' mode...")
-        run_multi_process(
-            process_comment_batch,
-            extract_comments(filtered_zst_path),
-            json_output_dir,
-            xml_output_dir,
+    with use_pool(pool, NUM_PROCESSES, preload_dtd=validation == "full") as workers:
+        # process comments in zst file (apply filters),
+        # NDJSON files are filtered in parallel by byte ranges
+        print(f"Filtering comments in {subreddit}...")
+        rules = load_rules(filter_config, botlist)
+        filter_counts = process_comments(
+            zstfile,
+            rules,
+            log_level=filter_log,
+            pool=workers,
+            processes=NUM_PROCESSES,
+            keep_fields=keep_fields,
+            quarantine=quarantine,
         )
+        monitor.stage("filter")
+
+        print(f"Extracting comments from {filtered_zst_path}. This may take a while...")
+
+        # process based on mode
+        if no_group:
+            print("Processing comments in 'no-group' mode...")
+            # in corpus mode a batch fills one <teiCorpus> file
+            chunk_size = corpus[0] if corpus else CHUNK_SIZE
+            if shared_memory:
+                # the workers parse the lines, here they are only split and copied
+                if json_zst:
+                    sample = islice(
+                        extract_comments(filtered_zst_path, keep_fields=keep_fields),
+                        DICTIONARY_SAMPLES,
+                    )
+                    options["json_dictionary"] = train_dictionary(sample, json_output_dir)
+                start = time.perf_counter()
+                results = dispatch_shared(
+                    unique_lines(iter_zst_lines(filtered_zst_path)),
+                    chunk_size,
+                    shards,
+                    {**options, "keep_fields": keep_fields},
+                    workers,
+                    NUM_PROCESSES,
+                )
+                corpus_stats, written = merge_results(
+                    results, options, quarantine, start, monitor
+                )
+                monitor.stage("convert")
+            else:
+                seen_ids = set()
+                comments = extract_comments(
+                    filtered_zst_path,
+                    keep_fields=keep_fields,
+                    quarantine=quarantine,
+                    seen_ids=seen_ids,
+                )
+                if update:
+                    comments = index.new_comments(comments)
+                if json_zst and not options.get("json_dictionary"):
+                    # dictionary for the compressed JSON, trained on the first comments
+                    sample = list(islice(comments, DICTIONARY_SAMPLES))
+                    options["json_dictionary"] = train_dictionary(sample, json_output_dir)
+                    comments = chain(sample, comments)
+                if update:
+                    tasks = (
+                        (batch, *update_layout.assign(len(batch)))
+                        for batch in make_chunks(comments, chunk_size)
+                    )
+                elif partition:
+                    # one file per comment, or one <teiCorpus> file per batch
+                    tasks = (
+                        (batch, *layout.assign(key, 1 if corpus else len(batch), len(batch)))
+                        for key, batch in partition_batches(comments, chunk_size)
+                    )
+                else:
+                    tasks = (
+                        task
+                        for batch in make_chunks(comments, chunk_size)
+                        for task in shards.split(batch, corpus=bool(corpus))
+                    )
+                corpus_stats, written = run_multi_process(
+                    process_comment_batch, tasks, options, workers, quarantine, monitor
+                )
+                monitor.stage("convert", **buffer_sizes(seen_ids=seen_ids))
+            if update:
+                index.add_comments(key for key, _ in written)
+                index.db.commit()
+                xml_paths = [path for _, paths in written for path in paths if path.endswith(".xml")]
+        else:
+            thread_comments = defaultdict(list)
+            seen_ids = set()
+            spill = None
+
+            comments = extract_comments(
+                filtered_zst_path,
+                keep_fields=keep_fields,
+                quarantine=quarantine,
+                seen_ids=seen_ids,
+            )
+            if update:
+                comments = index.new_comments(comments)
+            for number, comment in enumerate(comments, 1):
+                thread_id = comment.get("link_id", "").replace("t3_", "")
+                if spill is not None:
+                    spill.add(thread_id, comment)
+                    continue
+                # buffered as compact records with interned strings
+                thread_comments[thread_id].append(compact(comment))
+                if number % MEMORY_CHECK_EVERY == 0 and monitor.over_limit():
+                    if update:
+                        # the threads of an update are merged with their archive, no spilling
+                        quarantine.close()
+                        monitor.stage("grouping", **buffer_sizes(thread_comments, seen_ids))
+                        print_memory(monitor)
+                        monitor.abort("grouping")
+                    # the rest of the run groups the threads bucket by bucket
+                    print("Memory limit reached, spilling the threads to disk...")
+                    spill = ThreadSpill(os.path.join(subreddit_folder, "spill"))
+                    spill.add_threads(thread_comments)
+            monitor.stage("grouping", **buffer_sizes(thread_comments, seen_ids))
+            del comments, seen_ids
+            if spill is not None:
+                monitor.spilled = spill.count
+
+            corpus_stats, written = None, []
+            for thread_comments in [thread_comments] if spill is None else spill.groups():
+                if update:
+                    # threads with new comments are rewritten with their archived comments first
+                    new_ids = {
+                        thread_id: [comment["id"] for comment in comments]
+                        for thread_id, comments in thread_comments.items()
+                    }
+                    old_files = {}
+                    for thread_id in thread_comments:
+                        files = index.thread_files(thread_id)
+                        if files:
+                            old_files[thread_id] = files
+                            thread_comments[thread_id] = (
+                                load_thread(files) + thread_comments[thread_id]
+                            )
+                    print(
+                        f"{sum(map(len, new_ids.values()))} new comments ({index.skipped} known), "
+                        f"{len(old_files)} threads updated, "
+                        f"{len(thread_comments) - len(old_files)} new threads."
+                    )
+
+                print(f"Processing {len(thread_comments)} threads in 'grouped' mode...")
+                if json_zst and not options.get("json_dictionary"):
+                    # dictionary for the compressed JSON, trained on the first comments
+                    sample = islice(
+                        chain.from_iterable(thread_comments.values()), DICTIONARY_SAMPLES
+                    )
+                    options["json_dictionary"] = train_dictionary(sample, json_output_dir)
+                if stats:
+                    thread_sizes.update(
+                        length_bucket(len(comments)) for comments in thread_comments.values()
+                    )
+                # oversized threads are written as numbered parts, processed in parallel
+                tasks = []
+                thread_dirs, thread_tasks = {}, {}
+                for thread_id, comments in thread_comments.items():
+                    parts = split_thread(comments, max_comments, max_bytes)
+                    if update:
+                        thread_tasks[thread_id] = len(parts)
+                        thread_dirs[thread_id] = update_layout.assign(
+                            len(parts), old_files.get(thread_id, ())
+                        )
+                    if len(parts) == 1:
+                        tasks.append((thread_id, comments))
+                        continue
+                    for number, part in enumerate(parts, 1):
+                        tasks.append((thread_id, part, (number, len(parts), comments[-1])))
+
+                # largest threads first, small threads packed into batches of similar cost
+                total_cost = sum(thread_cost(comments) for comments in thread_comments.values())
+                batch_cost = max(total_cost // (NUM_PROCESSES * BATCHES_PER_PROCESS), 1)
+                if update:
+                    # batches of threads written to the same directories
+                    groups = defaultdict(list)
+                    for task in tasks:
+                        groups[thread_dirs[task[0]]].append(task)
+                    batches = [
+                        (batch, *dirs) for _, dirs, batch in balance_groups(groups, batch_cost)
+                    ]
+                elif partition:
+                    # batches of one partition each, keyed on the thread's last comment
+                    partitions = defaultdict(list)
+                    for task in tasks:
+                        last_comment = task[2][2] if len(task) > 2 else task[1][-1]
+                        partitions[partition_key(last_comment)].append(task)
+                    batches = [
+                        (
+                            batch,
+                            *layout.assign(
+                                key,
+                                1 if corpus else len(batch),
+                                sum(len(task[1]) for task in batch),
+                            ),
+                        )
+                        for _, key, batch in balance_groups(partitions, batch_cost)
+                    ]
+                else:
+                    batches = [
+                        task
+                        for _, batch in balance_batches(tasks, batch_cost)
+                        for task in shards.split(batch, corpus=bool(corpus))
+                    ]
+                group_stats, group_written = run_multi_process(
+                    process_thread_batch, batches, options, workers, quarantine, monitor
+                )
+                written.extend(group_written)
+                if corpus_stats is None:
+                    corpus_stats = group_stats
+                elif group_stats is not None:
+                    corpus_stats.merge(group_stats)
+                if update:
+                    xml_paths = record_update(index, written, old_files, thread_tasks, new_ids)
+            if spill is not None:
+                spill.close()
+            monitor.stage("convert")
+
+        dtd_rate = validation_rate(validation, dtd_sample)
+        if update:
+            print(f"Validating {len(xml_paths)} new XML files ({describe_validation(dtd_rate)})...")
+            invalid = validate_paths(xml_paths, pool=workers, dtd_rate=dtd_rate)
+        else:
+            print(f"Validating XML files ({describe_validation(dtd_rate)})...")
+            invalid = validate_directory(xml_output_dir, pool=workers, dtd_rate=dtd_rate)
+        record_validation(dtd_rate, invalid)
+        monitor.stage("validate")
+
+    if update:
+        # the filtered file only holds the delta, the index replaces the count check
+        index.close()
+        print(f"Index updated: {index.path}")
     else:
-        thread_comments = defaultdict(list)
-
-        for comment in extract_comments(filtered_zst_path):
-            thread_id = comment.get("link_id", "").replace("t3_", "")
-            thread_comments[thread_id].append(comment)
-
-        print(f"Processing {len(thread_comments)} threads in 'grouped' mode...")
-        run_multi_process(
-            process_thread_batch,
-            thread_comments.items(),
-            json_output_dir,
-            xml_output_dir,
+        # JSON object count consistency between filtered zst file and JSON output directory
+        print(
+            "Checking consistency of JSON object (comments) count between the filtered .zst file and JSON output directory..."
         )
+        compare_json_counts(filtered_zst_path, json_output_dir)
+    if layout is not None:
+        manifest_path = os.path.join(subreddit_folder, f"{subreddit}_manifest.json")
+        layout.write_manifest(manifest_path)
+        print(f"{len(layout.allocators)} partitions, manifest written to {manifest_path}.")
+    quarantine.close()
+    print_quarantine(quarantine)
+    monitor.close()
+    print_memory(monitor)
 
-    print("Validating XML files...")
-    validate_directory(xml_output_dir)
-
-    # JSON object count consistency between filtered zst file and JSON output directory
-    filtered_zst_path = f"{zstfile.rsplit('.', 1)[0]}_filtered.zst"
-    print(
-        "Checking consistency of JSON object (comments) count between the filtered .zst file and JSON output directory..."
-    )
-    compare_json_counts(filtered_zst_path, json_output_dir)
+    if stats:
+        stats_path = os.path.join(subreddit_folder, f"{subreddit}_stats.json")
+        excluded, deleted, quote, remindme, url_removal, url_only = filter_counts
+        write_stats(
+            stats_path,
+            corpus_stats,
+            thread_size_histogram=dict(sorted(thread_sizes.items())),
+            filter={
+                "excluded_authors": {name: n for name, n in excluded.items() if n},
+                "deleted": deleted,
+                "quotes_removed": quote,
+                "remindme": remindme,
+                "urls_removed": url_removal,
+                "url_only": url_only,
+            },
+            filter_rules=rules.stats(),
+            quarantine=dict(quarantine.counts),
+            memory=monitor.report(),
+        )
+        print(f"Statistics written to {stats_path}.")
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Process Reddit comments.")
     parser.add_argument(
-        "files", nargs="+", help="Path to one or more .zst files or _json directories."
+        "files",
+        nargs="+",
+        help="Path to one or more .zst, .ndjson or .jsonl files or _json directories, - reads NDJSON (plain or zstd) from stdin.",
     )
     parser.add_argument(
         "--no-group", action="store_true", help="Process each comment individually."
     )
+    parser.add_argument(
+        "--filter-log",
+        choices=LOG_LEVELS,
+        default="full",
+        help="Verbosity of the compressed filter log (default: full).",
+    )
+    parser.add_argument(
+        "--filter-config",
+        default=FILTER_CONFIG,
+        help="JSON file with the filter rules (default: src/config/filters.json).",
+    )
+    parser.add_argument(
+        "--botlist",
+        help="Bot list used by the authors rule instead of the one in the filter config.",
+    )
+    parser.add_argument(
+        "--whitelist",
+        action="store_true",
+        help="Keep only whitelisted fields instead of removing known unwanted ones.",
+    )
+    parser.add_argument(
+        "--keep-fields",
+        help="Comma-separated whitelist (implies --whitelist), a trailing * matches a prefix.",
+    )
+    parser.add_argument(
+        "--max-comments",
+        type=int,
+        help="Split threads with more comments into numbered parts (grouped mode).",
+    )
+    parser.add_argument(
+        "--max-bytes",
+        type=int,
+        help="Split threads with more body bytes into numbered parts (grouped mode).",
+    )
+    parser.add_argument(
+        "--corpus",
+        action="store_true",
+        help="Write <teiCorpus> files with many <TEI> documents instead of one file each.",
+    )
+    parser.add_argument(
+        "--corpus-max-members",
+        type=int,
+        default=CORPUS_MAX_MEMBERS,
+        help=f"Max. documents per <teiCorpus> file (default: {CORPUS_MAX_MEMBERS}).",
+    )
+    parser.add_argument(
+        "--corpus-max-bytes",
+        type=int,
+        default=CORPUS_MAX_BYTES,
+        help=f"Max. size of a <teiCorpus> file (default: {CORPUS_MAX_BYTES}).",
+    )
+    parser.add_argument(
+        "--json-zst",
+        action="store_true",
+        help="Write the JSON archive as .json.zst, compressed with a dictionary trained on the run's comments.",
+    )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="Collect corpus statistics during the run and write <subreddit>_stats.json.",
+    )
+    parser.add_argument(
+        "--partition",
+        action="store_true",
+        help="Write the output in <year>/<month> subdirectories (created_utc, last comment of a thread).",
+    )
+    parser.add_argument(
+        "--update",
+        action="store_true",
+        help="Add only new comments to an existing output, using the index <subreddit>_index.sqlite.",
+    )
+    parser.add_argument(
+        "--shared-memory",
+        action="store_true",
+        help="No-group mode: pass raw lines to the workers in shared memory, the workers parse them.",
+    )
+    parser.add_argument(
+        "--validation",
+        choices=VALIDATION_MODES,
+        default="full",
+        help="full: validate every XML file against the DTD, fast: check the structure of every file and validate a sample against the DTD (default: full).",
+    )
+    parser.add_argument(
+        "--dtd-sample",
+        type=float,
+        default=DTD_SAMPLE_RATE,
+        help=f"Share of the files validated against the DTD with --validation fast (default: {DTD_SAMPLE_RATE}).",
+    )
+    parser.add_argument(
+        "--memory-limit",
+        type=int,
+        help="Soft memory limit of the main process in MB: grouped mode spills the threads to disk, an update aborts.",
+    )
+    parser.add_argument(
+        "--tracemalloc",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Report the N largest allocations of the main process at each stage (slow).",
+    )
+    parser.add_argument(
+        "--merge",
+        action="store_true",
+        help="Merge all .zst files (e.g. monthly dumps of one subreddit) into a single run.",
+    )
+    parser.add_argument(
+        "--subreddit",
+        help="Subreddit name for --merge (default: derived from the first file name).",
+    )
+    parser.add_argument(
+        "--tree",
+        action="store_true",
+        help="Nest replies under their parent comment (grouped mode).",
+    )
+    parser.add_argument(
+        "--start-method",
+        choices=START_METHODS,
+        help="Start method of the worker processes (forkserver: low-memory startup).",
+    )
+    parser.add_argument(
+        "--stdout-format",
+        choices=STREAM_FORMATS,
+        default="ndjson",
+        help="Output written to stdout when reading from stdin (default: ndjson).",
+    )
+    parser.add_argument(
+        "--stream-max-threads",
+        type=int,
+        default=STREAM_MAX_THREADS,
+        help=f"Max. open threads buffered when streaming TEI (default: {STREAM_MAX_THREADS}).",
+    )
+    parser.add_argument(
+        "--estimate",
+        action="store_true",
+        help="Dry run: process a sample of each file and extrapolate counts, sizes and time.",
+    )
+    parser.add_argument(
+        "--sample-mb",
+        type=int,
+        default=64,
+        help="Decompressed MB read from the start of each file for --estimate (default: 64).",
+    )
     args = parser.parse_args()
-    for inputfile in args.files:
-        if inputfile.endswith(".zst"):
-            subreddit = inputfile.split("/")[-1].replace("_comments.zst", "")
-            pipeline(inputfile, subreddit, no_group=args.no_group)
-        elif inputfile.endswith("_json") or inputfile.endswith("_json/"):
-            pipeline_json2xml(inputfile)
-        else:
-            print(
-                "Please provide the path to one or more .zst files or _json directories."
+    corpus = (args.corpus_max_members, args.corpus_max_bytes) if args.corpus else None
+    keep_fields = None
+    if args.keep_fields:
+        keep_fields = tuple(field.strip() for field in args.keep_fields.split(","))
+    elif args.whitelist:
+        keep_fields = KEEP_FIELDS
+    pipeline_options = {
+        "no_group": args.no_group,
+        "filter_log": args.filter_log,
+        "keep_fields": keep_fields,
+        "max_comments": args.max_comments,
+        "max_bytes": args.max_bytes,
+        "corpus": corpus,
+        "tree": args.tree,
+        "json_zst": args.json_zst,
+        "stats": args.stats,
+        "partition": args.partition,
+        "filter_config": args.filter_config,
+        "botlist": args.botlist,
+        "update": args.update,
+        "shared_memory": args.shared_memory,
+        "validation": args.validation,
+        "dtd_sample": args.dtd_sample,
+        "memory_limit": args.memory_limit * 1024 * 1024 if args.memory_limit else None,
+        "tracemalloc_top": args.tracemalloc,
+    }
+    if args.update and (args.corpus or args.partition):
+        parser.error("--update writes one file per thread or comment, without --corpus or --partition")
+    if args.shared_memory and (not args.no_group or args.update or args.partition):
+        parser.error("--shared-memory needs --no-group and can't be combined with --update or --partition")
+    if args.merge and not any(f.endswith(".zst") for f in args.files):
+        parser.error("--merge needs at least one .zst file")
+
+    if args.files == ["-"]:
+        import sys
+
+        from extractor.filter_rules import load_rules
+        from extractor.streaming import stream_pipeline
+
+        # stdout carries the data, status messages go to stderr
+        stream_pipeline(
+            sys.stdin.buffer,
+            sys.stdout.buffer,
+            output_format=args.stdout_format,
+            group_mode=not args.no_group,
+            keep_fields=keep_fields,
+            corpus=corpus,
+            tree=args.tree,
+            max_threads=args.stream_max_threads,
+            max_comments=STREAM_MAX_COMMENTS,
+            log_level=args.filter_log,
+            rules=load_rules(args.filter_config, args.botlist),
+        )
+        raise SystemExit(0)
+
+    if args.estimate:
+        from extractor.estimate import estimate, print_estimate
+        from extractor.filter_rules import load_rules
+
+        for inputfile in args.files:
+            if not inputfile.endswith((".zst",) + NDJSON_EXTENSIONS):
+                print(f"Skipping {inputfile}, --estimate needs .zst or NDJSON files.")
+                continue
+            result = estimate(
+                inputfile,
+                NUM_PROCESSES,
+                no_group=args.no_group,
+                keep_fields=keep_fields,
+                max_comments=args.max_comments,
+                max_bytes=args.max_bytes,
+                corpus=corpus,
+                tree=args.tree,
+                json_zst=args.json_zst,
+                chunk_size=CHUNK_SIZE,
+                sample_bytes=args.sample_mb * 1024 * 1024,
+                rules=load_rules(args.filter_config, args.botlist),
             )
+            print_estimate(inputfile, result)
+        raise SystemExit(0)
+
+    from extractor.json2xml import pipeline_json2xml
+    from extractor.memory import MemoryLimitError
+    from extractor.merge import merge_zst_files
+    from extractor.quarantine import Quarantine, print_quarantine
+    from extractor.workers import create_pool
+
+    # one pool of initialized workers for all files and stages of the run,
+    # the DTD is parsed at startup only if every file is validated against it
+    pool = create_pool(
+        NUM_PROCESSES, args.start_method, preload_dtd=args.validation == "full"
+    )
+    pipeline_options["pool"] = pool
+
+    inputfiles = args.files
+    try:
+        if args.merge:
+            zstfiles = [f for f in inputfiles if f.endswith(".zst")]
+            subreddit = args.subreddit or zstfiles[0].split("/")[-1].split("_comments")[0]
+            merged = os.path.join(os.path.dirname(zstfiles[0]), f"{subreddit}_merged.zst")
+            print(f"Merging {len(zstfiles)} files into {merged}...")
+            quarantine = Quarantine(f"quarantine_{subreddit}_merge.ndjson.zst")
+            count = merge_zst_files(zstfiles, merged, quarantine=quarantine)
+            quarantine.close()
+            print(f"{count} unique comments merged.")
+            print_quarantine(quarantine)
+            inputfiles = [f for f in inputfiles if not f.endswith(".zst")]
+            pipeline(merged, subreddit, **pipeline_options)
+        for inputfile in inputfiles:
+            if inputfile.endswith(".zst"):
+                subreddit = inputfile.split("/")[-1].replace("_comments.zst", "")
+                pipeline(inputfile, subreddit, **pipeline_options)
+            elif inputfile.endswith(NDJSON_EXTENSIONS):
+                name = os.path.basename(inputfile).rsplit(".", 1)[0]
+                pipeline(inputfile, name.removesuffix("_comments"), **pipeline_options)
+            elif "_json" in os.path.basename(os.path.normpath(inputfile)) and os.path.isdir(inputfile):
+                pipeline_json2xml(
+                    inputfile,
+                    tree_structure=args.tree,
+                    pool=pool,
+                    validation=args.validation,
+                    dtd_sample=args.dtd_sample,
+                )
+            else:
+                print(
+                    "Please provide the path to one or more .zst or NDJSON files or _json directories."
+                )
+    except MemoryLimitError as e:
+        # a clean stop instead of an OOM kill, the output of earlier files is complete
+        pool.terminate()
+        pool.join()
+        raise SystemExit(f"Aborted: {e}")
+    pool.close()
+    pool.join()
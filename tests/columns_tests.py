@@ -0,0 +1,41 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from extractor import columns
+from extractor.columns import CommentColumns, format_dates
+
+TIMESTAMPS = [1688741740, 1688741740.9, "1672531199", 1672531200, 0, -1, 86399, 86400]
+
+
+def expected_dates(timestamps):
+    return [
+        datetime.fromtimestamp(int(t), tz=timezone.utc).strftime("%Y-%m-%d") for t in timestamps
+    ]
+
+
+@pytest.mark.parametrize("use_numpy", [False, True])
+def test_format_dates(use_numpy, monkeypatch):
+    """Die Datumsangaben stimmen mit datetime überein, mit und ohne NumPy."""
+    if use_numpy:
+        pytest.importorskip("numpy")
+        monkeypatch.setattr(columns, "NUMPY_MIN_BATCH", 0)
+    else:
+        monkeypatch.setattr(columns, "np", None)
+    assert format_dates(TIMESTAMPS) == expected_dates(TIMESTAMPS)
+    assert format_dates([]) == []
+
+
+def test_comment_columns():
+    """Abgeleitete Felder werden einmal pro Batch berechnet."""
+    comments = [
+        {"id": "a1", "created_utc": 1688741740, "body": "x"},
+        {"id": "b2", "created_utc": "1672531200", "body": "y"},
+    ]
+    thread_columns = CommentColumns(comments, "https://www.reddit.com/r/x/comments/t/")
+    assert len(thread_columns) == 2
+    assert list(thread_columns.rows()) == [
+        ("2023-07-07", "https://www.reddit.com/r/x/comments/t/comment/a1/"),
+        ("2023-01-01", "https://www.reddit.com/r/x/comments/t/comment/b2/"),
+    ]
+    assert thread_columns.by_id()["b2"][0] == "2023-01-01"
@@ -0,0 +1,87 @@
+import json
+import os
+import tempfile
+
+from extractor.comment_processing import process_comment_batch, process_thread_batch
+from extractor.corpus_index import CorpusIndex, UpdateLayout, load_thread, record_update
+from extractor.utils import split_thread
+
+TEST_DIR = os.path.abspath(os.path.dirname(__file__))
+THREAD = "18j6k0v"
+
+
+def load_fixture(name):
+    with open(os.path.join(TEST_DIR, f"files/grouped/{name}_flat.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_update_thread():
+    """Neue Kommentare werden an ihren Thread angehängt, überholte Dateien entfernt."""
+    comments = load_fixture(THREAD)
+    options = {"update": True, "fixed_dirs": True}
+    with tempfile.TemporaryDirectory() as tmp:
+        index = CorpusIndex(os.path.join(tmp, "index.sqlite"), tmp)
+        layout = UpdateLayout(os.path.join(tmp, "json"), os.path.join(tmp, "xml"))
+
+        first = comments[:4]
+        result = process_thread_batch([(THREAD, first)], *layout.assign(1), options)
+        record_update(
+            index, result["written"], {}, {THREAD: 1}, {THREAD: [c["id"] for c in first]}
+        )
+        old_files = index.thread_files(THREAD)
+        assert [os.path.basename(path) for path in old_files] == [
+            f"{THREAD}_flat.json",
+            f"{THREAD}.xml",
+        ]
+
+        # the whole thread arrives again: only the unknown comments are new
+        new = list(index.new_comments(comments))
+        assert new == comments[4:] and index.skipped == 4
+        merged = load_thread(old_files) + new
+        parts = split_thread(merged, max_comments=5)
+        tasks = [(THREAD, part, (n, len(parts), merged[-1])) for n, part in enumerate(parts, 1)]
+        dirs = layout.assign(len(parts), old_files)
+        assert dirs == tuple(os.path.dirname(path) for path in old_files)
+        result = process_thread_batch(tasks, *dirs, options)
+        xml_paths = record_update(
+            index,
+            result["written"],
+            {THREAD: old_files},
+            {THREAD: len(parts)},
+            {THREAD: [c["id"] for c in new]},
+        )
+
+        assert sorted(os.listdir(dirs[0])) == [
+            f"{THREAD}_p0001_flat.json",
+            f"{THREAD}_p0002_flat.json",
+        ]
+        assert sorted(map(os.path.basename, xml_paths)) == sorted(os.listdir(dirs[1]))
+        assert load_thread(index.thread_files(THREAD)) == comments
+        assert index.known_ids([c["id"] for c in comments]) == {c["id"] for c in comments}
+
+        # a fresh index of the same output knows the same comments and files
+        rebuilt = CorpusIndex(os.path.join(tmp, "rebuilt.sqlite"), tmp)
+        rebuilt.build(os.path.join(tmp, "json"), os.path.join(tmp, "xml"))
+        assert rebuilt.thread_files(THREAD) == index.thread_files(THREAD)
+        assert rebuilt.known_ids([c["id"] for c in comments]) == {c["id"] for c in comments}
+        index.close()
+        rebuilt.close()
+
+
+def test_update_nogroup():
+    """Im no-group-Modus werden die Kommentare mit ihrem Thread indexiert."""
+    comments = load_fixture(THREAD)
+    options = {"update": True, "fixed_dirs": True}
+    with tempfile.TemporaryDirectory() as tmp:
+        index = CorpusIndex(os.path.join(tmp, "index.sqlite"), tmp)
+        layout = UpdateLayout(os.path.join(tmp, "json"), os.path.join(tmp, "xml"))
+
+        for batch in (comments[:4], comments):
+            new = list(index.new_comments(batch))
+            result = process_comment_batch(new, *layout.assign(len(new)), options)
+            index.add_comments(key for key, _ in result["written"])
+            index.db.commit()
+        assert index.skipped == 4
+        rows = index.db.execute("SELECT id, thread FROM comments ORDER BY id").fetchall()
+        assert rows == sorted((comment["id"], THREAD) for comment in comments)
+        index.close()
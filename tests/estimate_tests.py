@@ -0,0 +1,42 @@
+import os
+import tempfile
+
+import zstandard as zstd
+
+from extractor.estimate import estimate, sample_lines
+
+TEST_DIR = os.path.abspath(os.path.dirname(__file__))
+SMALL_ZST = os.path.join(
+    TEST_DIR, "files/GermanRap_comments_small/GermanRap_comments_small.zst"
+)
+
+
+def test_estimate_whole_file():
+    """Passt die Datei in die Stichprobe, wird exakt gezählt."""
+    result = estimate(SMALL_ZST, processes=2)
+    assert result["share"] == 1.0
+    lines, _ = sample_lines(SMALL_ZST)
+    assert result["comments"] == len(lines)
+    assert 0 < result["kept"] <= result["comments"]
+    assert 0 < result["threads"] <= result["kept"]
+    assert result["json_bytes"] > 0 and result["xml_bytes"] > 0
+    assert result["grouping_memory"] > 0
+    assert set(result["times"]) == {"filter", "extract", "convert", "validate"}
+
+
+def test_estimate_sample():
+    """Hochrechnung aus dem Anfang und späteren Stellen einer NDJSON-Datei."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "small.ndjson")
+        with open(SMALL_ZST, "rb") as f, open(path, "wb") as out:
+            out.write(zstd.ZstdDecompressor().stream_reader(f).read())
+        all_lines, _ = sample_lines(SMALL_ZST)
+
+        lines, share = sample_lines(path, sample_bytes=64 * 1024, frames=2)
+        assert 0 < share < 1
+        assert set(lines) <= set(all_lines)
+
+        result = estimate(path, processes=2, no_group=True, sample_bytes=64 * 1024)
+        assert result["grouping_memory"] == 0
+        # grobe Hochrechnung der Anzahl der Kommentare
+        assert 0.5 * len(all_lines) < result["comments"] < 2 * len(all_lines)
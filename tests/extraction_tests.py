@@ -1,6 +1,10 @@
 import os
+import pickle
 
-from extractor.comment_tree import extract_comments
+from extractor.comment_tree import KEEP_FIELDS, build_comment_tree, extract_comments, project_object
+from extractor.json2xml import build_tei, serialize_tei
+from extractor.json_archive import dump_json
+from extractor.records import compact
 
 
 TEST_DIR = os.path.abspath(os.path.dirname(__file__))
@@ -15,3 +19,75 @@ def test_extraction():
     assert first.get("author") == "zer0deathserryone"
     assert first.get("permalink") == "/r/GermanRap/comments/176b4p3/ich_bin_coverartdesigner_und_möchte_ihnen_einige/k4kybh8/"
     assert first.get("created_utc") == 1697128377.0
+
+
+def test_whitelist_projection():
+    comments = list(extract_comments(TEST_FILE, keep_fields=KEEP_FIELDS))
+    assert len(comments) == 1028
+
+    first = comments[0]
+    assert set(first) <= {
+        "id", "link_id", "parent_id", "author", "body", "created_utc",
+        "subreddit", "permalink", "retrieved_on", "retrieved_utc",
+    }
+    assert first.get("author") == "zer0deathserryone"
+    assert first.get("created_utc") == 1697128377.0
+
+    # unknown fields and prefixes
+    obj = {"id": "x", "new_field": 1, "retrieved_on": 2, "retrieved_utc": 3}
+    assert project_object(obj) == {"id": "x", "retrieved_on": 2, "retrieved_utc": 3}
+    assert project_object(obj, ("id",)) == {"id": "x"}
+
+
+def test_comment_tree():
+    comments = [
+        {"id": "a", "parent_id": "t3_x"},
+        {"id": "b", "parent_id": "t1_a"},
+        {"id": "c", "parent_id": "t1_missing"},
+        {"id": "d", "parent_id": "t1_a"},
+        {"id": "e", "parent_id": "t1_f"},
+        {"id": "f", "parent_id": "t1_e"},
+    ]
+    roots, replies = build_comment_tree(comments)
+    # top-level comment, orphan and the broken parent cycle
+    assert [c["id"] for c in roots] == ["a", "c", "e"]
+    assert [c["id"] for c in replies["a"]] == ["b", "d"]
+    assert [c["id"] for c in replies["e"]] == ["f"]
+    assert not replies["f"]
+
+
+def test_comment_tree_cycle_root():
+    """Ein Zyklus wird an seinem ersten Kommentar getrennt, nicht an einer Antwort darauf."""
+    comments = [
+        {"id": "reply", "parent_id": "t1_y"},
+        {"id": "z", "parent_id": "t1_y"},
+        {"id": "y", "parent_id": "t1_x"},
+        {"id": "x", "parent_id": "t1_z"},
+    ]
+    roots, replies = build_comment_tree(comments)
+    assert [c["id"] for c in roots] == ["z"]
+    assert [c["id"] for c in replies["y"]] == ["reply"]
+    assert [c["id"] for c in replies["z"]] == ["x"]
+    assert [c["id"] for c in replies["x"]] == ["y"]
+
+
+def test_compact_records():
+    """Kompakte Datensätze ergeben dasselbe JSON und TEI wie Dicts."""
+    comments = list(extract_comments(TEST_FILE))
+    thread = [c for c in comments if c["link_id"] == comments[0]["link_id"]]
+    records = [compact(comment) for comment in thread]
+
+    assert records[0]["author"] == thread[0]["author"]
+    assert records[0].get("missing", "x") == "x" and "id" in records[0]
+    assert dump_json(records) == dump_json(thread)
+    assert records[0].layout is records[1].layout
+    assert records[0]["subreddit"] is records[1]["subreddit"]
+
+    for tree in (False, True):
+        expected, _ = build_tei(thread, tree_structure=tree)
+        result, _ = build_tei(records, tree_structure=tree)
+        assert serialize_tei(result) == serialize_tei(expected)
+
+    copies = pickle.loads(pickle.dumps(records))
+    assert copies[0].layout is copies[-1].layout
+    assert [copy.as_dict() for copy in copies] == thread
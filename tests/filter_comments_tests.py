@@ -5,6 +5,8 @@ import tempfile
 import pytest
 
 from extractor.comment_tree import extract_comments
+from extractor.eventlog import FilterLog, read_events
+from extractor.filter_rules import default_rules
 from extractor.trim_username_comments import (
     filter_comments,
     remove_plain_urls,
@@ -31,11 +33,7 @@ def example_zst_filtered():
 
     filter_comments(
         os.path.join(TEST_DIR, filename),
-        authors=["AutoModerator", "ClausKlebot", "sneakpeekbot"],
-        remove_deleted=True,
-        remove_quotes=True,
-        remove_remindme=True,
-        remove_urls=True,
+        default_rules(["AutoModerator", "ClausKlebot", "sneakpeekbot"], True, True, True, True),
         log_file=logfile,
     )
 
@@ -115,5 +113,46 @@ def test_inline_formatting():
     )
 
 
+@pytest.mark.parametrize("level", ["off", "counts", "sample", "full"])
+def test_filter_log_levels(level):
+    """Testet die Ausführlichkeitsstufen des komprimierten Filter-Logs."""
+    filename = os.path.join(TEST_DIR, "files/GermanRap_comments_small/GermanRap_comments_small.zst")
+    with tempfile.TemporaryDirectory() as tmp:
+        logfile = os.path.join(tmp, "log.ndjson.zst")
+        result = filter_comments(
+            filename,
+            default_rules(["automoderator"], True, True, True, True),
+            log_file=logfile,
+            log_level=level,
+            log_sample_rate=0.5,
+        )
+        os.remove(filename.replace(".zst", "_filtered.zst"))
+
+        if level == "off":
+            assert not os.path.exists(logfile)
+            return
+
+        events = list(read_events(logfile))
+        summary = events[-1]
+        assert summary["event"] == "summary"
+        assert summary["counts"]["deleted"] == result[1]
+        deleted = [e for e in events if e["event"] == "deleted"]
+        if level == "counts":
+            assert len(events) == 1
+        elif level == "sample":
+            assert len(deleted) == (result[1] + 1) // 2
+        else:
+            assert len(deleted) == result[1]
+
+
+@pytest.mark.parametrize("rate", [0, -0.5, 1.5])
+def test_filter_log_sample_rate(rate):
+    """Ungültige Stichprobenraten werden vor dem Filtern abgelehnt."""
+    with tempfile.TemporaryDirectory() as tmp:
+        with pytest.raises(ValueError):
+            FilterLog(os.path.join(tmp, "log.ndjson.zst"), level="sample", sample_rate=rate)
+        assert not os.listdir(tmp)
+
+
 if __name__ == "__main__":
     pytest.main()
@@ -0,0 +1,138 @@
+import json
+import os
+import tempfile
+
+import pytest
+
+from extractor.filter_rules import (
+    AuthorRule,
+    DeletedRule,
+    FilterPipeline,
+    QuoteRule,
+    Record,
+    Rule,
+    load_rules,
+)
+from extractor.quarantine import Quarantine
+from extractor.trim_username_comments import iter_filtered, new_filter_counts
+
+
+class SlowRule(Rule):
+    """Teure Regel, die nie verwirft."""
+
+    name = "slow"
+
+    def matches(self, record):
+        sum(range(2000))
+        return False
+
+
+class DropRule(Rule):
+    """Billige Regel, die jeden Kommentar verwirft."""
+
+    name = "drop"
+
+    def matches(self, record):
+        return True
+
+
+def write_config(tmp, rules):
+    path = os.path.join(tmp, "filters.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"rules": rules}, f)
+    return path
+
+
+def test_load_rules():
+    """Regeln aus der Konfiguration, Pfade relativ zur Konfigurationsdatei."""
+    with tempfile.TemporaryDirectory() as tmp:
+        with open(os.path.join(tmp, "bots.txt"), "w", encoding="utf-8") as f:
+            f.write("SomeBot\n\n")
+        path = write_config(
+            tmp,
+            [
+                {"rule": "authors", "botlist": "bots.txt", "authors": ["Other"]},
+                {"rule": "deleted", "enabled": False},
+                {"rule": "pattern", "label": "ads", "regex": "kauf", "ignore_case": True},
+            ],
+        )
+        rules = load_rules(path)
+        assert [rule.name for rule in rules.rules] == ["authors", "pattern"]
+        assert rules.authors == ["other", "somebot"]
+
+        lines = [
+            json.dumps({"id": "1", "author": "SomeBot", "body": "hallo"}),
+            json.dumps({"id": "2", "author": "x", "body": "[deleted]"}),
+            json.dumps({"id": "3", "author": "x", "body": "Jetzt KAUFEN"}),
+        ]
+        counts = new_filter_counts()
+        kept = list(iter_filtered(lines, rules, counts))
+        assert [obj["id"] for obj in kept] == ["2"]
+        assert counts["authors"] == {"somebot": 1}
+        assert [(s["rule"], s["seen"], s["drops"]) for s in rules.stats()] == [
+            ("authors", 3, 1),
+            ("pattern", 2, 1),
+        ]
+
+        write_config(tmp, [{"rule": "unknown"}])
+        with pytest.raises(ValueError):
+            load_rules(path)
+
+
+def test_reorder():
+    """Billige Regeln mit vielen Treffern rücken nach vorn, ändernde Regeln bleiben."""
+    slow, quotes, drop = SlowRule(), QuoteRule(), DropRule()
+    rules = FilterPipeline([SlowRule(), slow, quotes, drop], reorder_every=3)
+    counts = new_filter_counts()
+    for _ in range(10):
+        rules.apply(Record({"body": "text", "author": "a"}), counts)
+    assert rules.order[2] is quotes
+    assert drop.drops == 10 and quotes.seen == 10
+    rules.rules[0].time, slow.time = 2.0, 1.0
+    rules.reorder()
+    assert rules.order[:2] == [slow, rules.rules[0]]
+
+    rules = FilterPipeline([slow, drop], reorder_every=2)
+    for _ in range(4):
+        rules.apply(Record({"body": "text", "author": "a"}), counts)
+    assert rules.order == [drop, slow]
+
+
+def test_reorder_credit():
+    """Nach dem Umsortieren zählt weiterhin die erste konfigurierte Regel, die zutrifft."""
+    deleted, authors = DeletedRule(), AuthorRule(["bot"])
+    rules = FilterPipeline([deleted, authors])
+    deleted.seen, deleted.time = 1, 1.0
+    rules.reorder()
+    assert rules.order == [authors, deleted]
+
+    counts = new_filter_counts()
+    events = []
+    for body in ("[deleted]", "text"):
+        record = Record({"id": body, "body": body, "author": "bot"})
+        assert rules.apply(record, counts, lambda kind, **fields: events.append(kind))
+    assert counts["deleted"] == 1 and counts["authors"] == {"bot": 1}
+    assert events == ["deleted"]
+    assert (deleted.drops, authors.drops) == (1, 1)
+
+
+class BrokenRule(Rule):
+    """Regel mit einem Programmierfehler."""
+
+    name = "broken"
+
+    def matches(self, record):
+        return record.obj["body"] + 1
+
+
+def test_rule_errors_propagate():
+    """Fehler einer Regel brechen ab, nur defekte Zeilen gehen in die Quarantäne."""
+    rules = FilterPipeline([BrokenRule()])
+    quarantine = Quarantine()
+    lines = ["{", json.dumps({"id": "1", "body": None})]
+    assert list(iter_filtered(lines, rules, new_filter_counts(), quarantine=quarantine)) == []
+    assert quarantine.close() == {"filter:invalid_json": 1, "filter:invalid_record": 1}
+
+    lines = [json.dumps({"id": "2", "author": "x", "body": "hallo"})]
+    with pytest.raises(TypeError):
+        list(iter_filtered(lines, rules, new_filter_counts()))
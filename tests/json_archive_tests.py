@@ -0,0 +1,61 @@
+import json
+import os
+import tempfile
+
+from collections import defaultdict
+
+from extractor.comment_processing import process_thread_batch
+from extractor.comment_tree import extract_comments
+from extractor.json2xml import convert_json_task, find_json_tasks
+from extractor.json_archive import (
+    encode_json_file,
+    read_json_bytes,
+    train_dictionary,
+)
+from extractor.utils import count_json_objects_in_directory
+
+TEST_DIR = os.path.abspath(os.path.dirname(__file__))
+SMALL_ZST = os.path.join(
+    TEST_DIR, "files/GermanRap_comments_small/GermanRap_comments_small.zst"
+)
+
+
+def test_json_zst_archive():
+    """Komprimierte JSON-Dateien mit Wörterbuch werden transparent gelesen."""
+    comments = list(extract_comments(SMALL_ZST))
+    threads = defaultdict(list)
+    for comment in comments:
+        threads[comment["link_id"][3:]].append(comment)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        json_dir, xml_dir = os.path.join(tmp, "json"), os.path.join(tmp, "xml")
+        os.makedirs(json_dir)
+        os.makedirs(xml_dir)
+        dictionary = train_dictionary(comments, json_dir, size=16384)
+        assert dictionary == os.path.join(json_dir, "dictionary.zstd")
+
+        options = {"json_zst": True, "json_dictionary": dictionary}
+        result = process_thread_batch(list(threads.items()), json_dir, xml_dir, options)
+        assert result["errors"] == []
+        assert count_json_objects_in_directory(json_dir) == len(comments)
+
+        tasks = list(find_json_tasks(json_dir))
+        assert len(tasks) == len(threads)
+        assert all(paths[0].endswith("_flat.json.zst") for paths in tasks)
+        converted = os.path.join(tmp, "converted")
+        convert_json_task(tasks[0], converted)
+        thread_id = os.path.basename(tasks[0][0]).split("_")[0]
+        with open(os.path.join(converted, f"{thread_id}.xml"), encoding="utf-8") as f:
+            assert f.read().count("<item source=") == len(threads[thread_id])
+
+
+def test_json_zst_without_dictionary():
+    """Zu wenige Kommentare: komprimiert ohne Wörterbuch."""
+    with tempfile.TemporaryDirectory() as tmp:
+        comments = [{"id": "a", "body": "Hallo"}]
+        assert train_dictionary(comments, tmp) is None
+        path, data = encode_json_file(os.path.join(tmp, "x_a"), comments, True)
+        assert path.endswith("x_a.json.zst")
+        with open(path, "wb") as f:
+            f.write(data)
+        assert json.loads(read_json_bytes(path)) == comments
@@ -0,0 +1,74 @@
+import pytest
+
+from collections import defaultdict
+
+from extractor.memory import MemoryLimitError, MemoryMonitor, ThreadSpill, buffer_sizes
+from extractor.records import compact
+
+
+def comment(comment_id, thread_id):
+    return {
+        "id": comment_id,
+        "parent_id": f"t3_{thread_id}",
+        "link_id": f"t3_{thread_id}",
+        "author": "user",
+        "body": f"comment {comment_id}",
+        "created_utc": 1688823816,
+    }
+
+
+def test_thread_spill(tmp_path):
+    """Ausgelagerte Threads kommen vollständig und in ihrer Reihenfolge zurück."""
+    threads = defaultdict(list)
+    for number in range(200):
+        thread_id = f"t{number % 7}"
+        threads[thread_id].append(compact(comment(f"c{number}", thread_id)))
+    expected = {thread_id: [dict(c) for c in comments] for thread_id, comments in threads.items()}
+
+    spill = ThreadSpill(str(tmp_path / "spill"), buckets=3)
+    spill.add_threads(threads)
+    assert not threads and spill.count == 200
+
+    seen = {}
+    for group in spill.groups():
+        for thread_id, comments in group.items():
+            assert thread_id not in seen
+            seen[thread_id] = [dict(c) for c in comments]
+    spill.close()
+    assert seen == expected
+    assert not (tmp_path / "spill").exists()
+
+
+def test_buffer_sizes():
+    threads = {"a": [compact(comment("c1", "a")), compact(comment("c2", "a"))], "b": []}
+    sizes = buffer_sizes(threads, {"c1", "c2", "c3"})
+    assert sizes["thread_comments"]["threads"] == 2
+    assert sizes["thread_comments"]["comments"] == 2
+    assert sizes["thread_comments"]["bytes"] > 0
+    assert sizes["seen_ids"]["ids"] == 3
+    assert buffer_sizes() == {}
+
+
+def test_memory_monitor():
+    """Das Limit wird erkannt, die Spitzenwerte der Worker werden pro Prozess behalten."""
+    monitor = MemoryMonitor(limit=1)
+    assert monitor.over_limit()
+    with pytest.raises(MemoryLimitError):
+        monitor.abort("grouping")
+    assert not MemoryMonitor().over_limit()
+
+    monitor.add_results([{"pid": 1, "max_rss": 10}, {"pid": 1, "max_rss": 5}, {"pid": 2}])
+    monitor.add_results([{"pid": 2, "max_rss": 7}])
+    monitor.stage("filter")
+    report = monitor.report()
+    assert report["workers_peak_rss"] == {1: 10, 2: 7}
+    assert report["stages"][0]["stage"] == "filter" and report["stages"][0]["rss"] > 0
+
+
+def test_tracemalloc_stage():
+    monitor = MemoryMonitor(top=2)
+    data = [str(i) * 10 for i in range(10000)]
+    monitor.stage("grouping")
+    monitor.close()
+    assert len(monitor.stages[0]["top_allocations"]) == 2
+    assert data
@@ -0,0 +1,39 @@
+import json
+import os
+import tempfile
+
+import zstandard as zstd
+
+from extractor.comment_tree import extract_comments
+from extractor.merge import merge_zst_files
+from extractor.quarantine import Quarantine
+
+
+def write_zst(path, comments):
+    lines = "".join(json.dumps(c) + "\n" for c in comments)
+    with open(path, "wb") as f:
+        f.write(zstd.compress(lines.encode("utf-8")))
+
+
+def test_merge():
+    """Zusammenführen nach Zeit ohne Duplikate, defekte Zeilen landen in der Quarantäne."""
+    def comment(comment_id, created_utc):
+        return {"id": comment_id, "created_utc": created_utc, "link_id": "t3_x"}
+
+    january = [comment("a", 1), comment("c", 3)]
+    february = [comment("b", 2), comment("c", 3)]
+    march = [comment("d", 4)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        files = [os.path.join(tmp, f"{i}.zst") for i in range(3)]
+        for path, comments in zip(files, (january, february, march)):
+            write_zst(path, comments)
+        with open(os.path.join(tmp, "broken.zst"), "wb") as f:
+            f.write(zstd.compress(b'{"id": "e", "created_utc": 0, "link_id"\n'))
+        files.append(os.path.join(tmp, "broken.zst"))
+
+        merged = os.path.join(tmp, "merged.zst")
+        quarantine = Quarantine()
+        assert merge_zst_files(files, merged, quarantine=quarantine) == 4
+        assert [c["id"] for c in extract_comments(merged)] == ["a", "b", "c", "d"]
+        assert quarantine.close() == {"merge:invalid_json": 1}
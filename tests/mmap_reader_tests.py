@@ -0,0 +1,80 @@
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+import zstandard as zstd
+
+from extractor import mmap_reader
+from extractor.eventlog import read_events
+from extractor.filter_rules import load_rules
+from extractor.trim_username_comments import filter_comments
+from extractor.utils import iter_zst_lines
+
+TEST_DIR = os.path.abspath(os.path.dirname(__file__))
+SMALL_ZST = os.path.join(
+    TEST_DIR, "files/GermanRap_comments_small/GermanRap_comments_small.zst"
+)
+
+
+def test_line_ranges(monkeypatch):
+    """Bereiche enden immer nach einem Zeilenumbruch und decken die Datei ab."""
+    monkeypatch.setattr(mmap_reader, "MIN_RANGE_SIZE", 1)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "lines.ndjson")
+        data = b"".join(b"x" * n + b"\n" for n in range(50)) + b"last"
+        with open(path, "wb") as f:
+            f.write(data)
+        ranges = mmap_reader.line_ranges(path, 7)
+        assert len(ranges) > 1
+        assert ranges[0][0] == 0 and ranges[-1][1] == len(data)
+        for (_, end), (start, _) in zip(ranges, ranges[1:]):
+            assert end == start and data[end - 1 : end] == b"\n"
+
+        empty = os.path.join(tmp, "empty.ndjson")
+        open(empty, "wb").close()
+        assert mmap_reader.line_ranges(empty, 4) == []
+
+
+def test_filter_ndjson(monkeypatch):
+    """Paralleles Filtern liefert dieselben Kommentare wie filter_comments."""
+    monkeypatch.setattr(mmap_reader, "MIN_RANGE_SIZE", 4096)
+    rules = load_rules()
+    with tempfile.TemporaryDirectory() as tmp:
+        zst_path = os.path.join(tmp, "small.zst")
+        shutil.copy(SMALL_ZST, zst_path)
+        expected = filter_comments(
+            zst_path, load_rules(),
+            os.path.join(tmp, "zst_log.ndjson.zst"), log_level="off",
+        )
+        expected_ids = [
+            json.loads(line)["id"]
+            for line in iter_zst_lines(os.path.join(tmp, "small_filtered.zst"))
+        ]
+
+        ndjson_path = os.path.join(tmp, "small_ndjson.ndjson")
+        with open(SMALL_ZST, "rb") as f, open(ndjson_path, "wb") as out:
+            out.write(zstd.ZstdDecompressor().stream_reader(f).read())
+        log_file = os.path.join(tmp, "log.ndjson.zst")
+        with multiprocessing.get_context("fork").Pool(2) as pool:
+            result = mmap_reader.filter_ndjson(
+                ndjson_path, rules, log_file, pool, 2
+            )
+
+        assert result == expected
+        comments = [
+            json.loads(line)
+            for line in iter_zst_lines(os.path.join(tmp, "small_ndjson_filtered.zst"))
+        ]
+        assert [comment["id"] for comment in comments] == expected_ids
+        assert all("score" not in comment for comment in comments)
+        events = list(read_events(log_file))
+        assert events[-1]["event"] == "summary"
+        assert sorted(os.listdir(tmp)) == [
+            "log.ndjson.zst",
+            "small.zst",
+            "small_filtered.zst",
+            "small_ndjson.ndjson",
+            "small_ndjson_filtered.zst",
+        ]
@@ -0,0 +1,90 @@
+import json
+import os
+import tempfile
+
+from extractor.comment_processing import process_thread_batch
+from extractor.json2xml import pipeline_json2xml
+from extractor.partitions import (
+    PartitionedLayout,
+    partition_batches,
+    partition_key,
+    source_partition,
+)
+from extractor.utils import MAX_FILES_PER_DIR
+
+TEST_DIR = os.path.abspath(os.path.dirname(__file__))
+
+
+def load_thread(name):
+    with open(os.path.join(TEST_DIR, f"files/grouped/{name}_flat.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def list_files(directory):
+    return sorted(
+        os.path.relpath(os.path.join(root, name), directory)
+        for root, _, files in os.walk(directory)
+        for name in files
+    )
+
+
+def test_partition_batches():
+    """Kommentare werden nach Jahr/Monat (UTC) in Batches gruppiert."""
+    comments = [{"created_utc": t} for t in (1672531199, 1672531200, 1675209600, 1672531300)]
+    assert partition_key(comments[0]) == "2022/12"
+    assert partition_key({"created_utc": "1672531200"}) == "2023/01"
+    batches = list(partition_batches(comments, 1))
+    assert [key for key, _ in batches] == ["2022/12", "2023/01", "2023/02", "2023/01"]
+    assert [(key, len(batch)) for key, batch in partition_batches(comments, 10)] == [
+        ("2022/12", 1),
+        ("2023/01", 2),
+        ("2023/02", 1),
+    ]
+    assert source_partition("/a/json/2023/01/00001/x.json", "/a/json") == "2023/01"
+    assert source_partition("/a/json/00001/x.json", "/a/json") == "."
+    assert source_partition("/a/json/x.json", "/a/json") == "."
+
+
+def test_partitioned_layout():
+    """Jede Partition zählt ihre Shards selbst, das Manifest listet alle."""
+    threads = [(name, load_thread(name)) for name in ("14u42ly", "18j48hp", "18j6k0v")]
+    with tempfile.TemporaryDirectory() as tmp:
+        json_dir, xml_dir = os.path.join(tmp, "x_json"), os.path.join(tmp, "x_xml")
+        layout = PartitionedLayout(json_dir, xml_dir)
+        for thread in threads:
+            key = partition_key(thread[1][-1])
+            json_shard, xml_shard = layout.assign(key, 1, len(thread[1]))
+            assert json_shard == os.path.join(json_dir, key, "00001")
+            result = process_thread_batch([thread], json_shard, xml_shard, {"fixed_dirs": True})
+            assert result["errors"] == []
+
+        keys = sorted({partition_key(comments[-1]) for _, comments in threads})
+        assert list_files(json_dir) == sorted(
+            os.path.join(partition_key(comments[-1]), "00001", f"{name}_flat.json")
+            for name, comments in threads
+        )
+        assert {os.path.dirname(path) for path in list_files(xml_dir)} == {
+            os.path.join(key, "00001") for key in keys
+        }
+
+        manifest_path = os.path.join(tmp, "manifest.json")
+        layout.write_manifest(manifest_path)
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+        assert manifest["json_dir"] == "x_json"
+        assert list(manifest["partitions"]) == keys
+        assert sum(p["comments"] for p in manifest["partitions"].values()) == sum(
+            len(comments) for _, comments in threads
+        )
+
+        # a later run continues the shards of each partition
+        layout = PartitionedLayout(json_dir, xml_dir)
+        json_shard, _ = layout.assign(keys[0], MAX_FILES_PER_DIR)
+        assert json_shard == os.path.join(json_dir, keys[0], "00002")
+
+        # json2xml keeps the partitions of an existing archive
+        xml_files = list_files(xml_dir)
+        for path in xml_files:
+            os.remove(os.path.join(xml_dir, path))
+        pipeline_json2xml(json_dir, processes=1)
+        assert list_files(xml_dir) == xml_files
@@ -0,0 +1,146 @@
+import json
+import os
+import shutil
+import tempfile
+
+import pytest
+
+from lxml import etree
+
+from extractor.comment_processing import (
+    AsyncWriter,
+    WriteError,
+    process_comment_batch,
+    process_thread_batch,
+)
+from extractor.validate import validate
+
+TEST_DIR = os.path.abspath(os.path.dirname(__file__))
+
+
+def load_thread():
+    filename = os.path.join(TEST_DIR, "files/grouped/14u42ly_flat.json")
+    with open(filename, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_thread_batch():
+    """Testet das Schreiben von JSON und XML für einen Thread-Batch."""
+    comments = load_thread()
+    with tempfile.TemporaryDirectory() as tmp:
+        json_dir, xml_dir = os.path.join(tmp, "json"), os.path.join(tmp, "xml")
+        os.makedirs(json_dir)
+        os.makedirs(xml_dir)
+
+        result = process_thread_batch([("14u42ly", comments)], json_dir, xml_dir)
+        assert result["errors"] == []
+
+        with open(os.path.join(json_dir, "00001/14u42ly_flat.json"), encoding="utf-8") as f:
+            assert json.load(f) == comments
+        with open(os.path.join(xml_dir, "00001/14u42ly.xml"), encoding="utf-8") as f:
+            assert f.read().count("<item source=") == len(comments)
+
+
+def test_comment_batch_errors():
+    """Fehler werden im Ergebnis des Batches zurückgegeben."""
+    comments = load_thread()
+    with tempfile.TemporaryDirectory() as tmp:
+        json_dir, xml_dir = os.path.join(tmp, "json"), os.path.join(tmp, "xml")
+        os.makedirs(json_dir)
+        os.makedirs(xml_dir)
+
+        result = process_comment_batch(comments[:2] + [{"id": "broken"}], json_dir, xml_dir)
+        assert len(result["errors"]) == 1
+        assert "broken" in result["errors"][0]
+        assert len(os.listdir(os.path.join(xml_dir, "00001"))) == 2
+
+
+def test_async_writer_errors():
+    with tempfile.TemporaryDirectory() as tmp:
+        writer = AsyncWriter(threads=2, queue_size=2, max_open_files=1)
+        for i in range(5):
+            writer.submit(os.path.join(tmp, f"{i}.txt"), b"test")
+        writer.submit(os.path.join(tmp, "missing/file.txt"), b"test")
+        errors = writer.close()
+        assert len(errors) == 1
+        assert len(os.listdir(tmp)) == 5
+        assert sorted(writer.paths) == sorted(os.path.join(tmp, f"{i}.txt") for i in range(5))
+
+
+def test_async_writer_failure():
+    """Andere Schreibfehler werden beim Schließen gemeldet, die Datei gilt nicht als geschrieben."""
+    with tempfile.TemporaryDirectory() as tmp:
+        writer = AsyncWriter()
+        writer.submit(os.path.join(tmp, "ok.txt"), b"test")
+        writer.submit(os.path.join(tmp, "text.txt"), "kein bytes-Objekt")
+        with pytest.raises(WriteError):
+            writer.close()
+        assert writer.paths == [os.path.join(tmp, "ok.txt")]
+
+
+def test_written_files_failed_write():
+    """Updates melden nur Kommentare, deren Dateien alle geschrieben wurden."""
+    comments = load_thread()
+    with tempfile.TemporaryDirectory() as tmp:
+        options = {"update": True, "fixed_dirs": True}
+        first = process_comment_batch(comments, tmp, os.path.join(tmp, "xml"), options)
+        xml_paths = [paths[-1] for _, paths in first["written"]]
+        assert len(xml_paths) == 2
+        # a directory in place of the XML file of the second comment
+        os.remove(xml_paths[1])
+        os.makedirs(xml_paths[1])
+        result = process_comment_batch(comments, tmp, os.path.join(tmp, "xml"), options)
+        assert [record["stage"] for record in result["quarantine"]] == ["write"]
+        assert result["written"] == first["written"][:1]
+
+
+def test_corpus_output():
+    """Testet die Ausgabe als <teiCorpus> mit Rollover nach Anzahl."""
+    comments = load_thread()
+    with tempfile.TemporaryDirectory() as tmp:
+        json_dir, xml_dir = os.path.join(tmp, "json"), os.path.join(tmp, "xml")
+        os.makedirs(json_dir)
+        os.makedirs(xml_dir)
+
+        options = {"corpus": (1, 10**6)}
+        result = process_comment_batch(comments, json_dir, xml_dir, options)
+        assert result["errors"] == []
+        assert len(os.listdir(os.path.join(json_dir, "00001"))) == len(comments)
+
+        files = sorted(os.listdir(os.path.join(xml_dir, "00001")))
+        assert files == sorted(f"corpus_14u42ly_{c['id']}.xml" for c in comments)
+        path = os.path.join(xml_dir, "00001", files[0])
+        assert validate(path) is True
+        root = etree.parse(path).getroot()
+        assert etree.QName(root).localname == "teiCorpus"
+        assert [etree.QName(child).localname for child in root] == ["teiHeader", "TEI"]
+
+        options = {"corpus": (100, 10**6)}
+        result = process_thread_batch([("14u42ly", comments)], json_dir, xml_dir, options)
+        assert result["errors"] == []
+        assert os.path.exists(os.path.join(xml_dir, "00001", "corpus_14u42ly.xml"))
+
+
+def test_pipeline_shards(tmp_path, monkeypatch):
+    """Die Unterordner werden vorab vergeben: ein Thread liegt in JSON und XML im selben Ordner."""
+    from run import pipeline
+
+    root = os.path.dirname(TEST_DIR)
+    dump = os.path.join(TEST_DIR, "files/GermanRap_comments_small/GermanRap_comments_small.zst")
+    # bot list under src/config, logs and quarantine in the working directory
+    os.symlink(os.path.join(root, "src"), tmp_path / "src")
+    monkeypatch.chdir(tmp_path)
+    subreddit = "shards_test"
+    output = os.path.join(root, "subreddits", f"{subreddit}_grouped")
+    try:
+        pipeline(shutil.copy(dump, tmp_path), subreddit)
+        json_dir = os.path.join(output, f"{subreddit}_json_grouped")
+        xml_dir = os.path.join(output, f"{subreddit}_xml_grouped")
+        assert os.listdir(json_dir) == ["00001"] and os.listdir(xml_dir) == ["00001"]
+        threads = {name.split("_")[0] for name in os.listdir(os.path.join(json_dir, "00001"))}
+        assert len(threads) == 58
+        assert sorted(os.listdir(os.path.join(xml_dir, "00001"))) == sorted(
+            f"{thread}.xml" for thread in threads
+        )
+    finally:
+        shutil.rmtree(output, ignore_errors=True)
@@ -0,0 +1,100 @@
+import json
+import os
+import tempfile
+
+import pytest
+import zstandard as zstd
+
+from extractor.comment_processing import process_thread_batch
+from extractor.comment_tree import extract_comments
+from extractor.eventlog import BATCH_SIZE, QUEUE_SIZE, EventWriter, read_events
+from extractor.filter_rules import default_rules
+from extractor.quarantine import Quarantine
+from extractor.records import compact
+from extractor.trim_username_comments import filter_comments
+
+COMMENT = {
+    "id": "abc",
+    "link_id": "t3_xyz",
+    "parent_id": "t3_xyz",
+    "author": "someone",
+    "body": "Hallo Welt",
+    "created_utc": 1700000000,
+    "subreddit": "de",
+}
+BAD_LINES = [b'{"broken', b"[1, 2]", b'{"body": null}']
+
+
+def write_zst(path, lines):
+    with open(path, "wb") as f:
+        f.write(zstd.compress(b"\n".join(lines) + b"\n"))
+
+
+def test_filter_quarantine():
+    """Fehlerhafte Zeilen landen mit Grund in der Quarantäne-Datei."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "test.zst")
+        write_zst(path, BAD_LINES + [json.dumps(COMMENT).encode()])
+        quarantine = Quarantine(os.path.join(tmp, "quarantine.ndjson.zst"))
+        filter_comments(
+            path, default_rules([], True, True, True, True),
+            os.path.join(tmp, "log.ndjson.zst"), log_level="off", quarantine=quarantine,
+        )
+        counts = quarantine.close()
+        assert counts == {"filter:invalid_json": 1, "filter:invalid_record": 2}
+        records = list(read_events(quarantine.path))
+        assert [record["line"] for record in records] == [
+            line.decode() for line in BAD_LINES
+        ]
+
+
+def test_extract_quarantine():
+    """Auch eine ungültige erste Zeile führt nicht zu einem NameError."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "test_filtered.zst")
+        missing_id = {key: value for key, value in COMMENT.items() if key != "id"}
+        write_zst(
+            path,
+            [b'{"broken', json.dumps(missing_id).encode(), json.dumps(COMMENT).encode()],
+        )
+        quarantine = Quarantine()
+        comments = list(extract_comments(path, quarantine=quarantine))
+        assert [comment["id"] for comment in comments] == ["abc"]
+        assert quarantine.close() == {
+            "extract:invalid_json": 1,
+            "extract:missing_field": 1,
+        }
+
+
+def test_batch_quarantine():
+    """Fehlgeschlagene Threads werden samt Kommentaren zurückgegeben."""
+    with tempfile.TemporaryDirectory() as tmp:
+        result = process_thread_batch([("xyz", [{"id": "broken"}])], tmp, tmp)
+        assert len(result["errors"]) == 1
+        record = result["quarantine"][0]
+        assert record["stage"] == "convert"
+        assert record["record"] == [{"id": "broken"}]
+
+
+def test_thread_quarantine_file():
+    """Kompakte Datensätze eines fehlgeschlagenen Threads landen in der Quarantäne-Datei."""
+    with tempfile.TemporaryDirectory() as tmp:
+        broken = {key: value for key, value in COMMENT.items() if key != "author"}
+        comments = [compact(COMMENT), compact(broken)]
+        result = process_thread_batch([("xyz", comments)], tmp, tmp)
+        quarantine = Quarantine(os.path.join(tmp, "quarantine.ndjson.zst"))
+        for record in result["quarantine"]:
+            quarantine.add_record(record)
+        assert quarantine.close() == {"convert:missing_field": 1}
+        records = list(read_events(quarantine.path))
+        assert records[0]["record"] == [COMMENT, broken]
+
+
+def test_event_writer_error():
+    """Ein Fehler im Schreib-Thread blockiert nicht und wird beim Schließen gemeldet."""
+    with tempfile.TemporaryDirectory() as tmp:
+        writer = EventWriter(os.path.join(tmp, "events.ndjson.zst"))
+        for _ in range((QUEUE_SIZE + 2) * BATCH_SIZE):
+            writer.write({"value": object()})
+        with pytest.raises(RuntimeError):
+            writer.close()
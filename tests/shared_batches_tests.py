@@ -0,0 +1,89 @@
+import json
+import os
+
+from multiprocessing.shared_memory import SharedMemory
+
+import pytest
+
+from extractor.shared_batches import (
+    BlockPool,
+    dispatch_shared,
+    iter_line_batches,
+    unique_lines,
+)
+from extractor.utils import ShardLayout
+from extractor.workers import create_pool
+
+TEST_DIR = os.path.abspath(os.path.dirname(__file__))
+
+
+def load_comments():
+    comments = []
+    for name in sorted(os.listdir(os.path.join(TEST_DIR, "files/nogroup"))):
+        with open(os.path.join(TEST_DIR, "files/nogroup", name), encoding="utf-8") as f:
+            comments.extend(json.load(f))
+    return comments
+
+
+def list_files(directory):
+    return sorted(name for _, _, files in os.walk(directory) for name in files)
+
+
+def test_line_batches():
+    """Batches enden nach chunk_size Zeilen oder wenn der Block voll ist."""
+    lines = [b"a" * 3, b"b" * 3, b"c" * 3, b"d" * 9, b"e"]
+    batches = list(iter_line_batches(lines, 2, block_size=8))
+    assert batches == [
+        ([b"aaa", b"bbb"], True),
+        ([b"ccc"], True),
+        ([b"d" * 9], False),
+        ([b"e"], True),
+    ]
+
+
+@pytest.mark.parametrize("start_method", ["fork", "forkserver"])
+def test_dispatch_shared(start_method, tmp_path):
+    """Die Worker parsen die Zeilen aus dem Shared Memory, die Blöcke werden wiederverwendet."""
+    comments = load_comments()
+    lines = [json.dumps(comment).encode() for comment in comments]
+    # a duplicate, a comment without thread, an invalid and an oversized line
+    lines += [lines[0], json.dumps({"id": "x", "link_id": "t1_x"}).encode(), b"{broken"]
+    big = dict(comments[0], id="big", body="x" * 4096)
+    lines.append(json.dumps(big).encode())
+
+    json_dir, xml_dir = str(tmp_path / "json"), str(tmp_path / "xml")
+    os.makedirs(json_dir)
+    os.makedirs(xml_dir)
+    pool = create_pool(2, start_method)
+    try:
+        results = dispatch_shared(
+            unique_lines(lines),
+            1,
+            ShardLayout(json_dir, xml_dir),
+            {"keep_fields": None},
+            pool,
+            1,
+            block_size=4096,
+        )
+    finally:
+        pool.close()
+        pool.join()
+
+    assert len(results) == len(lines) - 1
+    quarantined = [record for result in results for record in result["quarantine"]]
+    assert [(r["stage"], r["reason"]) for r in quarantined] == [("extract", "invalid_json")]
+    ids = sorted({comment["id"] for comment in comments} | {"big"})
+    assert list_files(json_dir) == sorted(
+        f"{comments[0]['link_id'][3:]}_{comment_id}.json" for comment_id in ids
+    )
+    assert len(list_files(xml_dir)) == len(ids)
+
+
+def test_blocks_unlinked():
+    """Nach close() sind die Blöcke entfernt."""
+    blocks = BlockPool(2, 64)
+    name = blocks.blocks[0].name
+    assert blocks.write(0, [b"ab", b"cde"]) == [2, 5]
+    blocks.close()
+    with pytest.raises(FileNotFoundError):
+        SharedMemory(name=name)
@@ -0,0 +1,74 @@
+import json
+import os
+import shutil
+import tempfile
+
+from extractor.comment_processing import process_thread_batch
+from extractor.stats import CorpusStats, TopK, length_bucket
+
+TEST_DIR = os.path.abspath(os.path.dirname(__file__))
+DUMP = os.path.join(TEST_DIR, "files/GermanRap_comments_small/GermanRap_comments_small.zst")
+
+
+def load_thread(name):
+    with open(os.path.join(TEST_DIR, f"files/grouped/{name}_flat.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_top_k():
+    """Häufige Schlüssel überleben das Kürzen, auch nach dem Zusammenführen."""
+    first, second = TopK(2), TopK(2)
+    for key in "aaaaabbbcdefg":
+        first.add(key)
+    for key in "aaabbbbhij":
+        second.add(key)
+    first.merge(second)
+    assert first.top(2) == [("a", 8), ("b", 7)]
+    assert first.error <= 1
+    assert [length_bucket(n) for n in (0, 1, 2, 3, 4, 100)] == [0, 1, 2, 2, 4, 64]
+
+
+def test_batch_stats():
+    """Statistiken der Worker lassen sich verlustfrei zusammenführen."""
+    threads = [(name, load_thread(name)) for name in ("14u42ly", "18j48hp", "18j6k0v")]
+    with tempfile.TemporaryDirectory() as tmp:
+        options = {"stats": True}
+        merged = CorpusStats()
+        for thread in threads:
+            result = process_thread_batch([thread], tmp, tmp, options)
+            merged.merge(result["stats"])
+        whole = process_thread_batch(threads, tmp, tmp, options)["stats"]
+        assert process_thread_batch(threads[:1], tmp, tmp)["stats"] is None
+
+    assert merged.as_dict() == whole.as_dict()
+    data = whole.as_dict()
+    assert data["comments"] == sum(len(comments) for _, comments in threads)
+    assert sum(data["body_length_histogram"].values()) == data["comments"]
+    assert sorted(count for _, count in data["top_threads"]) == [2, 8, 9]
+
+
+def test_nogroup_stats(tmp_path, monkeypatch):
+    """--stats im no-group-Modus: alle Kommentare werden geschrieben und gezählt."""
+    from run import pipeline
+
+    # bot list under src/config, logs and quarantine in the working directory
+    os.symlink(os.path.join(os.path.dirname(TEST_DIR), "src"), tmp_path / "src")
+    monkeypatch.chdir(tmp_path)
+    dump = shutil.copy(DUMP, tmp_path)
+    subreddit = "stats_nogroup_test"
+    output = os.path.join(os.path.dirname(TEST_DIR), "subreddits", f"{subreddit}_nogroup")
+    try:
+        for json_zst in (False, True):
+            shutil.rmtree(output, ignore_errors=True)
+            pipeline(dump, subreddit, no_group=True, json_zst=json_zst, stats=True)
+            with open(os.path.join(output, f"{subreddit}_stats.json"), encoding="utf-8") as f:
+                data = json.load(f)
+            json_files = [
+                name
+                for _, _, names in os.walk(os.path.join(output, f"{subreddit}_json_nogroup"))
+                for name in names
+                if name.endswith((".json", ".json.zst"))
+            ]
+            assert data["comments"] == len(json_files) > 0
+    finally:
+        shutil.rmtree(output, ignore_errors=True)
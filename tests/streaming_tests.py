@@ -0,0 +1,69 @@
+import io
+import os
+import tempfile
+
+import zstandard as zstd
+
+from lxml import etree
+
+from extractor.filter_rules import load_rules
+from extractor.streaming import ThreadBuffer, stream_pipeline
+from extractor.trim_username_comments import filter_comments
+
+TEST_DIR = os.path.abspath(os.path.dirname(__file__))
+SMALL_ZST = os.path.join(
+    TEST_DIR, "files/GermanRap_comments_small/GermanRap_comments_small.zst"
+)
+
+
+def run_stream(data, **kwargs):
+    out = io.BytesIO()
+    with tempfile.TemporaryDirectory() as tmp:
+        stream_pipeline(
+            io.BytesIO(data),
+            out,
+            log_file=os.path.join(tmp, "log.ndjson.zst"),
+            quarantine_file=os.path.join(tmp, "quarantine.ndjson.zst"),
+            status=io.StringIO(),
+            **kwargs,
+        )
+    return out.getvalue()
+
+
+def test_stream_ndjson():
+    """zstd- und Klartext-Eingabe liefern dieselbe Ausgabe wie filter_comments."""
+    with open(SMALL_ZST, "rb") as f:
+        compressed = f.read()
+    with tempfile.TemporaryDirectory() as tmp:
+        filter_comments(
+            SMALL_ZST, load_rules(),
+            os.path.join(tmp, "log.ndjson.zst"), log_level="off",
+        )
+    filtered = SMALL_ZST.rsplit(".", 1)[0] + "_filtered.zst"
+    with open(filtered, "rb") as f:
+        expected = zstd.ZstdDecompressor().stream_reader(f).read()
+    os.remove(filtered)
+
+    assert run_stream(compressed) == expected
+    plain = zstd.ZstdDecompressor().stream_reader(io.BytesIO(compressed)).read()
+    assert run_stream(plain) == expected
+
+
+def test_stream_corpus():
+    """TEI-Ausgabe als <teiCorpus> auf stdout."""
+    with open(SMALL_ZST, "rb") as f:
+        output = run_stream(f.read(), output_format="tei", corpus=(1000, 10**8))
+    root = etree.fromstring(output)
+    assert etree.QName(root).localname == "teiCorpus"
+    assert len(root) > 1
+
+
+def test_thread_buffer():
+    """Der am längsten nicht aktualisierte Thread wird zuerst ausgegeben."""
+    emitted = []
+    buffer = ThreadBuffer(lambda thread_id, comments: emitted.append(thread_id), 2, 10)
+    for thread_id in ["a", "b", "a", "c", "d"]:
+        buffer.add(thread_id, {})
+    assert emitted == ["b", "a"]
+    buffer.flush()
+    assert emitted == ["b", "a", "c", "d"]
@@ -5,11 +5,16 @@ import zstandard as zstd
 
 from extractor.utils import (
     MAX_FILES_PER_DIR,
+    ShardAllocator,
+    ShardLayout,
+    balance_batches,
     compare_json_counts,
     count_json_objects_in_directory,
     count_json_objects_in_zst,
     get_output_dir,
     make_chunks,
+    split_thread,
+    worker_utilization,
 )
 
 
@@ -78,3 +83,68 @@ def test_output_dir():
         assert new_output_dir != output_dir
         assert os.path.exists(new_output_dir) and os.path.isdir(new_output_dir)
         assert new_output_dir == os.path.join(tmp, "00002")
+
+
+def test_shard_layout():
+    """Batches werden an den Grenzen der Unterordner geteilt, JSON und XML parallel."""
+    with tempfile.TemporaryDirectory() as tmp:
+        json_dir, xml_dir = os.path.join(tmp, "json"), os.path.join(tmp, "xml")
+        shards = ShardLayout(json_dir, xml_dir, max_files=3)
+        parts = [
+            (part, os.path.relpath(json_sub, json_dir), os.path.relpath(xml_sub, xml_dir))
+            for batch in ("ab", "cdefg")
+            for part, json_sub, xml_sub in shards.split(batch)
+        ]
+        assert parts == [
+            ("ab", "00001", "00001"),
+            ("c", "00001", "00001"),
+            ("def", "00002", "00002"),
+            ("g", "00003", "00003"),
+        ]
+        # a later run continues the last shard
+        os.makedirs(os.path.join(json_dir, "00002"))
+        os.makedirs(os.path.join(xml_dir, "00002"))
+        open(os.path.join(json_dir, "00002", "a.json"), "w").close()
+        open(os.path.join(xml_dir, "00002", "a.xml"), "w").close()
+        shards = ShardLayout(json_dir, xml_dir, max_files=3)
+        assert [os.path.basename(j) for _, j, _ in shards.split("abc")] == ["00002", "00003"]
+        # <teiCorpus> batches: one XML file per part
+        shards = ShardLayout(json_dir, xml_dir, max_files=3)
+        parts = [
+            (part, os.path.basename(j), os.path.basename(x))
+            for part, j, x in shards.split("abcd", corpus=True)
+        ]
+        assert parts == [("ab", "00002", "00002"), ("cd", "00003", "00002")]
+
+
+def test_shard_rollover():
+    """Ein Batch, der nicht mehr in den Unterordner passt, beginnt einen neuen."""
+    shards = ShardAllocator("out", max_files=3)
+    dirs = [os.path.basename(shards.next_dir(files)) for files in (2, 2, 1, 3, 5)]
+    assert dirs == ["00001", "00002", "00002", "00003", "00004"]
+
+
+def test_balance_batches():
+    items = [("a", [1]), ("b", [1] * 10), ("c", [1, 1]), ("d", [1]), ("e", [1, 1, 1])]
+    batches = list(balance_batches(items, 3, cost=len))
+    # largest thread first and alone, small threads packed by cost
+    assert batches[0] == (10, (("b", [1] * 10),))
+    assert [cost for cost, _ in batches] == [10, 3, 3, 1]
+    assert sorted(t for _, batch in batches for t, _ in batch) == ["a", "b", "c", "d", "e"]
+    assert list(balance_batches([], 3, cost=len)) == []
+
+
+def test_worker_utilization():
+    results = [{"pid": 1, "busy": 4.0}, {"pid": 1, "busy": 4.0}, {"pid": 2, "busy": 4.0}]
+    utilization, busiest, mean = worker_utilization(results, 10.0, 2)
+    assert utilization == 0.6
+    assert busiest == 8.0 and mean == 6.0
+
+
+def test_split_thread():
+    comments = [{"body": "abcd"} for _ in range(5)]
+    assert split_thread(comments) == [comments]
+    assert [len(p) for p in split_thread(comments, max_comments=2)] == [2, 2, 1]
+    assert [len(p) for p in split_thread(comments, max_bytes=9)] == [2, 2, 1]
+    # a single comment larger than the limit still makes a part
+    assert [len(p) for p in split_thread(comments, max_bytes=1)] == [1] * 5
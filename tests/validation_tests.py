@@ -1,9 +1,21 @@
+import json
 import os
+import subprocess
+import sys
 
-from io import StringIO
+from io import BytesIO, StringIO
 
-from extractor.json2xml import json2xml
-from extractor.validate import validate
+from lxml import etree
+
+from extractor.comment_processing import CorpusWriter
+from extractor.json2xml import build_tei, json2xml, serialize_tei
+from extractor.validate import (
+    check_document,
+    check_structure,
+    record_validation,
+    validate,
+    validation_rate,
+)
 
 from .xml_conversion_tests import grouped_example, nogroup_example
 
@@ -17,3 +29,97 @@ def test_validation_group(grouped_example):
 
 def test_validation_nogroup(nogroup_example):
     assert validate(StringIO(nogroup_example[1])) is True
+
+
+def test_validation_parts():
+    filename = os.path.join(TEST_DIR, "files/grouped/14u42ly_flat.json")
+    with open(filename, "r", encoding="utf-8") as f:
+        comments = json.load(f)
+
+    headers = []
+    for number, part in enumerate((comments[:1], comments[1:]), 1):
+        teidoc, post_id = build_tei(part, part=(number, 2), last_comment=comments[-1])
+        xml = serialize_tei(teidoc)
+        assert validate(BytesIO(xml)) is True
+        assert f"<extent>part {number} of 2</extent>".encode() in xml
+        headers.append(xml.split(b"<extent>")[0])
+    # shared thread metadata
+    assert headers[0] == headers[1]
+
+
+def test_validation_tree():
+    def comment(comment_id, parent_id):
+        return {
+            "id": comment_id,
+            "parent_id": parent_id,
+            "link_id": "t3_x",
+            "subreddit": "GermanRap",
+            "author": "user",
+            "body": f"comment {comment_id}",
+            "created_utc": 1688823816,
+        }
+
+    # 10k-deep reply chain, an orphan and a sibling
+    chain = [comment("c0", "t3_x")]
+    chain += [comment(f"c{i}", f"t1_c{i - 1}") for i in range(1, 10000)]
+    comments = chain + [comment("orphan", "t1_gone"), comment("sibling", "t1_c0")]
+
+    teidoc, _ = build_tei(comments, tree_structure=True)
+    xml = serialize_tei(teidoc)
+    assert validate(BytesIO(xml)) is True
+    assert xml.count(b"<item ") == len(comments)
+    assert xml.count(b'corresp="https://www.reddit.com/r/GermanRap/comments/x/comment/gone/"') == 1
+
+
+def test_lazy_dtd():
+    """Der DTD wird erst bei der ersten Validierung geladen."""
+    code = (
+        "import extractor.json2xml, extractor.validate as v; "
+        "assert v.load_dtd.cache_info().currsize == 0; "
+        "v.get_dtd(); assert v.load_dtd.cache_info().currsize == 1"
+    )
+    subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(TEST_DIR), check=True)
+
+
+def test_structure_check(grouped_example, nogroup_example):
+    """Die schnelle Prüfung erkennt genau die Strukturen des Generators."""
+    filename = os.path.join(TEST_DIR, "files/grouped/14u42ly_flat.json")
+    with open(filename, "r", encoding="utf-8") as f:
+        comments = json.load(f)
+    corpus = BytesIO()
+    writer = CorpusWriter(None, False, stream=corpus)
+    for comment in comments:
+        writer.add(comment["id"], serialize_tei(build_tei([comment], group_mode=False)[0]), comment)
+    writer.flush()
+
+    documents = [
+        grouped_example[1].encode(),
+        nogroup_example[1].encode(),
+        serialize_tei(build_tei(comments, tree_structure=True)[0]),
+        serialize_tei(build_tei(comments[1:], part=(2, 2), last_comment=comments[-1])[0]),
+        corpus.getvalue(),
+    ]
+    for xml in documents:
+        assert check_document(xml) is None
+        assert check_structure(etree.parse(BytesIO(xml)).getroot()) == []
+
+    xml = documents[0]
+    assert check_document(xml.replace(b"<name>", b"<name>\x01", 1)) == "control character"
+    assert check_document(xml.replace(b"</date> <name>", b"</date> <hi/><name>", 1))
+    assert check_document(xml.replace(b'type="last_comment">2', b'type="last_comment">x', 1))
+    assert check_document(xml.replace(b"<item ", b"<item", 1))
+    assert check_document(b"\xff" + xml) is not None
+    root = etree.parse(BytesIO(xml)).getroot()
+    root.find(".//{*}item").set("n", "1")
+    assert check_structure(root) == ["<list/item>: unexpected attribute n"]
+
+
+def test_validation_rate(tmp_path):
+    """Nach einer Änderung des Generators werden einmal alle Dateien gegen den DTD geprüft."""
+    state = str(tmp_path / "state")
+    assert validation_rate("full", 0.1, state) is None
+    assert validation_rate("fast", 0.1, state) == 1.0
+    record_validation(1.0, 1, state)
+    assert validation_rate("fast", 0.1, state) == 1.0
+    record_validation(1.0, 0, state)
+    assert validation_rate("fast", 0.1, state) == 0.1
@@ -0,0 +1,44 @@
+import os
+
+import pytest
+
+from extractor.utils import directory_state, get_output_dir
+from extractor.workers import create_pool, use_pool
+
+
+def worker_state(_):
+    return os.getpid(), len(directory_state)
+
+
+@pytest.mark.parametrize("start_method", ["fork", "forkserver"])
+def test_pool_reuse(start_method, tmp_path):
+    # the parent's output directories are not inherited by the workers
+    get_output_dir(str(tmp_path))
+    pool = create_pool(2, start_method)
+    try:
+        with use_pool(pool) as workers:
+            assert workers is pool
+            first = workers.map(worker_state, range(4))
+        with use_pool(pool) as workers:
+            second = workers.map(worker_state, range(4))
+        assert all(size == 0 for _, size in first + second)
+        # same long-lived workers for both stages
+        assert len({pid for pid, _ in first + second}) <= 2
+    finally:
+        pool.close()
+        pool.join()
+        directory_state.clear()
+
+
+def dtd_loaded(_):
+    from extractor import validate
+
+    return validate.load_dtd.cache_info().currsize
+
+
+def test_pool_without_dtd():
+    """Ohne vollständige Validierung parsen die Worker die DTD nicht beim Start."""
+    with use_pool(processes=1, start_method="forkserver", preload_dtd=False) as workers:
+        assert workers.map(dtd_loaded, range(2)) == [0, 0]
+    with use_pool(processes=1, start_method="forkserver") as workers:
+        assert workers.map(dtd_loaded, range(2)) == [1, 1]
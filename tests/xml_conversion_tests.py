@@ -150,5 +150,32 @@ def test_pipeline_json2xml():
         xml_output_dir = os.path.join(tmp, "xml")
         assert os.path.exists(xml_output_dir) and os.path.isdir(xml_output_dir)
 
-        xml_file = os.path.join(xml_output_dir, "00001/14t73le.xml")
+        xml_file = os.path.join(xml_output_dir, "00001/14t73le_jr5508f.xml")
         assert os.path.exists(xml_file) and os.path.isfile(xml_file)
+
+
+def test_pipeline_json2xml_recursive():
+    "Testet die Konvertierung von Shard-Verzeichnissen mit gruppierten Dateien und Teilen."
+    filename = os.path.join(TEST_DIR, "files/grouped/14u42ly_flat.json")
+    with open(filename, "r", encoding="utf-8") as inputfile:
+        comments = json.load(inputfile)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        json_dir = os.path.join(tmp, "GermanRap_json_grouped")
+        for shard, name, content in [
+            ("00001", "14u42ly_flat.json", comments),
+            ("00001", "14u42ly_p0001_flat.json", comments[:1]),
+            ("00002", "14u42ly_p0002_flat.json", comments[1:]),
+        ]:
+            os.makedirs(os.path.join(json_dir, shard), exist_ok=True)
+            with open(os.path.join(json_dir, shard, name), "w", encoding="utf-8") as f:
+                json.dump(content, f)
+
+        pipeline_json2xml(json_dir, processes=2, batch_size=1)
+
+        xml_dir = os.path.join(tmp, "GermanRap_xml_grouped", "00001")
+        assert sorted(os.listdir(xml_dir)) == ["14u42ly.xml", "14u42ly_p0001.xml", "14u42ly_p0002.xml"]
+        with open(os.path.join(xml_dir, "14u42ly_p0001.xml"), encoding="utf-8") as f:
+            content = f.read()
+        assert "<extent>part 1 of 2</extent>" in content
+        assert content.count("<item source=") == 1